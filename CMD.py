@@ -103,6 +103,7 @@ def option_parser(args, options, lists, version=0):
     options['SeparateTop']         = options['-sep']
     options['MixedChains']         = False  # options['-mixed']
     options['ElasticNetwork']      = options['-elastic']
+    options['ElasticAverage']      = options['-eavg']
 
     # Parsing of some other options into variables
     options['ElasticMaximumForce'] = options['-ef'].value
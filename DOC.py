@@ -72,6 +72,11 @@ also affect the topology. If secondary structure is determined
 internally, the structure will be averaged over the frames. Likewise,
 interatomic distances, as used for backbone bond lengths in Elnedyn
 and in elastic networks, are also averaged over the frames available.
+A selection of frames can be given with -frames, eg 100::10 for every
+tenth frame from the 100th on, counting from 0. These are read directly
+from the file, using the byte offsets of the frames, which are stored
+in a sidecar index file (the input file name with .idx appended) on the
+first pass and reused for as long as the input file is unchanged.
 
 If an output file (-o) is indicated for the topology, that file will
 be used for the master topology, using #include statements to link the
@@ -160,6 +165,11 @@ can be speficied. If a force field with an intrinsic Elastic
 network is specified (eg. Elnedyn) with -ff, -elastic in implied and
 the default values for the force constant and upper cutoff are used.
 However, these can be overwritten.
+By default the network is set up on the last frame of the input. With
+-eavg the bead distances are averaged over all frames instead, in a
+single pass that keeps one frame in memory at a time. Bonds between
+beads that only come within reach after the first frame are left out,
+with a warning, as their average distance is then not known.
 
 Multiscaling
 ------------
@@ -177,6 +187,7 @@ as argument, causing all chains to be multiscaled.
     ("-f",        Option(str,                      1,     None, "Input file (PDB|GRO)")),
     ("-o",        Option(str,                      1,     None, "Output topology (TOP)")),
     ("-x",        Option(str,                      1,     None, "Output coarse grained structure (PDB)")),
+    ("-frames",   Option(str,                      1,     None, "Frames to use, as start:stop:step (indexes the input file)")),
     ("-n",        Option(str,                      1,     None, "Output index file with CG (and multiscale) beads.")),
     ("-nmap",     Option(str,                      1,     None, "Output index file containing per bead mapping.")),
     ("-v",        Option(bool,                     0,    False, "Verbose. Be load and noisy.")),
@@ -208,6 +219,7 @@ as argument, causing all chains to be multiscaled.
     ("-ep",       Option(float,                    1,        1, "Elastic bond decay power p")),
     ("-em",       Option(float,                    1,        0, "Remove elastic bonds with force constant lower than this")),
     ("-eb",       Option(str,                      1,     'BB', "Comma separated list of bead names for elastic bonds")),
+    ("-eavg",     Option(bool,                     0,    False, "Average elastic bond lengths over all frames")),
 #    ("-hetatm",   Option(bool,                     0,    False, "Include HETATM records from PDB file (Use with care!)")),
     ("-multi",    Option(lists['multi'].append,    1,     None, "Chain to be set up for multiscaling (+)")),
     ]
@@ -1,9 +1,16 @@
 #########################
 ## 7 # ELASTIC NETWORK ##  -> @ELN <-
 #########################
-import math
+import math, logging
 import FUNC
 
+# NumPy is optional: without it the elastic network is set up with the
+# plain pair loop below, which gives the same bonds, only slower.
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
 ## ELASTIC NETWORK ##
 
 # Only the decay function is defined here, the network
@@ -18,7 +25,53 @@ def decayFunction(distance, shift, rate, power):
     return math.exp(-rate*math.pow(distance-shift, power))
 
 
-def rubberBands(atomList, lowerBound, upperBound, decayFactor, decayPower, forceConstant, minimumForce):
+# All pairs (i, j) with j >= i+3 closer than cutoff, found by binning the
+# coordinates on a grid of cells one cutoff wide, so only atoms in the same
+# or neighbouring cells are compared. Coordinates and cutoff in the same
+# units. Returns the index arrays, sorted by i and then j, and the squared
+# distances, summed in the same order as FUNC.distance2.
+def gridPairs(coords, cutoff):
+    x     = numpy.asarray(coords, dtype=float).reshape(-1, 3)
+    n     = len(x)
+    # Widen the cells a hair, so no pair right at the cutoff is missed
+    size  = cutoff*(1+1e-9)
+    cell  = numpy.floor((x - x.min(axis=0))/size).astype(int)
+    ncell = cell.max(axis=0) + 1
+    key   = numpy.ravel_multi_index(cell.T, ncell)
+    order = numpy.argsort(key)
+    skey  = key[order]
+    # The 13 forward neighbour cells plus the own cell cover every pair once
+    offsets = numpy.array([(a, b, c) for a in (-1, 0, 1) for b in (-1, 0, 1)
+                           for c in (-1, 0, 1) if (a, b, c) >= (0, 0, 0)])
+    neigh  = (cell[:, None, :] + offsets[None, :, :]).reshape(-1, 3)
+    owner  = numpy.repeat(numpy.arange(n), len(offsets))
+    own    = numpy.tile(numpy.all(offsets == 0, axis=1), n)
+    inside = numpy.all((neigh >= 0) & (neigh < ncell), axis=1)
+    neigh, owner, own = neigh[inside], owner[inside], own[inside]
+    nkey   = numpy.ravel_multi_index(neigh.T, ncell)
+    start  = numpy.searchsorted(skey, nkey, side='left')
+    count  = numpy.searchsorted(skey, nkey, side='right') - start
+    # Expand the [start, start+count) ranges of the sorted atoms
+    first  = numpy.cumsum(count) - count
+    slots  = numpy.arange(count.sum()) - numpy.repeat(first - start, count)
+    i, j   = numpy.repeat(owner, count), order[slots]
+    own    = numpy.repeat(own, count)
+    # Pairs within a cell are found from both ends, keep one of them
+    keep   = ~own | (i < j)
+    i, j   = numpy.minimum(i[keep], j[keep]), numpy.maximum(i[keep], j[keep])
+    keep   = j >= i + 3
+    i, j   = i[keep], j[keep]
+    # power rather than ** or square, which may round x*x differently from
+    # the libm pow behind FUNC.distance2
+    d      = numpy.power(x[i] - x[j], 2.0)
+    d2     = d[:, 0] + d[:, 1] + d[:, 2]
+    keep   = d2 < cutoff**2
+    i, j, d2 = i[keep], j[keep], d2[keep]
+    s = numpy.argsort(i.astype(numpy.int64)*n + j)
+    return i[s], j[s], d2[s]
+
+
+def rubberBandsLoop(atomList, lowerBound, upperBound, decayFactor, decayPower, forceConstant, minimumForce):
     out = []
     u2  = upperBound**2
     while len(atomList) > 3:
@@ -33,3 +86,104 @@ def rubberBands(atomList, lowerBound, upperBound, decayFactor, decayPower, force
                 if fscl*forceConstant > minimumForce:
                     out.append({"atoms": (bi, bj), "parameters": (dij, "RUBBER_FC*%f" % fscl)})
     return out
+
+
+# Elastic network between all atoms in atomList, a list of (atom id, coordinates
+# in Angstrom), that are at least three apart in the list and closer than
+# upperBound (nm). The pairs are found on a grid and the decay function and
+# force cutoff are applied on arrays; the bonds are the same as those of
+# rubberBandsLoop, in the same order.
+def rubberBands(atomList, lowerBound, upperBound, decayFactor, decayPower, forceConstant, minimumForce):
+    if numpy is None or len(atomList) < 4:
+        return rubberBandsLoop(list(atomList), lowerBound, upperBound, decayFactor,
+                               decayPower, forceConstant, minimumForce)
+    ids      = [bi for bi, xi in atomList]
+    i, j, d2 = gridPairs([xi for bi, xi in atomList], 10*upperBound)
+    # Mind the nm/A conversion, as in rubberBandsLoop
+    d2       = d2/100
+    keep     = d2 < upperBound**2
+    return _bandList(ids, i[keep], j[keep], numpy.sqrt(d2[keep]), lowerBound,
+                     decayFactor, decayPower, forceConstant, minimumForce)
+
+
+# The bonds for the pairs (i, j) of atom ids at distances dij (nm), with the
+# force constant scaled by the decay function and weak bonds dropped.
+def _bandList(ids, i, j, dij, lowerBound, decayFactor, decayPower, forceConstant, minimumForce):
+    shifted  = dij - lowerBound
+    if decayPower != int(decayPower) and numpy.any(shifted < 0):
+        # math.pow would refuse this too
+        raise ValueError("math domain error")
+    fscl     = numpy.exp(-decayFactor*numpy.power(shifted, decayPower))
+    keep     = fscl*forceConstant > minimumForce
+    # One dict per bond, for up to millions of bonds
+    with FUNC.collectorPaused():
+        return [{"atoms": (ids[a], ids[b]), "parameters": (d, "RUBBER_FC*%f" % f)}
+                for a, b, d, f in zip(i[keep].tolist(), j[keep].tolist(),
+                                      dij[keep].tolist(), fscl[keep].tolist())]
+
+
+# Running means of the pair distances (nm) over the frames of a structure, for
+# an elastic network on the average rather than the last frame. Each frame
+# added is searched on a grid for pairs closer than upperBound+skin, and the
+# distances of all pairs found so far are summed, so one pass over the frames
+# and one copy of the coordinates at a time suffice. A pair first found in a
+# later frame was further than upperBound+skin in the frames before, which
+# sets a lower bound to its mean; it is left out of the network, as its
+# length is not known, unless that bound already rules it out (see
+# distances).
+class DistanceAverage:
+    def __init__(self, upperBound, skin=0.3):
+        self.upperBound = upperBound
+        self.cutoff     = upperBound + skin
+        self.frames     = 0
+        self.atoms      = None
+        self.i          = numpy.zeros(0, dtype=int)
+        self.j          = numpy.zeros(0, dtype=int)
+        self.sum        = numpy.zeros(0)
+        self.first      = numpy.zeros(0, dtype=int)
+
+    # Add a frame, a list of coordinates in Angstrom
+    def add(self, coords):
+        x = numpy.asarray(coords, dtype=float).reshape(-1, 3)
+        if self.atoms is None:
+            self.atoms = len(x)
+        elif len(x) != self.atoms:
+            raise ValueError("Frame %d has %d atoms for the elastic network, not %d" %
+                             (self.frames+1, len(x), self.atoms))
+        if len(x) > 3:
+            i, j, d2 = gridPairs(x, 10*self.cutoff)
+            # Pairs seen before are summed below with the rest
+            key  = i.astype(numpy.int64)*self.atoms + j
+            new  = ~numpy.in1d(key, self.i.astype(numpy.int64)*self.atoms + self.j)
+            i, j = numpy.concatenate((self.i, i[new])), numpy.concatenate((self.j, j[new]))
+            s    = numpy.argsort(i.astype(numpy.int64)*self.atoms + j, kind='mergesort')
+            self.i, self.j = i[s], j[s]
+            self.sum   = numpy.concatenate((self.sum, numpy.zeros(new.sum())))[s]
+            self.first = numpy.concatenate((self.first, numpy.repeat(self.frames, new.sum())))[s]
+            # Summed as in gridPairs, and in nm as in rubberBands
+            d = numpy.power(x[self.i] - x[self.j], 2.0)
+            self.sum += numpy.sqrt((d[:, 0] + d[:, 1] + d[:, 2])/100)
+        self.frames += 1
+
+    # The pairs (i, j) of atoms, as indices into the frames, with a mean
+    # distance below upperBound, and that mean. Returns the arrays, sorted
+    # by i and then j, and the number of pairs left out because they were
+    # missed in early frames, while the lower bound to their mean is below
+    # upperBound.
+    def distances(self):
+        bound = (self.sum + self.first*self.cutoff)/max(self.frames, 1)
+        keep  = bound < self.upperBound
+        late  = keep & (self.first > 0)
+        keep &= ~late
+        return self.i[keep], self.j[keep], bound[keep], int(numpy.sum(late))
+
+
+# Elastic network as in rubberBands, on the pair distances averaged over the
+# frames in a DistanceAverage. ids are the atom ids for the coordinates added.
+def rubberBandsAveraged(ids, average, lowerBound, decayFactor, decayPower, forceConstant, minimumForce):
+    i, j, dij, dropped = average.distances()
+    if dropped:
+        logging.warning("Left out %d elastic bonds between beads that only came within %.2f nm "
+                        "after the first frame." % (dropped, average.cutoff))
+    return _bandList(list(ids), i, j, dij, lowerBound, decayFactor, decayPower,
+                     forceConstant, minimumForce)
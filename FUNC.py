@@ -2,7 +2,7 @@
 ## 3 # HELPER FUNCTIONS, CLASSES AND SHORTCUTS ##  -> @FUNC <-
 #################################################
 
-import math
+import math, gc, contextlib
 
 #----+------------------+
 ## A | STRING FUNCTIONS |
@@ -62,3 +62,21 @@ def norm(a):
 
 def distance2(a, b):
     return (a[0]-b[0])**2+(a[1]-b[1])**2+(a[2]-b[2])**2
+
+
+#----+-----------------+
+## C | OTHER UTILITIES |
+#----+-----------------+
+
+
+# Pause the cyclic garbage collector while building many small containers
+# that cannot form cycles, restoring its previous state afterwards
+@contextlib.contextmanager
+def collectorPaused():
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if enabled:
+            gc.enable()
@@ -1,9 +1,81 @@
 #######################
 ## 8 # STRUCTURE I/O ##  -> @IO <-
 #######################
-import logging, math, random, sys
+import logging, math, random, sys, itertools, os, mmap, io
 import MAP, SS, FUNC
 
+# Without NumPy, frames are read one atom line at a time (pdbAtom, groAtom).
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+# Frames can be read into structured arrays, one record per atom, with the
+# fields of the atom tuples of pdbAtom and groAtom. A blank chain is ''.
+if numpy is not None:
+    frameFields = numpy.dtype([("name", "S5"), ("resname", "S5"), ("resid", int),
+                               ("chain", "S1"), ("xyz", float, 3)])
+
+
+# The numbers in a fixed width column, given as an array of character codes
+# with one row per character position and one column per line, or None if
+# any of them is not plainly written: blanks, an optional minus sign, and
+# digits with at most one point (none for integers), with at least one
+# digit and no blanks in between. The digits are summed up as an integer,
+# which is divided by the power of ten of the decimals: both are exact, so
+# this gives the same, correctly rounded, value as float() would.
+def fixedNumbers(chars, integer=False):
+    digit    = (chars >= 48) & (chars <= 57)
+    point    = chars == 46
+    minus    = chars == 45
+    filled   = ~((chars == 32) | (chars == 0))
+    if not numpy.all(digit | point | minus | ~filled):
+        return None
+    lines    = numpy.arange(chars.shape[1])
+    first    = numpy.argmax(filled, axis=0)
+    last     = len(chars) - 1 - numpy.argmax(filled[::-1], axis=0)
+    if not (numpy.all(digit.any(axis=0)) and
+            numpy.all(filled.sum(axis=0) == last - first + 1) and
+            numpy.all(point.sum(axis=0) <= (not integer)) and
+            numpy.all(minus.sum(axis=0) == minus[first, lines])):
+        return None
+    value    = numpy.zeros(chars.shape[1], dtype=numpy.int64)
+    decimals = numpy.zeros(chars.shape[1], dtype=int)
+    after    = numpy.zeros(chars.shape[1], dtype=bool)
+    for k in range(len(chars)):
+        value     = numpy.where(digit[k], 10*value + (chars[k] - 48), value)
+        decimals += digit[k] & after
+        after    |= point[k]
+    if integer:
+        return numpy.where(minus[first, lines], -value, value)
+    sign     = numpy.where(minus[first, lines], -1.0, 1.0)
+    # The sign goes last, so that -0.000 stays negative, as with float()
+    return value/numpy.power(10.0, decimals)*sign
+
+
+# The atom lines as an array of strings of the given width, and the
+# character codes of those, with one row per character position.
+def fixedLines(lines, width):
+    chars = numpy.array(lines, dtype="S%d" % width)
+    return chars, chars.view(numpy.uint8).reshape(len(lines), width).T.copy()
+
+
+# The text in columns i to j of the lines, stripped.
+def fixedStrings(codes, i, j):
+    return numpy.char.strip(codes[i:j].T.copy().view("S%d" % (j-i)).ravel())
+
+
+# The numbers in columns i to j of the lines, of type kind (float or int),
+# by fixedNumbers if possible.
+def fixedValues(chars, codes, i, j, kind=float):
+    column = fixedNumbers(codes[i:j], kind is int)
+    if column is None:
+        # Let the conversion read, or complain about, whatever is in there
+        column = numpy.array([kind(a[i:j]) for a in chars.tolist()], dtype=kind)
+    return column
+
+
 #----+---------+
 ## A | PDB I/O |
 #----+---------+
@@ -78,9 +150,32 @@ def pdbBoxRead(a):
     return [0.1*fa, 0, 0, 0.1*fb*cg, 0.1*fb*sg, 0, wx, wy, wz]
 
 
+# All ATOM/HETATM lines of a PDB model at once, as an array with frameFields,
+# with the insertion code shifted into the resid as in pdbAtom, and the
+# coordinates (Angstrom) read a column at a time as in groFrame.
+def pdbFrame(lines):
+    chars, codes     = fixedLines(lines, 54)
+    frame            = numpy.zeros(len(lines), dtype=frameFields)
+    frame["name"]    = fixedStrings(codes, 12, 16)
+    frame["resname"] = fixedStrings(codes, 17, 20)
+    frame["chain"]   = fixedStrings(codes, 21, 22)
+    frame["resid"]   = fixedValues(chars, codes, 22, 26, int) + (codes[26].astype(int) << 20)
+    for k, i in enumerate((30, 38, 46)):
+        frame["xyz"][:, k] = fixedValues(chars, codes, i, i+8)
+    return frame
+
+
 # Function for splitting a PDB file in chains, based
 # on chain identifiers and TER statements
 def pdbChains(pdbAtomList):
+    if hasattr(pdbAtomList, "dtype"):
+        # A frame from pdbFrame, which has no TER records, is
+        # split wherever the chain identifier changes
+        new = numpy.flatnonzero(pdbAtomList["chain"][1:] != pdbAtomList["chain"][:-1]) + 1
+        for i, j in zip([0] + new.tolist(), new.tolist() + [len(pdbAtomList)]):
+            if j > i:
+                yield pdbAtomList[i:j]
+        return
     chain = []
     for atom in pdbAtomList:
         if not atom:  # Was a "TER" statement
@@ -101,19 +196,25 @@ def pdbChains(pdbAtomList):
 
 # Simple PDB iterator
 def pdbFrameIterator(streamIterator):
+    if numpy is None:
+        readAtom, readAll = pdbAtom, list
+    else:
+        # Gather the atom lines of each model and read them at once
+        readAtom, readAll = str, pdbFrame
     title, atoms, box = [], [], []
     for i in streamIterator:
-        if i.startswith("ENDMDL"):
-            yield "".join(title), atoms, box
+        # Atoms first, as most lines are
+        if i.startswith("ATOM") or i.startswith("HETATM"):
+            atoms.append(readAtom(i))
+        elif i.startswith("ENDMDL"):
+            yield "".join(title), readAll(atoms), box
             title, atoms, box = [], [], []
         elif i.startswith("TITLE"):
             title.append(i)
         elif i.startswith("CRYST1"):
             box = pdbBoxRead(i)
-        elif i.startswith("ATOM") or i.startswith("HETATM"):
-            atoms.append(pdbAtom(i))
     if atoms:
-        yield "".join(title), atoms, box
+        yield "".join(title), readAll(atoms), box
 
 
 #----+---------+
@@ -141,6 +242,21 @@ def groAtom(a):
             10*float(a[20:28]), 10*float(a[28:36]), 10*float(a[36:44]))
 
 
+# All atom lines of a GRO frame at once, as an array with frameFields, with
+# the same constant added to the resid and the coordinates in Angstrom, as
+# in groAtom. The lines are cut into fixed width columns on an array of
+# characters, and the numbers are read a column at a time.
+def groFrame(lines):
+    chars, codes     = fixedLines(lines, 44)
+    frame            = numpy.zeros(len(lines), dtype=frameFields)
+    frame["name"]    = fixedStrings(codes, 10, 15)
+    frame["resname"] = fixedStrings(codes, 5, 10)
+    frame["resid"]   = fixedValues(chars, codes, 0, 5, int) + (32 << 20)
+    for k, i in enumerate((20, 28, 36)):
+        frame["xyz"][:, k] = 10*fixedValues(chars, codes, i, i+8)
+    return frame
+
+
 # Simple GRO iterator
 def groFrameIterator(streamIterator):
     while True:
@@ -152,7 +268,10 @@ def groFrameIterator(streamIterator):
         if not natoms:
             break
         natoms = int(natoms)
-        atoms  = [groAtom(streamIterator.next()) for i in range(natoms)]
+        if numpy is None:
+            atoms = [groAtom(streamIterator.next()) for i in range(natoms)]
+        else:
+            atoms = groFrame(list(itertools.islice(streamIterator, natoms)))
         box    = groBoxRead(streamIterator.next())
         yield title, atoms, box
 
@@ -217,6 +336,160 @@ def streamTag(stream):
         yield i
 
 
+# A frame index holds the byte offsets at which the frames of a structure
+# file start, plus the size of the file, so that frame k can be read from
+# the file directly, without going through the frames before it. The index
+# is built with a single scan over the memory mapped file, and stored next
+# to it in a sidecar file, which is used for as long as the size and the
+# modification time of the file are those it was built for.
+def frameIndexName(filename):
+    return filename + ".idx"
+
+
+# Start of the first line at or after the start of a line pos that begins
+# with tag, or -1.
+def lineWith(mm, tag, pos):
+    if mm[pos:pos+len(tag)] == tag:
+        return pos
+    hit = mm.find("\n"+tag, pos)
+    return hit < 0 and -1 or hit+1
+
+
+# The start of the line count lines on from pos in a memory mapped file,
+# or -1 if the file ends before. A last line without a newline counts. The
+# file is read in blocks sized to the lines wanted: newlines are counted a
+# block at a time, and only located in the last one, so memory use stays
+# that of a block, however long the file.
+def skipLines(mm, pos, count):
+    size  = len(mm)
+    block = min(100*count + 4096, 1 << 24)
+    while count > 0 and pos < size:
+        chunk = mm[pos:pos+block]
+        found = chunk.count("\n")
+        if found < count:
+            count -= found
+            pos   += len(chunk)
+            continue
+        if numpy is not None:
+            newlines = numpy.flatnonzero(numpy.frombuffer(chunk, dtype=numpy.uint8) == 10)
+            return pos + int(newlines[count-1]) + 1
+        end = -1
+        for i in range(count):
+            end = chunk.find("\n", end+1)
+        return pos + end + 1
+    if count == 0:
+        return pos
+    if count == 1 and size and mm[size-1] != "\n":
+        return size
+    return -1
+
+
+# Frame offsets in a memory mapped file, with the end of the last frame
+# last. A GRO frame is the title line, the atom count, the atoms and the
+# box, so the next frame starts natoms+1 lines after the atom count. A PDB
+# frame runs up to and including an ENDMDL line, as for pdbFrameIterator,
+# with one more frame after the last ENDMDL if there are atoms there.
+def frameOffsets(mm, fileType):
+    size    = len(mm)
+    offsets = [0]
+    if fileType == "GRO":
+        pos = 0
+        while pos < size:
+            start = skipLines(mm, pos, 1)
+            end   = start >= 0 and skipLines(mm, start, 1) or -1
+            if end < 0:
+                break
+            natoms = mm[start:end].strip()
+            if not natoms:
+                break
+            # A frame cut short is not read by groFrameIterator either
+            pos = skipLines(mm, end, int(natoms) + 1)
+            if pos < 0:
+                break
+            offsets.append(pos)
+    else:
+        pos = lineWith(mm, "ENDMDL", 0)
+        while pos >= 0:
+            end = mm.find("\n", pos)
+            end = end < 0 and size or end+1
+            offsets.append(end)
+            pos = end < size and lineWith(mm, "ENDMDL", end) or -1
+        last = offsets[-1]
+        if last < size and (lineWith(mm, "ATOM", last) >= 0 or lineWith(mm, "HETATM", last) >= 0):
+            offsets.append(size)
+    return offsets
+
+
+# Scan a structure file for its frames, and store the index in the sidecar
+# file if possible. Returns the file type and the offsets.
+def buildFrameIndex(filename):
+    stream = open(filename, "rb")
+    head   = [stream.readline(), stream.readline()]
+    fileType = head[-1].strip().isdigit() and "GRO" or "PDB"
+    stream.seek(0, 2)
+    if stream.tell() == 0:
+        offsets = [0]
+    else:
+        mm = mmap.mmap(stream.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            offsets = frameOffsets(mm, fileType)
+        finally:
+            mm.close()
+    stream.close()
+    stat = os.stat(filename)
+    try:
+        index = open(frameIndexName(filename), "w")
+        index.write("%s %d %r\n" % (fileType, stat.st_size, stat.st_mtime))
+        index.write("".join(["%d\n" % i for i in offsets]))
+        index.close()
+    except IOError:
+        logging.warning("Could not write frame index %s." % frameIndexName(filename))
+    return fileType, offsets
+
+
+# The index of a structure file, from its sidecar file if that is up to
+# date, or else from a new scan.
+def frameIndex(filename):
+    stat = os.stat(filename)
+    try:
+        index = open(frameIndexName(filename))
+        fileType, size, mtime = index.readline().split()
+        if int(size) == stat.st_size and float(mtime) == stat.st_mtime:
+            offsets = [int(i) for i in index]
+            index.close()
+            return fileType, offsets
+        index.close()
+    except (IOError, ValueError):
+        pass
+    logging.info("Indexing frames of %s." % filename)
+    return buildFrameIndex(filename)
+
+
+# Read frame k of a structure file, as (title, atoms, box) from the frame
+# iterators, using the frame index.
+def readFrame(filename, k, index=None):
+    fileType, offsets = index or frameIndex(filename)
+    if not -len(offsets) < k < len(offsets)-1:
+        raise IndexError("Frame %d is not in %s, which has %d frames" % (k, filename, len(offsets)-1))
+    k = k % (len(offsets)-1)
+    stream = open(filename, "rb")
+    stream.seek(offsets[k])
+    text   = stream.read(offsets[k+1]-offsets[k])
+    stream.close()
+    frameIterator = fileType == "GRO" and groFrameIterator or pdbFrameIterator
+    return frameIterator(io.BytesIO(text)).next()
+
+
+# Iterate over a selection of frames of a structure file, given as a
+# string start:stop:step, with the meaning of a Python slice.
+def indexedFrames(filename, selection):
+    index  = frameIndex(filename)
+    frames = range(len(index[1])-1)
+    parts  = [int(i) if i.strip() else None for i in selection.split(":")]
+    for k in frames[slice(*parts)]:
+        yield readFrame(filename, k, index)
+
+
 #----+-----------------+
 ## D | STRUCTURE STUFF |
 #----+-----------------+
@@ -242,7 +515,14 @@ class Residue(list):
             return [i for i in self if i[0] == tag[0]]  # Return exact matches only
 
 
+# Lists of atoms per residue. The atoms can also be a frame from groFrame or
+# pdbFrame (or a chain of one from pdbChains), which is split on the arrays,
+# and only turned into atom tuples in bulk.
 def residues(atomList):
+    if hasattr(atomList, "dtype"):
+        for residue in frameResidues(atomList):
+            yield residue
+        return
     residue = [atomList[0]]
     for atom in atomList[1:]:
         if (atom[1] == residue[-1][1] and  # Residue name check
@@ -255,6 +535,25 @@ def residues(atomList):
     yield Residue(residue)
 
 
+def frameResidues(frame):
+    n     = len(frame)
+    if not n:
+        return
+    # A new residue starts wherever the residue name, id or chain changes
+    new   = ((frame["resname"][1:] != frame["resname"][:-1]) |
+             (frame["resid"][1:] != frame["resid"][:-1]) |
+             (frame["chain"][1:] != frame["chain"][:-1]))
+    start = [0] + (numpy.flatnonzero(new) + 1).tolist()
+    # One tuple per atom
+    with FUNC.collectorPaused():
+        chain = [c or None for c in frame["chain"].tolist()]
+        atoms = zip(frame["name"].tolist(), frame["resname"].tolist(), frame["resid"].tolist(),
+                    chain, *frame["xyz"].T.tolist())
+        residuelist = [Residue(atoms[i:j]) for i, j in zip(start, start[1:] + [n])]
+    for residue in residuelist:
+        yield residue
+
+
 def residueDistance2(r1, r2):
     return min([FUNC.distance2(i, j) for i in r1 for j in r2])
 
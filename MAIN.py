@@ -19,6 +19,16 @@ def main(options):
     else:
         frameIterator = IO.pdbFrameIterator
 
+    # A selection of frames is read straight from the file, through
+    # an index of the frame offsets
+    if options["-frames"].value and not options["-f"].value:
+        logging.error("Frames can only be selected (-frames) from an input file (-f), not from stdin.")
+        sys.exit(1)
+    if options["-frames"].value:
+        frames = IO.indexedFrames(options["-f"].value, options["-frames"].value)
+    else:
+        frames = frameIterator(inStream)
+
     # ITERATE OVER FRAMES IN STRUCTURE FILE #
 
     # Now iterate over the frames in the stream
@@ -27,7 +37,10 @@ def main(options):
     cgOutPDB  = None
     ssTotal   = []
     cysteines = []
-    for title, atoms, box in frameIterator(inStream):
+    elastic   = None
+    if options['ElasticNetwork'] and options['ElasticAverage'] and ELN.numpy is None:
+        logging.warning("Averaging the elastic network over frames requires NumPy; the last frame is used.")
+    for title, atoms, box in frames:
 
         if fileType == "PDB":
             # The PDB file can have chains, in which case we list and process them specifically
@@ -186,6 +199,15 @@ def main(options):
                     logging.warning("No mapping for coarse graining chain %s (%s); chain is skipped." % (ci.id, ci.type()))
             cgOutPDB.write("ENDMDL\n")
 
+        # Sum the distances between the elastic beads of each molecule,
+        # to set up the elastic network on their averages over the frames
+        if options['ElasticNetwork'] and options['ElasticAverage'] and ELN.numpy is not None:
+            if elastic is None:
+                elastic = [ELN.DistanceAverage(options['ElasticUpperBound']) for group in merge]
+            for average, group in zip(elastic, merge):
+                average.add([bead[4:7] for c in group for bead in chains[c].cg(force=True)
+                             if bead[0] in options['ElasticBeads']])
+
         # Gather cysteine sulphur coordinates
         cyslist = [cys["SG"] for chain in chains for cys in chain["CYS"]]
         cysteines.append([cys for cys in cyslist if cys])
@@ -384,11 +406,19 @@ def main(options):
                 # coordinates for the merged chains are available.
                 if options['ElasticNetwork']:
                     rubberType = options['ForceField'].EBondType
-                    rubberList = ELN.rubberBands(
-                        [(i[0], j) for i, j in zip(top.atoms, coords) if i[4] in options['ElasticBeads']],
-                        options['ElasticLowerBound'], options['ElasticUpperBound'],
-                        options['ElasticDecayFactor'], options['ElasticDecayPower'],
-                        options['ElasticMaximumForce'], options['ElasticMinimumForce'])
+                    if elastic:
+                        # Distances averaged over all frames
+                        rubberList = ELN.rubberBandsAveraged(
+                            [i[0] for i in top.atoms if i[4] in options['ElasticBeads']], elastic[mi],
+                            options['ElasticLowerBound'],
+                            options['ElasticDecayFactor'], options['ElasticDecayPower'],
+                            options['ElasticMaximumForce'], options['ElasticMinimumForce'])
+                    else:
+                        rubberList = ELN.rubberBands(
+                            [(i[0], j) for i, j in zip(top.atoms, coords) if i[4] in options['ElasticBeads']],
+                            options['ElasticLowerBound'], options['ElasticUpperBound'],
+                            options['ElasticDecayFactor'], options['ElasticDecayPower'],
+                            options['ElasticMaximumForce'], options['ElasticMinimumForce'])
                     top.bonds.extend([TOP.Bond(i, options=options, type=rubberType, category="Rubber band") for i in rubberList])
 
                 # Write out the MoleculeType topology
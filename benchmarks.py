@@ -0,0 +1,258 @@
+# -*- coding: utf-8 -*-
+"""
+Timings for the pieces of createMartiniModel that have to scale to large
+systems.  Run as
+
+python benchmarks.py
+
+and each benchmark prints one line per system size.
+"""
+from __future__ import absolute_import, division, print_function
+import os,time,tempfile,shutil
+import numpy as np
+from createMartiniModel import DXXXTopology,PeptideTopology,AtomTable,Gro,Itp
+from nonbonded import NonbondedModel,loadNonbonded
+from insertMolecules import insertMolecules,writeBox
+
+def benchmarkPeptideTopology(lengths=(10,100,1000,5000),residue='PHE',
+                             itpname='DFAG.itp',groname='DFAG.gro'):
+    """
+    Time building DX_n-OPV3-X_nD topologies directly from their sequence
+    
+    ----------
+    Parameters
+    ----------
+    lengths: list of ints
+        numbers of residues n in each arm, not counting the terminal PAS
+    residue: string
+        the residue repeated along both arms
+    itpname: string
+        location of the template topology file
+    groname: string
+        location of the template coordinate file
+        
+    -------
+    Returns
+    -------
+    timings: list of (n,number of beads,seconds)
+    """
+    template = DXXXTopology(itpname,groname)
+    timings = []
+    for n in lengths:
+        t0 = time.time()
+        Top = PeptideTopology(['PAS'] + [residue] * n,[residue] * n + ['PAS'],
+                              template=template)
+        t1 = time.time()
+        timings.append((n,len(Top.atomlist),t1-t0))
+        print('PeptideTopology: {} residues per arm, {} beads, {:.3f} s'.format(
+              n,len(Top.atomlist),t1-t0))
+    return timings
+
+def lineByLineGroWrite(gro,filename):
+    """
+    Reference gro writer that formats and writes one bead at a time, as
+    Gro.write used to
+    """
+    fid = open(filename,'w')
+    fid.write(gro.title+'\n')
+    fid.write(str(gro.atomno)+'\n')
+    bformat = "%5d%-5s%5s%5d%8.3f%8.3f%8.3f%8.4f%8.4f%8.4f"
+    for bead in gro.atoms:
+        beadline = bformat % (bead.resNo,bead.resname,bead.name,
+                              bead.number,bead.pos[0],bead.pos[1],
+                              bead.pos[2],bead.vel[0],bead.vel[1],
+                              bead.vel[2])
+        fid.write(beadline+'\n')
+    fid.write('{0} {1} {2}\n'.format(gro.box[0],gro.box[1],gro.box[2]))
+    fid.close()
+
+def lineByLineItpWrite(itp,fname):
+    """
+    Reference itp writer that calls str() on every Bead and bonded term, 
+    as Itp.write used to
+    """
+    fid = open(fname,'w')
+    fid.write('; MARTINI (martini22) Coarse Grained topology file for \
+                  "Protein"\n')
+    fid.write('; written by createMartiniModel for ' + itp.chemName+\
+              ' chemistry\n')
+    fid.write('\n')
+    fid.write('[ moleculetype ]\n')
+    fid.write('; Name         Exclusions\n')
+    fid.write('{0}\t\t{1}\n\n'.format(itp.moltype[0],itp.moltype[1]))
+    fid.write('[ atoms ]\n')
+    for atom in itp.atomlist:
+        fid.write(str(atom))
+    for (header,blist) in [('[ bonds ]\n',itp.bondlist),
+                           ('[ constraints ]\n',itp.conlist),
+                           ('[ angles ]\n',itp.anglist),
+                           ('[ dihedrals ]\n',itp.dihlist)]:
+        fid.write('\n')
+        fid.write(header)
+        for entry in blist:
+            fid.write(str(entry))
+    fid.write('\n')
+    fid.close()
+
+def benchmarkWriters(natoms=100000,itpname='DFAG.itp',groname='DFAG.gro'):
+    """
+    Compare the bulk Gro and Itp writers with line-by-line writing
+    
+    ----------
+    Parameters
+    ----------
+    natoms: int
+        rough number of beads to write.  The gro file is a box of copies of
+        the template and the itp file a single long peptide.
+    itpname: string
+        location of the template topology file
+    groname: string
+        location of the template coordinate file
+        
+    -------
+    Returns
+    -------
+    timings: dict
+        (writer,'bulk' or 'lines') -> seconds
+    """
+    template = DXXXTopology(itpname,groname)
+    molecule = template.atomTable()
+    ncopies = max(1,natoms // len(molecule))
+    copies = []
+    for i in range(ncopies):
+        copy = molecule.copy()
+        copy.pos += 3. * np.array([i % 30,(i // 30) % 30,i // 900])
+        copies.append(copy)
+    box = AtomTable.concatenate(copies)
+    narm = max(1,(natoms - 13) // 8)
+    peptide = PeptideTopology(['PAS'] + ['PHE'] * narm,
+                              ['PHE'] * narm + ['PAS'],template=template)
+    itp = Itp(peptide.chemName,peptide.moltype,peptide.atomTable(),
+              peptide.bondlist,peptide.conlist,peptide.anglist,
+              peptide.dihlist)
+    tmpdir = tempfile.mkdtemp()
+    timings = {}
+    try:
+        gro = Gro('box',len(box),box,[90.,90.,90.])
+        t0 = time.time()
+        gro.write(os.path.join(tmpdir,'bulk.gro'))
+        timings[('gro','bulk')] = time.time() - t0
+        gro.atoms = [box.bead(ind) for ind in range(len(box))]
+        t0 = time.time()
+        lineByLineGroWrite(gro,os.path.join(tmpdir,'lines.gro'))
+        timings[('gro','lines')] = time.time() - t0
+        t0 = time.time()
+        itp.write(os.path.join(tmpdir,'bulk.itp'))
+        timings[('itp','bulk')] = time.time() - t0
+        itp.atomlist = peptide.atomlist
+        t0 = time.time()
+        lineByLineItpWrite(itp,os.path.join(tmpdir,'lines.itp'))
+        timings[('itp','lines')] = time.time() - t0
+        for suffix in ['.gro','.itp']:
+            same = open(os.path.join(tmpdir,'bulk'+suffix)).read() == \
+                   open(os.path.join(tmpdir,'lines'+suffix)).read()
+            if not same:
+                print('WARNING: bulk and line-by-line {} files differ'.format(
+                      suffix))
+    finally:
+        shutil.rmtree(tmpdir)
+    print('Gro: {} beads, bulk {:.3f} s, line by line {:.3f} s'.format(
+          len(box),timings[('gro','bulk')],timings[('gro','lines')]))
+    print('Itp: {} beads, bulk {:.3f} s, line by line {:.3f} s'.format(
+          len(peptide.atomlist),timings[('itp','bulk')],
+          timings[('itp','lines')]))
+    return timings
+
+def benchmarkDimerScreening(nplacements=(100,1000,10000),itpname='DFAG.itp',
+                            groname='DFAG.gro',ffname='martini.itp',seed=0):
+    """
+    Time scoring random placements of a second copy of the template against
+    the first with NonbondedModel
+    
+    ----------
+    Parameters
+    ----------
+    nplacements: list of ints
+        numbers of placements scored in one call
+    itpname: string
+        location of the template topology file
+    groname: string
+        location of the template coordinate file
+    ffname: string
+        location of the force field file
+    seed: int
+        seed of the random placements
+        
+    -------
+    Returns
+    -------
+    timings: list of (number of placements,seconds)
+    """
+    Top = DXXXTopology(itpname,groname)
+    model = NonbondedModel(Top,nb=loadNonbonded(ffname))
+    pos = Top.positions() - Top.centroid()
+    random = np.random.RandomState(seed)
+    timings = []
+    for n in nplacements:
+        rotations = np.array([np.linalg.qr(random.randn(3,3))[0] 
+                              for k in range(n)])
+        shifts = random.randn(n,3)
+        shifts *= (0.5 + 1.5 * random.rand(n,1)) / \
+                  np.sqrt(np.sum(shifts**2,axis=1))[:,None]
+        placements = np.einsum('kab,nb->kna',rotations,pos) + \
+                     shifts[:,None,:]
+        t0 = time.time()
+        model.scorePlacements(pos,placements)
+        t1 = time.time()
+        timings.append((n,t1-t0))
+        print('NonbondedModel: {} dimer placements, {:.3f} s, {:.0f} per s'\
+              .format(n,t1-t0,n/(t1-t0)))
+    return timings
+
+def benchmarkBoxBuilding(natoms=(10000,100000),density=1.6,
+                         itpname='DFAG.itp',groname='DFAG.gro'):
+    """
+    Time filling boxes with copies of the template and writing them out
+    
+    ----------
+    Parameters
+    ----------
+    natoms: list of ints
+        rough numbers of beads in each box
+    density: float
+        beads per nm^3, which sets the box size
+    itpname: string
+        location of the template topology file
+    groname: string
+        location of the template coordinate file
+        
+    -------
+    Returns
+    -------
+    timings: list of (number of beads,insertion seconds,writing seconds)
+    """
+    Top = DXXXTopology(itpname,groname)
+    tmpdir = tempfile.mkdtemp()
+    timings = []
+    try:
+        for n in natoms:
+            nmol = max(1,n // len(Top.atomlist))
+            box = [(nmol * len(Top.atomlist) / density) ** (1. / 3.)] * 3
+            t0 = time.time()
+            positions = insertMolecules(Top,nmol,box)
+            t1 = time.time()
+            writeBox(Top,positions,box,os.path.join(tmpdir,'box'))
+            t2 = time.time()
+            timings.append((positions.size // 3,t1-t0,t2-t1))
+            print('insertMolecules: {} beads in a {:.1f} nm box, inserted in '
+                  '{:.3f} s, written in {:.3f} s'.format(positions.size // 3,
+                  box[0],t1-t0,t2-t1))
+    finally:
+        shutil.rmtree(tmpdir)
+    return timings
+
+if __name__ == "__main__":
+    benchmarkPeptideTopology()
+    benchmarkWriters()
+    benchmarkDimerScreening()
+    benchmarkBoxBuilding()
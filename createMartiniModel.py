@@ -6,11 +6,52 @@ Created on Thu Feb 22 09:30:04 2018
 """
 from __future__ import absolute_import, division, print_function
 import argparse,numpy as np
-import pdb
+import pdb,os,sys,time,copy,itertools,multiprocessing,hashlib
+import collections,shutil
+import io,gzip,tarfile,zipfile
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+try:
+    import lzma
+except ImportError:
+    try:
+        from backports import lzma
+    except ImportError:
+        lzma = None
 from martini22_ff import martini22
 from warnings import warn
 
-class Bead:
+def _beadField(field):
+    """
+    Make a Bead attribute that lives in the bead itself until the bead is
+    attached to an AtomTable, and in the matching column of the table after
+    
+    ----------
+    Parameters
+    ----------
+    field: string
+        name of the attribute and of the AtomTable column
+    
+    -------
+    Returns
+    -------
+    prop: property
+    """
+    private = '_' + field
+    def get(self):
+        if self._table is None:
+            return self.__dict__[private]
+        return getattr(self._table,field)[self._index]
+    def set(self,value):
+        if self._table is None:
+            self.__dict__[private] = value
+        else:
+            self._table.setValue(field,self._index,value)
+    return property(get,set)
+
+class Bead(object):
     """
     A class that holds all necessary information about a particular
     atom or bead
@@ -36,18 +77,50 @@ class Bead:
         charge on the bead, by default 0
     structure: string
         secondary structure, by default random coil
+        
+    -----
+    Notes
+    -----
+    Once a bead has been attached to an AtomTable (see Topology.atomTable)
+    it is a view of one row of the table: its attributes read and write the
+    table's columns, and pos and vel are views of rows of its arrays.
     """
+    resNo = _beadField('resNo')
+    resname = _beadField('resname')
+    name = _beadField('name')
+    number = _beadField('number')
+    pos = _beadField('pos')
+    vel = _beadField('vel')
+    btype = _beadField('btype')
+    charge = _beadField('charge')
+    structure = _beadField('structure')
+    
     def __init__(self,resNo,resname,name,number,pos,vel,btype):
+        self._table = None
+        self._index = None
         self.resNo = resNo
         self.resname = resname
         self.name = name
         self.number = number
-        self.pos = pos
-        self.vel = vel
+        self.pos = np.array(pos,dtype=float)
+        self.vel = np.array(vel,dtype=float)
         self.btype = btype
         self.charge = 0.0
         self.structure = 'C'
         
+    def copy(self):
+        """
+        Create an independent copy of this bead, with its own pos and vel
+        arrays, that is not attached to any AtomTable
+        """
+        bead = Bead.__new__(Bead)
+        bead.__dict__ = {'_table':None,'_index':None,'_resNo':self.resNo,
+                         '_resname':self.resname,'_name':self.name,
+                         '_number':self.number,'_pos':self.pos.copy(),
+                         '_vel':self.vel.copy(),'_btype':self.btype,
+                         '_charge':self.charge,'_structure':self.structure}
+        return bead
+        
     def __str__(self):
         """
         Create a string representation as this bead should be written out
@@ -63,7 +136,216 @@ class Bead:
                                                                  self.structure)
         return s
         
-class Bond:
+class AtomTable(object):
+    """
+    Structure-of-arrays storage for the beads of a topology, so that whole
+    molecules can be moved and written without looping over Bead objects
+    
+    ----------
+    Attributes
+    ----------
+    resNo: numpy array of ints, length N
+    resname: numpy array of strings, length N
+    name: numpy array of strings, length N
+    number: numpy array of ints, length N
+    pos: numpy array of floats, N x 3
+    vel: numpy array of floats, N x 3
+    btype: numpy array of strings, length N
+    charge: numpy array of floats, length N
+    structure: numpy array of strings, length N
+    """
+    STRINGS = ['resname','name','btype','structure']
+    
+    def __init__(self,resNo,resname,name,number,pos,vel,btype,charge,
+                 structure):
+        """
+        Initialize the columns, copying the given sequences
+        """
+        self.resNo = np.array(resNo,dtype=int)
+        self.resname = np.array(resname,dtype=str)
+        self.name = np.array(name,dtype=str)
+        self.number = np.array(number,dtype=int)
+        self.pos = np.array(pos,dtype=float).reshape((-1,3))
+        self.vel = np.array(vel,dtype=float).reshape((-1,3))
+        self.btype = np.array(btype,dtype=str)
+        self.charge = np.array(charge,dtype=float)
+        self.structure = np.array(structure,dtype=str)
+    
+    @classmethod
+    def fromBeads(cls,beads,attach=True):
+        """
+        Pack a list of beads into a new table
+        
+        ----------
+        Parameters
+        ----------
+        beads: list of Bead objects
+        attach: bool
+            if True, turn the beads into views of the new table's rows
+            
+        -------
+        Returns
+        -------
+        table: AtomTable
+        """
+        table = cls([b.resNo for b in beads],[b.resname for b in beads],
+                    [b.name for b in beads],[b.number for b in beads],
+                    [b.pos for b in beads],[b.vel for b in beads],
+                    [b.btype for b in beads],[b.charge for b in beads],
+                    [b.structure for b in beads])
+        if attach:
+            table.attach(beads)
+        return table
+    
+    def __len__(self):
+        return len(self.resNo)
+    
+    def attach(self,beads):
+        """
+        Make each bead a view of the matching row of this table, dropping
+        its own copies of the values
+        
+        ----------
+        Parameters
+        ----------
+        beads: list of Bead objects, in row order
+        """
+        for (ind,bead) in enumerate(beads):
+            bead.__dict__ = {'_table':self,'_index':ind}
+    
+    def holds(self,beads):
+        """
+        Check whether a list of beads is exactly the rows of this table, in
+        order
+        
+        ----------
+        Parameters
+        ----------
+        beads: list of Bead objects
+        
+        -------
+        Returns
+        -------
+        holds: bool
+        """
+        if len(beads) != len(self):
+            return False
+        for (ind,bead) in enumerate(beads):
+            if bead._table is not self or bead._index != ind:
+                return False
+        return True
+    
+    def bead(self,ind):
+        """
+        Get a Bead that is a view of one row
+        
+        ----------
+        Parameters
+        ----------
+        ind: int
+            the row
+            
+        -------
+        Returns
+        -------
+        bead: Bead
+        """
+        bead = Bead.__new__(Bead)
+        bead.__dict__ = {'_table':self,'_index':ind}
+        return bead
+    
+    def setValue(self,field,ind,value):
+        """
+        Set one entry of a column, widening string columns when the new 
+        value does not fit
+        
+        ----------
+        Parameters
+        ----------
+        field: string
+            name of the column
+        ind: int
+            the row
+        value: the new value
+        """
+        column = getattr(self,field)
+        if field in self.STRINGS:
+            value = np.array(value,dtype=str)
+            if value.dtype.itemsize > column.dtype.itemsize:
+                column = column.astype(value.dtype)
+                setattr(self,field,column)
+        column[ind] = value
+    
+    @classmethod
+    def concatenate(cls,tables):
+        """
+        Stack several tables into one, as for a box of several molecules.
+        Residues and atoms are renumbered consecutively across the tables.
+        
+        ----------
+        Parameters
+        ----------
+        tables: list of AtomTable objects
+        
+        -------
+        Returns
+        -------
+        table: AtomTable
+        """
+        tables = [table for table in tables if len(table) > 0]
+        if len(tables) == 0:
+            return cls([],[],[],[],[],[],[],[],[])
+        resNos = []
+        offset = 0
+        for table in tables:
+            resNos.append(table.resNo - table.resNo.min() + 1 + offset)
+            offset = resNos[-1].max()
+        natoms = sum([len(table) for table in tables])
+        stack = lambda field: np.concatenate([getattr(table,field) \
+                                              for table in tables])
+        return cls(np.concatenate(resNos),stack('resname'),stack('name'),
+                   np.arange(1,natoms+1),stack('pos'),stack('vel'),
+                   stack('btype'),stack('charge'),stack('structure'))
+    
+    def copy(self):
+        """
+        Create an independent copy of this table
+        
+        -------
+        Returns
+        -------
+        table: AtomTable
+        """
+        return AtomTable(self.resNo,self.resname,self.name,self.number,
+                         self.pos,self.vel,self.btype,self.charge,
+                         self.structure)
+
+#line formats of the gro file and the [ atoms ] section of the itp file
+GROFORMAT = "%5d%-5s%5s%5d%8.3f%8.3f%8.3f%8.4f%8.4f%8.4f\n"
+ITPATOMFORMAT = '{:>5}{:>6}{:>6}{:>6}{:>6}{:>6}{:>8.4}; {}\n'
+
+def asAtomTable(atoms):
+    """
+    Get the columns of a set of beads without attaching them to anything
+    
+    ----------
+    Parameters
+    ----------
+    atoms: list of Bead objects or an AtomTable
+    
+    -------
+    Returns
+    -------
+    table: AtomTable
+    """
+    if isinstance(atoms,AtomTable):
+        return atoms
+    if len(atoms) > 0 and atoms[0]._table is not None and \
+       atoms[0]._table.holds(atoms):
+        return atoms[0]._table
+    return AtomTable.fromBeads(atoms,attach=False)
+
+class Bond(object):
     """
     A class that keeps track of the 2-body interactions for a topology
     (bonds and constraints)
@@ -115,6 +397,29 @@ class Bond:
 
         return s
         
+    def remap(self,beadMap):
+        """
+        Create a copy of this bonded term acting on different beads.  The
+        params list and notes are shared with the original, so they should
+        be replaced rather than modified in place.
+        
+        ----------
+        Parameters
+        ----------
+        beadMap: dict
+            id(old bead) -> new bead, for every bead in ainds
+            
+        -------
+        Returns
+        -------
+        bond: Bond, Angle, or Dihedral
+            same class as this one
+        """
+        bond = self.__class__.__new__(self.__class__)
+        bond.__dict__.update(self.__dict__)
+        bond.ainds = [beadMap[id(a)] for a in self.ainds]
+        return bond
+    
     def contains(self,ind):
         """
         Check whether any of the atoms in the bond has a particular index
@@ -179,6 +484,186 @@ class Dihedral(Angle):
     def __init__(self,ainds,params,notes='',fromCreateNewBonds=False):
         Bond.__init__(self,ainds,params,notes,fromCreateNewBonds)
         
+def writeText(fid,text):
+    """
+    Write a string to a text or binary stream
+    
+    ----------
+    Parameters
+    ----------
+    fid: file-like object
+    text: string
+    """
+    try:
+        fid.write(text)
+    except TypeError:
+        if isinstance(text,bytes):
+            fid.write(text.decode('utf-8'))
+        else:
+            fid.write(text.encode('utf-8'))
+
+def openOutput(fname):
+    """
+    Open a file for writing, compressed if its name ends in .gz or .xz
+    
+    ----------
+    Parameters
+    ----------
+    fname: string
+    
+    -------
+    Returns
+    -------
+    fid: file-like object
+    """
+    if fname.endswith('.gz'):
+        return gzip.open(fname,'wb')
+    if fname.endswith('.xz'):
+        if lzma is None:
+            raise ValueError('xz output needs the lzma module')
+        return lzma.open(fname,'wb')
+    return open(fname,'w')
+
+def writeOutput(target,text):
+    """
+    Write the whole contents of a file to a path or stream.  Streams are
+    left open.
+    
+    ----------
+    Parameters
+    ----------
+    target: string or file-like object
+        a file name (compressed if it ends in .gz or .xz, see openOutput) 
+        or anything with a write method
+    text: string
+    """
+    if hasattr(target,'write'):
+        writeText(target,text)
+    else:
+        fid = openOutput(target)
+        writeText(fid,text)
+        fid.close()
+
+class DirectoryTarget(object):
+    """
+    Output target that writes every file to disk, the default for the 
+    topology writers
+    
+    ----------
+    Attributes
+    ----------
+    directory: string
+        prepended to every file name
+    compression: string
+        None for plain files, or 'gz' or 'xz' to compress every file and
+        append the matching suffix to its name
+    """
+    def __init__(self,directory='',compression=None):
+        if compression not in [None,'gz','xz']:
+            raise ValueError('Unknown compression ' + str(compression))
+        self.directory = directory
+        self.compression = compression
+    
+    def add(self,name,text):
+        """
+        Write one file
+        
+        ----------
+        Parameters
+        ----------
+        name: string
+            file name, relative to the directory
+        text: string
+            the contents
+        """
+        fname = os.path.join(self.directory,name)
+        if self.compression is not None:
+            fname += '.' + self.compression
+        writeOutput(fname,text)
+    
+    def close(self):
+        pass
+
+class MemoryTarget(object):
+    """
+    Output target that keeps every file in memory
+    
+    ----------
+    Attributes
+    ----------
+    files: dict
+        file name -> contents
+    names: list of strings
+        file names in the order they were added
+    """
+    def __init__(self):
+        self.files = {}
+        self.names = []
+    
+    def add(self,name,text):
+        """
+        Store one file, see DirectoryTarget.add
+        """
+        if name not in self.files:
+            self.names.append(name)
+        self.files[name] = text
+    
+    def close(self):
+        pass
+
+class ArchiveTarget(object):
+    """
+    Output target that writes every file as an entry of a single tar or 
+    zip archive
+    
+    ----------
+    Attributes
+    ----------
+    path: string
+        the archive, a zip file if it ends in .zip and otherwise a tar file,
+        compressed if it ends in .gz, .tgz, or .xz
+    """
+    def __init__(self,path):
+        self.path = path
+        if path.endswith('.zip'):
+            self.archive = zipfile.ZipFile(path,'w',zipfile.ZIP_DEFLATED)
+        elif path.endswith('.gz') or path.endswith('.tgz'):
+            self.archive = tarfile.open(path,'w:gz')
+        elif path.endswith('.xz'):
+            try:
+                self.archive = tarfile.open(path,'w:xz')
+            except tarfile.CompressionError:
+                raise ValueError('xz archives need the lzma module')
+        else:
+            self.archive = tarfile.open(path,'w')
+    
+    def add(self,name,text):
+        """
+        Add one file to the archive, see DirectoryTarget.add
+        """
+        name = os.path.normpath(name)
+        if not isinstance(text,bytes):
+            text = text.encode('utf-8')
+        if isinstance(self.archive,zipfile.ZipFile):
+            self.archive.writestr(name,text)
+        else:
+            info = tarfile.TarInfo(name)
+            info.size = len(text)
+            info.mtime = time.time()
+            self.archive.addfile(info,io.BytesIO(text))
+    
+    def close(self):
+        """
+        Finish writing the archive
+        """
+        self.archive.close()
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self,excType,excValue,traceback):
+        self.close()
+
 class Itp:
     """
     A class that holds different parts of the .itp file format ready for 
@@ -191,7 +676,8 @@ class Itp:
         name, exclusions
     chemName: string
         short version of chemistry name (ie DFAG)
-    atomlist: list of beads containing structural information about each atom
+    atomlist: list of beads or an AtomTable containing structural information
+        about each atom
     bondlist: list of bonds containing structural information about each bond
     conlist: list of constraints containing structural information about each 
         one
@@ -219,39 +705,104 @@ class Itp:
         ----------
         Parameters
         ----------
-        fname: string
-            name of file to be written to
-        """
-        fid = open(fname,'w')
-        fid.write('; MARTINI (martini22) Coarse Grained topology file for \
-                  "Protein"\n')
-        fid.write('; written by createMartiniModel for ' + self.chemName+\
-                  ' chemistry\n')
-        fid.write('\n')
-        fid.write('[ moleculetype ]\n')
-        fid.write('; Name         Exclusions\n')
-        fid.write('{0}\t\t{1}\n\n'.format(self.moltype[0],self.moltype[1]))
-        fid.write('[ atoms ]\n')
-        for atom in self.atomlist:
-            fid.write(str(atom))
-        fid.write('\n')
-        fid.write('[ bonds ]\n')
-        for bond in self.bondlist:
-            fid.write(str(bond))
-        fid.write('\n')
-        fid.write('[ constraints ]\n')
-        for constraint in self.conlist:
-            fid.write(str(constraint))
-        fid.write('\n')
-        fid.write('[ angles ]\n')
-        for angle in self.anglist:
-            fid.write(str(angle))
-        fid.write('\n')
-        fid.write('[ dihedrals ]\n')
-        for dih in self.dihlist:
-            fid.write(str(dih))
-        fid.write('\n')
-        fid.close()
+        fname: string or file-like object
+            name of file to be written to (see openOutput), or a stream
+            
+        -----
+        Notes
+        -----
+        Every section is formatted in bulk and the whole file goes out in 
+        a single write
+        """
+        writeOutput(fname,self.text())
+    
+    def text(self):
+        """
+        Format the whole itp file
+        
+        -------
+        Returns
+        -------
+        text: string
+        """
+        table = asAtomTable(self.atomlist)
+        sections = ['; MARTINI (martini22) Coarse Grained topology file for \
+                  "Protein"\n',
+                    '; written by createMartiniModel for ' + self.chemName+\
+                    ' chemistry\n',
+                    '\n',
+                    '[ moleculetype ]\n',
+                    '; Name         Exclusions\n',
+                    '{0}\t\t{1}\n\n'.format(self.moltype[0],self.moltype[1]),
+                    '[ atoms ]\n',
+                    self.atomSection(table),
+                    '\n']
+        for (header,blist) in [('[ bonds ]\n',self.bondlist),
+                               ('[ constraints ]\n',self.conlist),
+                               ('[ angles ]\n',self.anglist),
+                               ('[ dihedrals ]\n',self.dihlist)]:
+            sections += [header,self.bondedSection(blist,table),'\n']
+        return ''.join(sections)
+    
+    def atomSection(self,table):
+        """
+        Format the [ atoms ] lines of every bead at once
+        
+        ----------
+        Parameters
+        ----------
+        table: AtomTable
+        
+        -------
+        Returns
+        -------
+        lines: string
+        """
+        n = len(table)
+        if n == 0:
+            return ''
+        cols = np.empty((n,8),dtype=object)
+        cols[:,0] = table.number
+        cols[:,1] = table.btype
+        cols[:,2] = table.resNo
+        cols[:,3] = table.resname
+        cols[:,4] = table.name
+        cols[:,5] = table.number
+        cols[:,6] = table.charge
+        cols[:,7] = table.structure
+        return (ITPATOMFORMAT*n).format(*cols.ravel().tolist())
+    
+    def bondedSection(self,blist,table):
+        """
+        Format the lines of one list of bonded terms at once
+        
+        ----------
+        Parameters
+        ----------
+        blist: Blist
+        table: AtomTable
+            the beads, used to look up atom numbers of beads that are 
+            views of it
+        
+        -------
+        Returns
+        -------
+        lines: string
+        """
+        numbers = ['\t' + str(number) for number in table.number.tolist()]
+        tails = {}
+        lines = []
+        for entry in blist.entries:
+            key = (id(entry.params),entry.notes)
+            tail = tails.get(key)
+            if tail is None:
+                tail = ''.join(['\t' + str(p) for p in entry.params]) + \
+                       '; ' + str(entry.notes) + '\n'
+                tails[key] = tail
+            head = [numbers[a._index] if a._table is table else \
+                    '\t' + str(a.number) for a in entry.ainds]
+            lines.append(''.join(head) + tail)
+        return ''.join(lines)
     
 
 class Gro:
@@ -272,7 +823,7 @@ class Gro:
             number of atoms in the system
         box: list of floats, length 3
             the box vectors of the system (assume cubic box)
-        atoms: list of Bead objects
+        atoms: list of Bead objects or an AtomTable
             containing necessary information
         """
         self.title = title
@@ -281,39 +832,166 @@ class Gro:
         self.atoms = atoms
     
     def write(self,filename):
-        fid = open(filename,'w')
-        fid.write(self.title+'\n')
-        fid.write(str(self.atomno)+'\n')
-        bformat = "%5d%-5s%5s%5d%8.3f%8.3f%8.3f%8.4f%8.4f%8.4f"
-        for bead in self.atoms:
-            beadline = bformat % (bead.resNo,bead.resname,bead.name,
-                                  bead.number,bead.pos[0],bead.pos[1],
-                                  bead.pos[2],bead.vel[0],bead.vel[1],
-                                  bead.vel[2])
-            fid.write(beadline+'\n')
-        fid.write('{0} {1} {2}\n'.format(self.box[0],self.box[1],self.box[2]))
-        fid.close()
-
-class Blist:
-    """
-    A list containing a list of Bonds with some added useful features
-    
-    ----------
-    Attributes
-    ----------
-    
-    """
-    def __init__(self):
-        self.entries = []
+        """
+        write out a gro file, formatting all the bead lines at once and 
+        emitting the whole file in a single write
+        
+        ----------
+        Parameters
+        ----------
+        filename: string or file-like object
+            name of file to be written to (see openOutput), or a stream
+        """
+        writeOutput(filename,self.text())
     
-    def __getitem__(self,key):
-        return self.entries[key]
+    def text(self):
+        """
+        Format the whole gro file
         
-    def __setitem__(self,key,item):
-        self.entries[key] = item
+        -------
+        Returns
+        -------
+        text: string
+        """
+        table = asAtomTable(self.atoms)
+        return self.title + '\n' + str(self.atomno) + '\n' + \
+               self.atomSection(table) + \
+               '{0} {1} {2}\n'.format(self.box[0],self.box[1],self.box[2])
     
-    def __len__(self):
-        return len(self.entries)
+    def atomSection(self,table):
+        """
+        Format the lines of every bead at once.  Residue and atom numbers
+        wrap around at 100000, as in GROMACS
+        
+        ----------
+        Parameters
+        ----------
+        table: AtomTable
+        
+        -------
+        Returns
+        -------
+        lines: string
+        """
+        n = len(table)
+        if n == 0:
+            return ''
+        cols = np.empty((n,10),dtype=object)
+        cols[:,0] = table.resNo % 100000
+        cols[:,1] = table.resname
+        cols[:,2] = table.name
+        cols[:,3] = table.number % 100000
+        cols[:,4:7] = table.pos
+        cols[:,7:10] = table.vel
+        return (GROFORMAT*n) % tuple(cols.ravel().tolist())
+
+def readGroFrames(groname):
+    """
+    Read every frame of a (multi-frame) gro file
+
+    ----------
+    Parameters
+    ----------
+    groname: string
+
+    -------
+    Returns
+    -------
+    table: AtomTable
+        residues and names of the beads, positions of the first frame
+    frames: numpy array, F x N x 3
+        positions in every frame
+    boxes: numpy array, F x 3
+        box edges of every frame
+    titles: list of strings
+    """
+    fid = open(groname)
+    lines = fid.read().splitlines()
+    fid.close()
+    titles = []
+    frames = []
+    boxes = []
+    start = 0
+    while start < len(lines) and len(lines[start].strip()) > 0:
+        natoms = int(lines[start+1])
+        atoms = lines[start+2:start+2+natoms]
+        titles.append(lines[start])
+        frames.append(np.array([(line[20:28],line[28:36],line[36:44])
+                                for line in atoms],dtype=float))
+        boxes.append([float(b) for b in lines[start+2+natoms].split()[:3]])
+        if start == 0:
+            resNo = np.array([int(line[:5]) for line in atoms])
+            resname = [line[5:10].strip() for line in atoms]
+            name = [line[10:15].strip() for line in atoms]
+        start += natoms + 3
+    frames = np.array(frames)
+    natoms = frames.shape[1]
+    table = AtomTable(resNo,resname,name,np.arange(1,natoms+1),
+                      frames[0].copy(),np.zeros((natoms,3)),[''] * natoms,
+                      np.zeros(natoms),['C'] * natoms)
+    return (table,frames,np.array(boxes),titles)
+
+class Blist(object):
+    """
+    A list containing a list of Bonds with some added useful features
+    
+    ----------
+    Attributes
+    ----------
+    entries: list of Bond, Angle, or Dihedral objects
+        the bonded terms, in the order they will be written
+    beadIndex: dict
+        Bead -> list of entries containing that bead.  Keyed on the Bead 
+        objects themselves, so it stays valid when beads are renumbered.
+    
+    -----
+    Notes
+    -----
+    The order of the entries is kept as an ordering key per entry, with the
+    same scheme as DXXXTopology.resSwapMany: (position,) for appended 
+    entries, and anchorKey + (-insertion,i) for the i-th entry of an 
+    insertion right after the entry with anchorKey (anchorKey is () when 
+    inserting at the front).  Removing and inserting entries then only 
+    touches those entries and the entries of the beads involved; the list
+    itself is only sorted when entries is next read, e.g. when the topology
+    is written.
+    """
+    def __init__(self):
+        self.beadIndex = {}
+        self._setEntries([])
+    
+    @property
+    def entries(self):
+        if self._sorted is None:
+            self._sorted = [entry for (key,entry) in \
+                            sorted(self._items.values(),
+                                   key=lambda item: item[0])]
+            self._positions = None
+        return self._sorted
+    
+    @entries.setter
+    def entries(self,entries):
+        self._setEntries(entries)
+    
+    def __getitem__(self,key):
+        return self.entries[key]
+        
+    def __setitem__(self,key,item):
+        old = self.entries[key]
+        self._unindex(old)
+        self._items[id(item)] = (self._items.pop(id(old))[0],item)
+        self._index(item)
+        self._sorted = None
+    
+    def __len__(self):
+        return len(self._items)
+    
+    def __getstate__(self):
+        #the keys are tied to id() of the entries, so only keep the order
+        return {'entries':self.entries}
+    
+    def __setstate__(self,state):
+        self._setEntries(state['entries'])
         
     def __str__(self):
         return str([str(entry) for entry in self.entries])
@@ -323,8 +1001,126 @@ class Blist:
         Add two Blists together by concatenating their entries
         """
         newBlist = Blist()
-        newBlist.entries = self.entries+other.entries
+        newBlist._setEntries(self.entries+other.entries)
+        return newBlist
+    
+    def _index(self,entry):
+        """
+        Add an entry to the reverse index
+        """
+        for a in entry.ainds:
+            self.beadIndex.setdefault(a,[]).append(entry)
+    
+    def _unindex(self,entry):
+        """
+        Remove an entry from the reverse index
+        """
+        for a in entry.ainds:
+            bentries = self.beadIndex.get(a)
+            if bentries is None:
+                continue
+            bentries.remove(entry)
+            if len(bentries) == 0:
+                del self.beadIndex[a]
+    
+    def _setEntries(self,entries):
+        """
+        Replace all entries at once, rebuilding the reverse index and 
+        numbering the ordering keys afresh
+        """
+        entries = list(entries)
+        self._items = dict([(id(entry),((pos,),entry)) for (pos,entry) \
+                            in enumerate(entries)])
+        self._next = len(entries)
+        self._insertions = 0
+        self._sorted = entries
+        self._positions = None
+        self.beadIndex = {}
+        for entry in entries:
+            self._index(entry)
+    
+    def remap(self,beadMap):
+        """
+        Create a copy of this list whose entries act on different beads, 
+        see Bond.remap
+        
+        ----------
+        Parameters
+        ----------
+        beadMap: dict
+            id(old bead) -> new bead, for every bead in the list
+            
+        -------
+        Returns
+        -------
+        newBlist: Blist
+        """
+        newBlist = Blist()
+        newBlist._setEntries([entry.remap(beadMap) for entry in self.entries])
         return newBlist
+    
+    def position(self,entry):
+        """
+        Find the position of an entry in the list
+        
+        ----------
+        Parameters
+        ----------
+        entry: a Bond, Angle, or Dihedral object
+        
+        -------
+        Returns
+        -------
+        pos: int
+            index of the entry in entries
+        """
+        entries = self.entries
+        if self._positions is None:
+            self._positions = dict([(id(e),i) for (i,e) \
+                                    in enumerate(entries)])
+        return self._positions[id(entry)]
+    
+    def orderKey(self,entry):
+        """
+        The ordering key of an entry, see the class Notes.  Entries are 
+        written in order of increasing key.
+        
+        ----------
+        Parameters
+        ----------
+        entry: a Bond, Angle, or Dihedral object
+        
+        -------
+        Returns
+        -------
+        key: tuple
+        """
+        return self._items[id(entry)][0]
+    
+    def entriesContaining(self,beads):
+        """
+        Find all entries containing any of a set of beads, using the 
+        reverse index
+        
+        ----------
+        Parameters
+        ----------
+        beads: list of Beads
+        
+        -------
+        Returns
+        -------
+        found: list of entries
+            each entry containing one of the beads, listed once
+        """
+        found = []
+        seen = set()
+        for bead in beads:
+            for entry in self.beadIndex.get(bead,[]):
+                if id(entry) not in seen:
+                    seen.add(id(entry))
+                    found.append(entry)
+        return found
         
     def append(self,entry):
         """
@@ -336,7 +1132,14 @@ class Blist:
         entry: a Bond, Angle, or Dihedral object
         
         """
-        self.entries.append(entry)
+        self._items[id(entry)] = ((self._next,),entry)
+        self._next += 1
+        self._index(entry)
+        if self._sorted is not None:
+            #the new key is the largest, so the sorted list stays sorted
+            self._sorted.append(entry)
+            if self._positions is not None:
+                self._positions[id(entry)] = len(self._sorted) - 1
     
     def remove(self,entry):
         """
@@ -348,7 +1151,7 @@ class Blist:
         entry: a Bond, Angle, or Dihedral object
         
         """
-        self.entries.remove(entry)
+        self.removeEntries([entry])
     
     def removeByIndex(self,ID):
         """
@@ -360,18 +1163,41 @@ class Blist:
         ID: int
         
         """
+        doomed = [entry for entry in self.entries if entry.contains(ID)]
+        self.removeEntries(doomed)
+    
+    def removeByAtoms(self,beads):
+        """
+        Removes all entries in the list containing any of the given beads.
+        Only the entries of those beads are looked at, via the reverse index.
         
-        newEntries = []
-     
-        ind = 0
-        for entry in self.entries:
-            if not entry.contains(ID):
-                newEntries.append(entry)
-            
-            ind += 1
-        self.entries = newEntries   
+        ----------
+        Parameters
+        ----------
+        beads: list of Beads
+        
+        """
+        self.removeEntries(self.entriesContaining(beads))
+    
+    def removeEntries(self,doomed):
+        """
+        Removes a set of entries from the list, at a cost proportional to 
+        the number of entries removed
+        
+        ----------
+        Parameters
+        ----------
+        doomed: list of Bond, Angle, or Dihedral objects
+        
+        """
+        if len(doomed) == 0:
+            return
+        for entry in doomed:
+            del self._items[id(entry)]
+            self._unindex(entry)
+        self._sorted = None
     
-    def insertByResIndex(self,newentries,resID):
+    def insertByResIndex(self,newentries,resID,prevBeads=None):
         """
         Inserts entries between entries containing atoms with resID - 1 and 
         those with atoms with resID + 1
@@ -384,30 +1210,311 @@ class Blist:
             
         resID: int
             the residue ID location to insert the entries
+            
+        prevBeads: list of Beads
+            the beads of residue resID - 1, if known.  The insertion point is
+            then found from the reverse index instead of checking every entry.
         """
-        startInd = -1
+        anchorKey = ()
+        if prevBeads is not None:
+            for entry in self.entriesContaining(prevBeads):
+                anchorKey = max(anchorKey,self.orderKey(entry))
+        else:
+            for entry in self.entries:
+                if entry.containsRes(resID - 1):
+                    anchorKey = self.orderKey(entry)
+        self._insertions += 1
+        for (i,entry) in enumerate(newentries):
+            self._items[id(entry)] = (anchorKey + (-self._insertions,i),entry)
+            self._index(entry)
+        self._sorted = None
+        
+        
+        
+#secondary structure codes, in the order used by the martini22 tables
+SSCODES = ['F','E','H','1','2','3','T','S','C']
 
-        currind = 0
-        #pdb.set_trace()
-        for entry in self.entries:
-            if entry.containsRes(resID - 1):
-                startInd = currind
-            currind += 1
-        #pdb.set_trace()
-        nentries = []
-        for i in range(0,startInd+1):
-            nentries.append(self.entries[i])
-        #pdb.set_trace()
-        for entry in newentries:
-            nentries.append(entry)
-        #pdb.set_trace()
-        for i in range(startInd+1,len(self.entries)):
-            nentries.append(self.entries[i])
-        #pdb.set_trace()
-        self.entries = nentries
+class ReadOnlyDict(dict):
+    """
+    A dictionary that cannot be changed after it is created, used for the
+    lookup tables of the shared force field
+    """
+    def _readOnly(self,*args,**kwargs):
+        raise TypeError('force field tables are read-only')
+    __setitem__ = _readOnly
+    __delitem__ = _readOnly
+    clear = _readOnly
+    pop = _readOnly
+    popitem = _readOnly
+    setdefault = _readOnly
+    update = _readOnly
+    
+    def __reduce__(self):
+        return (ReadOnlyDict,(dict(self),))
+
+def freeze(item):
+    """
+    Recursively turn lists into tuples and dicts into ReadOnlyDicts
+    """
+    if isinstance(item,dict):
+        return ReadOnlyDict([(key,freeze(value)) for (key,value) \
+                             in item.items()])
+    if isinstance(item,(list,tuple)):
+        return tuple([freeze(value) for value in item])
+    return item
+
+class FrozenForceField(martini22):
+    """
+    An immutable martini22 force field with the per-residue parameters
+    needed by Topology.createRes compiled into a single lookup table.
+    Use getForceField() rather than constructing one of these directly.
+    
+    ----------
+    Attributes
+    ----------
+    All martini22 attributes, with lists as tuples and dicts as ReadOnlyDicts
+    residueTable: ReadOnlyDict
+        (resname,ss) -> dict of the parameters of a residue, see 
+        residueParameters
+    """
+    def __init__(self):
+        martini22.__init__(self)
+        for key in list(self.__dict__.keys()):
+            self.__dict__[key] = freeze(self.__dict__[key])
+        table = {}
+        for name in self.sidechains.keys():
+            for ssind in range(len(SSCODES)):
+                table[(name,SSCODES[ssind])] = \
+                freeze(self.compileResidue(name,ssind))
+        self.__dict__['residueTable'] = ReadOnlyDict(table)
+        self.__dict__['_frozen'] = True
+        
+    def __setattr__(self,key,value):
+        if self.__dict__.get('_frozen',False):
+            raise AttributeError('the shared force field is read-only')
+        self.__dict__[key] = value
+        
+    def compileResidue(self,name,ssind):
+        """
+        Gather everything createRes needs to know about a residue with a 
+        given secondary structure
+        
+        ----------
+        Parameters
+        ----------
+        name: string
+            the residue name as it appears in the Martini 2.2 ff lookup table
+        ssind: int
+            index of the secondary structure in SSCODES
+            
+        -------
+        Returns
+        -------
+        params: dict
+            bbtype, bbcharge: backbone bead type and charge (None if neutral)
+            bbbond: backbone bond or constraint parameters
+            bbconstraint: True if the backbone bond is a constraint
+            bbangle: backbone angle parameters
+            bbdihedral: backbone dihedral parameters (None if there are none)
+            sctypes, sccharges: side chain bead types and charges
+            scbonds: side chain bond parameters from the force field
+            bbsangle: backbone-backbone-side chain angle parameters
+            scterms: list of (kind,bead indices,params) for each side chain
+                bonded term, where kind is bond, constraint, angle or dihedral
+        """
+        params = {}
+        if name in self.bbtyp:
+            params['bbtype'] = self.bbtyp[name][ssind]
+        else:
+            params['bbtype'] = self.bbdef[ssind]
+        params['bbcharge'] = self.charges.get(params['bbtype'])
+        bbl = self.bbldef[ssind]
+        bbk = self.bbkb[ssind]
+        params['bbconstraint'] = bbk is None
+        if bbk is not None:
+            params['bbbond'] = [1,bbl,bbk]
+        else:
+            params['bbbond'] = [1,bbl]
+        if name in self.bbatyp:
+            bba = self.bbatyp[name][ssind]
+        else:
+            bba = self.bbadef[ssind]
+        params['bbangle'] = [2,bba,self.bbka[ssind]]
+        if ssind < len(self.bbddef):
+            params['bbdihedral'] = [2,self.bbddef[ssind],self.bbkd[ssind]]
+        else:
+            params['bbdihedral'] = None
+        params['bbsangle'] = [2,self.bbsangle[0],self.bbsangle[1]]
+        sidechain = self.sidechains[name]
+        params['sctypes'] = []
+        params['sccharges'] = []
+        params['scbonds'] = []
+        params['scterms'] = []
+        if len(sidechain) == 0:
+            return params
+        params['sctypes'] = sidechain[0]
+        for sctype in sidechain[0]:
+            if sctype in self.charges:
+                params['sccharges'].append(float(self.charges[sctype]))
+            else:
+                params['sccharges'].append(None)
+        params['scbonds'] = sidechain[1]
+        bondConnect = self.connectivity[name]
+        for bsetind in range(len(bondConnect)):
+            for bind in range(len(bondConnect[bsetind])):
+                currBInds = bondConnect[bsetind][bind]
+                currBParams = sidechain[bsetind+1][bind]
+                if len(currBInds) == 2:
+                    if currBParams[1] is not None:
+                        term = ('bond',[1,currBParams[0],currBParams[1]])
+                    else:
+                        term = ('constraint',[1,currBParams[0]])
+                elif len(currBInds) == 3:
+                    term = ('angle',[2,currBParams[0],currBParams[1]])
+                elif len(currBInds) == 4:
+                    term = ('dihedral',[2,currBParams[0],currBParams[1]])
+                else:
+                    warn("Unknown bonded interaction. Not adding SC bonds.")
+                    continue
+                params['scterms'].append((term[0],currBInds,term[1]))
+        return params
+    
+    def residueParameters(self,name,structure):
+        """
+        Look up the compiled parameters of a residue
         
+        ----------
+        Parameters
+        ----------
+        name: string
+            the residue name as it appears in the Martini 2.2 ff lookup table
+        structure: string
+            the residue secondary structure as it appears in the Martini 2.2
+            ff lookup table
+            
+        -------
+        Returns
+        -------
+        params: ReadOnlyDict
+            see compileResidue
+        """
+        if structure not in SSCODES:
+            raise ValueError('Unknown secondary structure ' + str(structure))
+        return self.residueTable[(name,structure)]
+
+#the process-wide force field, built on first use
+_forceField = None
+
+def getForceField():
+    """
+    Get the shared, read-only martini22 force field.  It is constructed the
+    first time this is called and reused afterwards; worker processes forked
+    after that point inherit it without rebuilding it.
+    
+    -------
+    Returns
+    -------
+    ff: FrozenForceField
+    """
+    global _forceField
+    if _forceField is None:
+        _forceField = FrozenForceField()
+    return _forceField
         
+def sideChainPositions(bbPos,prevPos,nextPos,bondLengths,nBeads,flip=None):
+    """
+    Place the side chains of a batch of residues that all have the same 
+    number of side chain beads
+    
+    ----------
+    Parameters
+    ----------
+    bbPos: numpy array, R x 3
+        backbone bead positions
+    prevPos: numpy array, R x 3
+        positions of the previous residues' backbone beads, nan where there
+        is no previous residue
+    nextPos: numpy array, R x 3
+        positions of the next residues' backbone beads, nan where there is
+        no next residue
+    bondLengths: numpy array, R x B
+        side chain bond lengths of each residue, in the order of the 
+        martini22 sidechains table
+    nBeads: int
+        number of side chain beads per residue
+    flip: numpy array of bools, length R
+        residues whose side chain goes to the other side of a straight 
+        chain, where "away from the neighbours" is undefined
         
+    -------
+    Returns
+    -------
+    scpos: numpy array, R x nBeads x 3
+    
+    -----
+    Notes
+    -----
+    Each side chain points along u, the bisector of the two backbone bonds
+    pointing away from the neighbouring backbone beads, made perpendicular
+    to the local chain axis.  Rings lie in the plane spanned by u and the 
+    normal v = axis x u, across the chain rather than along it, so they do
+    not run into the neighbouring side chains.  One and two bead side 
+    chains are straight, three bead ones are a triangle on the first bead 
+    (as in getSCPos) and four bead ones (TRP) add the fourth bead on the 
+    far side of the second and third.
+    """
+    bbPos = np.asarray(bbPos,dtype=float).reshape((-1,3))
+    prevPos = np.asarray(prevPos,dtype=float).reshape((-1,3))
+    nextPos = np.asarray(nextPos,dtype=float).reshape((-1,3))
+    lengths = np.asarray(bondLengths,dtype=float).reshape((len(bbPos),-1))
+    hasPrev = ~np.isnan(prevPos).any(axis=1)
+    hasNext = ~np.isnan(nextPos).any(axis=1)
+    prevPos = np.where(hasPrev[:,None],prevPos,bbPos)
+    nextPos = np.where(hasNext[:,None],nextPos,bbPos)
+    away = (bbPos - prevPos) + (bbPos - nextPos)
+    axis = nextPos - prevPos
+    axisNorm = np.sqrt(np.sum(axis**2,axis=1))
+    axis[axisNorm == 0.] = [1.,0.,0.]
+    axisNorm[axisNorm == 0.] = 1.
+    axis /= axisNorm[:,None]
+    away -= np.sum(away*axis,axis=1)[:,None]*axis
+    awayNorm = np.sqrt(np.sum(away**2,axis=1))
+    #any direction perpendicular to the axis, for straight chains
+    perp = np.cross(axis,[0.,0.,1.])
+    perpNorm = np.sqrt(np.sum(perp**2,axis=1))
+    parallel = perpNorm < 1e-6
+    perp[parallel] = np.cross(axis[parallel],[0.,1.,0.])
+    perp /= np.sqrt(np.sum(perp**2,axis=1))[:,None]
+    if flip is not None:
+        perp[np.asarray(flip,dtype=bool)] *= -1.
+    straight = awayNorm < 1e-6
+    awayNorm[straight] = 1.
+    u = np.where(straight[:,None],perp,away/awayNorm[:,None])
+    v = np.cross(axis,u)
+    
+    #coordinates of each bead along u and v
+    cu = np.zeros((len(bbPos),nBeads))
+    cv = np.zeros((len(bbPos),nBeads))
+    c60 = np.cos(np.pi/3)
+    s60 = np.sin(np.pi/3)
+    cu[:,0] = lengths[:,0]
+    if nBeads == 3 or nBeads == 4:
+        cu[:,1] = cu[:,0] + lengths[:,1]*s60
+        cv[:,1] = lengths[:,1]*c60
+        cu[:,2] = cu[:,0] + lengths[:,2]*s60
+        cv[:,2] = -lengths[:,2]*c60
+        if nBeads == 4:
+            half = 0.5*(cv[:,1] - cv[:,2])
+            side = 0.5*(lengths[:,4] + lengths[:,5])
+            cu[:,3] = 0.5*(cu[:,1] + cu[:,2]) + \
+                      np.sqrt(np.maximum(side**2 - half**2,0.))
+            cv[:,3] = 0.5*(cv[:,1] + cv[:,2])
+    else:
+        for i in range(1,nBeads):
+            cu[:,i] = cu[:,i-1] + lengths[:,min(i,lengths.shape[1]-1)]
+    return bbPos[:,None,:] + cu[:,:,None]*u[:,None,:] + \
+           cv[:,:,None]*v[:,None,:]
+
 class Topology:
     """
     contains all requisite information for a single-molecule system
@@ -431,10 +1538,15 @@ class Topology:
         one
     anglist: list of angles containing structural information about each one
     dihlist: list of dihedrals containing structural information about each one
+    bbIndex: dict
+        resNo -> index in the atomlist of the first BB bead of that residue
+    resRange: dict
+        resNo -> [start,stop) indices in the atomlist of that residue's beads
     """
     def __init__(self):
         self.title = ''
         self.atomlist = []
+        self._atomTable = None
         self.atomno = 0
         self.box = [0.,0.,0.]
         self.moltype = ['Protein',1]
@@ -443,97 +1555,294 @@ class Topology:
         self.conlist = Blist()
         self.anglist = Blist()
         self.dihlist = Blist()
+        self.bbIndex = {}
+        self.resRange = {}
     
-    def findBBinRes(self,resID):
+    def clone(self):
         """
-        A function that locates the BB residue inside the atomlist with the
-        given residue ID.  Assumes there is only one
-        
-        ----------
-        Parameters
-        ----------
-        resID: int
-            the residue ID to search for the backbone bead of
+        Create an independent copy of this topology, much faster than 
+        re-reading the template files or deep-copying.  Beads are copied,
+        so the clone can be renumbered and mutated freely; bonded terms are
+        rebuilt on the new beads but share their (unchanging) params lists 
+        and notes with the original.
         
         -------
         Returns
         -------
-        beadID: int
-            the index of the bead in the atomlist that is the backbone bead
-            for the given residue, None if there is no backbone bead
+        Top: same class as this topology
         """
-        beadID = 0
-        for atom in self.atomlist:
-            if atom.resNo == resID and atom.name == 'BB':
-                return beadID
-            beadID += 1
-        return None
+        Top = copy.copy(self)
+        table = self._atomTable
+        if table is not None and table.holds(self.atomlist):
+            Top._atomTable = table.copy()
+            Top.atomlist = [Top._atomTable.bead(ind) for ind in \
+                            range(len(table))]
+        else:
+            Top._atomTable = None
+            Top.atomlist = [atom.copy() for atom in self.atomlist]
+        beadMap = dict(zip([id(atom) for atom in self.atomlist],Top.atomlist))
+        Top.box = list(self.box)
+        Top.moltype = list(self.moltype)
+        Top.bondlist = self.bondlist.remap(beadMap)
+        Top.conlist = self.conlist.remap(beadMap)
+        Top.anglist = self.anglist.remap(beadMap)
+        Top.dihlist = self.dihlist.remap(beadMap)
+        Top.bbIndex = dict(self.bbIndex)
+        Top.resRange = dict(self.resRange)
+        return Top
     
-    def createNewBonds(self,params,shiftID,bbAtom,resID):
+    def topText(self,fname,count=1):
         """
-        Helper function that creates bonds, constraints, angles or dihedrals
+        Format a top file for a system of this molecule
         
         ----------
         Parameters
         ----------
-        params: list
-            These parameters are determined by the particular type of thing
-            in general
-        shiftID: int
-            essentially what kind of bonded interaction: 1 = bond or constraint
-            , 2 = angle, 3 = dihedral (it's how far out to take your window) of
-            BB beads that are included
-        bbAtom: Bead
-            central bead
-        resID: eventual ID of residue containing central bead
+        fname: string
+            the base name of the matching itp file
+        count: int
+            number of copies of the molecule in the system
+            
         -------
         Returns
         -------
-        newBonds: Blist
-            list of  
+        text: string
         """
-        
-        newBonds = Blist()
-        finalResID = self.atomlist[len(self.atomlist)-1].resNo
-        span = range(max(1,resID-shiftID),min(finalResID,
-                         resID+shiftID)+1)
-        #pdb.set_trace()
-        for j in range(0,len(span)-shiftID):
-            lrinds = span[j:j+shiftID+1]
-            ainds = []
-            notes = ''
-            for lri in lrinds:
-                if lri == resID:
-                    currbead = bbAtom
-                else:
-                    currBeadID = self.findBBinRes(lri)
-                    currbead = self.atomlist[currBeadID]
-                notes += currbead.resname + '-'
-                ainds.append(currbead)
-                
-            if shiftID == 1:
-                newBonds.append(Bond(ainds,params,notes,True))
-            elif shiftID == 2:
-                newBonds.append(Angle(ainds,params,notes,True))
-            elif shiftID == 3:
-                newBonds.append(Dihedral(ainds,params,notes,True))
-            else:
-                warn('No such bonded interaction, returning empty Blist.')
-        return newBonds
+        return '#include "martini.itp"\n' + \
+               '#include "{}"\n'.format(os.path.basename(fname)+'.itp') + \
+               '[ system ]\n\n' + \
+               '; name\n' + \
+               '{} system\n\n'.format(self.chemName) + \
+               '[ molecules ]\n\n' + \
+               '; name \t number\n\n' + \
+               '{} \t {}\n'.format(self.moltype[0],count)
     
-    def createRes(self,name,structure,bbID):
+    def atomTable(self):
         """
-        Creates a residue to be inserted based on the Martini 2.2 force field
+        Get the array-backed storage of the beads in the atomlist.  The
+        table is (re)built whenever the atomlist has changed since the last
+        call, after which every bead in the atomlist is a view of its row.
         
-        ----------
-        Parameters
-        ----------
+        -------
+        Returns
+        -------
+        table: AtomTable
+        """
+        if self._atomTable is None or \
+           not self._atomTable.holds(self.atomlist):
+            self._atomTable = AtomTable.fromBeads(self.atomlist)
+        return self._atomTable
+    
+    def positions(self):
+        """
+        Get the positions of all the beads
+        
+        -------
+        Returns
+        -------
+        pos: numpy array, N x 3
+            positions in atomlist order; changing it moves the beads
+        """
+        return self.atomTable().pos
+    
+    def centroid(self):
+        """
+        Get the geometric centre of the beads
+        
+        -------
+        Returns
+        -------
+        center: numpy array, length 3
+        """
+        return self.positions().mean(axis=0)
+    
+    def translate(self,shift):
+        """
+        Move every bead by the same vector
+        
+        ----------
+        Parameters
+        ----------
+        shift: numpy array, length 3
+        """
+        pos = self.positions()
+        pos += np.asarray(shift,dtype=float)
+    
+    def rotate(self,rotation,center=None):
+        """
+        Rotate the molecule rigidly
+        
+        ----------
+        Parameters
+        ----------
+        rotation: numpy array, 3 x 3
+            rotation matrix, applied to column vectors
+        center: numpy array, length 3
+            point to rotate about, the centroid if not given
+        """
+        pos = self.positions()
+        if center is None:
+            center = pos.mean(axis=0)
+        center = np.asarray(center,dtype=float)
+        pos[:] = np.dot(pos - center,np.asarray(rotation,dtype=float).T) + \
+                 center
+    
+    def indexResidues(self):
+        """
+        Rebuild the residue to bead lookup tables (bbIndex and resRange) in
+        a single pass over the atomlist.  Must be called whenever atoms are 
+        added, removed or renumbered.
+        """
+        bbIndex = {}
+        resRange = {}
+        for (ind,atom) in enumerate(self.atomlist):
+            if atom.resNo in resRange:
+                resRange[atom.resNo][1] = ind+1
+            else:
+                resRange[atom.resNo] = [ind,ind+1]
+            if atom.name == 'BB' and atom.resNo not in bbIndex:
+                bbIndex[atom.resNo] = ind
+        self.bbIndex = bbIndex
+        self.resRange = dict([(resNo,tuple(rng)) for (resNo,rng) \
+                              in resRange.items()])
+    
+    def resAtomIndices(self,resID):
+        """
+        Find the indices in the atomlist of all beads in a residue
+        
+        ----------
+        Parameters
+        ----------
+        resID: int
+            the residue ID to search for
+            
+        -------
+        Returns
+        -------
+        inds: list of ints
+            indices of the beads with the given residue ID, in order
+        """
+        if len(self.resRange) == 0 and len(self.atomlist) > 0:
+            self.indexResidues()
+        if resID not in self.resRange:
+            return []
+        (start,stop) = self.resRange[resID]
+        return [ind for ind in range(start,stop) \
+                if self.atomlist[ind].resNo == resID]
+    
+    def findBBinRes(self,resID):
+        """
+        A function that locates the BB residue inside the atomlist with the
+        given residue ID.  Assumes there is only one
+        
+        ----------
+        Parameters
+        ----------
+        resID: int
+            the residue ID to search for the backbone bead of
+        
+        -------
+        Returns
+        -------
+        beadID: int
+            the index of the bead in the atomlist that is the backbone bead
+            for the given residue, None if there is no backbone bead
+        """
+        if len(self.bbIndex) == 0 and len(self.atomlist) > 0:
+            self.indexResidues()
+        return self.bbIndex.get(resID)
+    
+    def bbBead(self,resID,neighbours=None):
+        """
+        Get the backbone bead of a residue
+        
+        ----------
+        Parameters
+        ----------
+        resID: int
+            the residue ID to get the backbone bead of
+        neighbours: dict
+            resID -> BB bead overrides, used for residues that have been
+            replaced but not yet written into the atomlist
+            
+        -------
+        Returns
+        -------
+        bead: Bead
+        """
+        if neighbours is not None and resID in neighbours:
+            return neighbours[resID]
+        return self.atomlist[self.findBBinRes(resID)]
+    
+    def createNewBonds(self,params,shiftID,bbAtom,resID,neighbours=None):
+        """
+        Helper function that creates bonds, constraints, angles or dihedrals
+        
+        ----------
+        Parameters
+        ----------
+        params: list
+            These parameters are determined by the particular type of thing
+            in general
+        shiftID: int
+            essentially what kind of bonded interaction: 1 = bond or constraint
+            , 2 = angle, 3 = dihedral (it's how far out to take your window) of
+            BB beads that are included
+        bbAtom: Bead
+            central bead
+        resID: eventual ID of residue containing central bead
+        neighbours: dict
+            optional resID -> BB bead overrides, see bbBead
+        -------
+        Returns
+        -------
+        newBonds: Blist
+            list of  
+        """
+        
+        newBonds = Blist()
+        finalResID = self.atomlist[len(self.atomlist)-1].resNo
+        span = range(max(1,resID-shiftID),min(finalResID,
+                         resID+shiftID)+1)
+        #pdb.set_trace()
+        for j in range(0,len(span)-shiftID):
+            lrinds = span[j:j+shiftID+1]
+            ainds = []
+            notes = ''
+            for lri in lrinds:
+                if lri == resID:
+                    currbead = bbAtom
+                else:
+                    currbead = self.bbBead(lri,neighbours)
+                notes += currbead.resname + '-'
+                ainds.append(currbead)
+                
+            if shiftID == 1:
+                newBonds.append(Bond(ainds,params,notes,True))
+            elif shiftID == 2:
+                newBonds.append(Angle(ainds,params,notes,True))
+            elif shiftID == 3:
+                newBonds.append(Dihedral(ainds,params,notes,True))
+            else:
+                warn('No such bonded interaction, returning empty Blist.')
+        return newBonds
+    
+    def createRes(self,name,structure,bbID,neighbours=None):
+        """
+        Creates a residue to be inserted based on the Martini 2.2 force field
+        
+        ----------
+        Parameters
+        ----------
         name: string
             the residue name as it appears in the Martini 2.2 ff lookup table
         structure: string
             the residue secondary structure as it appears in the Martini 2.2
             ff lookup table
         bbID: index of current BB bead where the residue is to be replaced
+        neighbours: dict
+            optional resID -> BB bead overrides for the neighbouring 
+            residues, see bbBead
         -------
         Returns
         -------
@@ -558,61 +1867,48 @@ class Topology:
         resCons = Blist()
         resAngs = Blist()
         resDihs = Blist()
-        ff = martini22()
-        ss = ['F','E','H','1','2','3','T','S','C']
-        ssind = ss.index(structure)
+        ff = getForceField()
+        rp = ff.residueParameters(name,structure)
         #add backbone bead
-        if ff.bbtyp.has_key(name):
-            bbbeadtype = ff.bbtyp[name][ssind]
-        else:
-            bbbeadtype = ff.bbdef[ssind]
         bbAtom = self.atomlist[bbID]
-        bbbead = Bead(0,name,'BB',0,bbAtom.pos,bbAtom.vel,bbbeadtype)
+        bbbead = Bead(0,name,'BB',0,bbAtom.pos,bbAtom.vel,rp['bbtype'])
         
-        if ff.charges.has_key(bbbeadtype):
-            bbbead.charge = ff.charges[bbbeadtype]
+        if rp['bbcharge'] is not None:
+            bbbead.charge = rp['bbcharge']
         resAtoms.append(bbbead)
         
-        bbl = ff.bbldef[ssind]
-        bbk = ff.bbkb[ssind]
         #add backbone bonds connecting left and right
         #pdb.set_trace()
-        if bbk is not None:
-            newBBBonds = self.createNewBonds([1,bbl,bbk],1,bbbead,bbAtom.resNo)
+        newBBBonds = self.createNewBonds(list(rp['bbbond']),1,bbbead,
+                                         bbAtom.resNo,neighbours)
+        if not rp['bbconstraint']:
             resBonds = resBonds + newBBBonds
         else:
-            newBBBonds = self.createNewBonds([1,bbl],1,bbbead,bbAtom.resNo)
             resCons = resCons + newBBBonds
                 
         #add backbone angles connecting left and right
-        if ff.bbatyp.has_key(name):
-            bba = ff.bbatyp[name][ssind]
-        else:
-            bba = ff.bbadef[ssind]
-        bbka = ff.bbka[ssind]
-        newAngs = self.createNewBonds([2,bba,bbka],2,bbbead,bbAtom.resNo)
+        newAngs = self.createNewBonds(list(rp['bbangle']),2,bbbead,
+                                      bbAtom.resNo,neighbours)
         resAngs = resAngs + newAngs
         #if they exist, add backbone dihedrals connecting left and right
-        if ssind < len(ff.bbddef):
-            bbd = ff.bbddef[ssind]
-            bbkd = ff.bbkd[ssind]
-            newDihs = self.createNewBonds([2,bbd,bbkd],3,bbbead,bbAtom.resNo)
+        if rp['bbdihedral'] is not None:
+            newDihs = self.createNewBonds(list(rp['bbdihedral']),3,bbbead,
+                                          bbAtom.resNo,neighbours)
             resDihs = resDihs + newDihs
            
         
         #add side chain beads         
-        if len(ff.sidechains[name]) > 0:
+        if len(rp['sctypes']) > 0:
             
-            scpos = self.getSCPos(ff.sidechains[name][1],bbAtom.pos,
-                                      len(ff.sidechains[name][0]))
+            scpos = self.getSCPos(rp['scbonds'],bbAtom.pos,
+                                      len(rp['sctypes']))
             #pdb.set_trace()
-            for sci in range(len(ff.sidechains[name][0])):
+            for sci in range(len(rp['sctypes'])):
                 scbead = Bead(0,name,'SC'+str(sci+1),sci+1,scpos[sci,:],
-                              np.array([0.,0.,0.]),ff.sidechains[name][0][sci])
+                              np.array([0.,0.,0.]),rp['sctypes'][sci])
                 #pdb.set_trace()
-                if ff.charges.has_key(ff.sidechains[name][0][sci]):
-                    scbead.charge = \
-                    float(ff.charges[ff.sidechains[name][0][sci]])
+                if rp['sccharges'][sci] is not None:
+                    scbead.charge = rp['sccharges'][sci]
                 resAtoms.append(scbead)
             #add backbone-backbone side chain angles
             #assume that they are on the left if the resID < (1/2) max resID
@@ -623,54 +1919,89 @@ class Topology:
             #pdb.set_trace()
             if maxres > 1:
                 if currres > 0.5 * maxres:
-                    currNeighBead = self.atomlist[self.findBBinRes(currres-1)]  
-                    params = [2,ff.bbsangle[0],ff.bbsangle[1]]
+                    currNeighBead = self.bbBead(currres-1,neighbours)
+                    params = list(rp['bbsangle'])
                     ainds = [currNeighBead,resAtoms[0],resAtoms[1]]
                     notes = currNeighBead.resname + '-' + resAtoms[0].resname + \
                             '-' + resAtoms[1].resname
                     resAngs.append(Angle(ainds,params,notes))
                 else:
-                    currNeighBead = self.atomlist[self.findBBinRes(currres+1)]
-                    params = [2,ff.bbsangle[0],ff.bbsangle[1]]
+                    currNeighBead = self.bbBead(currres+1,neighbours)
+                    params = list(rp['bbsangle'])
                     ainds = [resAtoms[1],resAtoms[0],currNeighBead]
                     notes = resAtoms[1].resname + '-' + resAtoms[0].resname + \
                             '-' + currNeighBead.resname
                     resAngs.append(Angle(ainds,params,notes))
             #add bonded interactions containing SC beads
-            bondConnect = ff.connectivity[name]
-            bondAttributes = ff.sidechains[name]
-            for bsetind in range(len(bondConnect)):
-                for bind in range(len(bondConnect[bsetind])):
-                    currBInds = bondConnect[bsetind][bind]
-                    currBParams = bondAttributes[bsetind+1][bind]
-                    currBeads = []
-                    currNotes = ''
-                    #pdb.set_trace()
-                    for cbind in range(len(currBInds)):
-                        currBeads.append(resAtoms[currBInds[cbind]])
-                        currNotes += resAtoms[currBInds[cbind]].resname +'-'
-                    if len(currBInds) == 2:
-                        
-                        if currBParams[1] is not None: #bond
-                            currParams = [1,currBParams[0],currBParams[1]]
-                            resBonds.append(Bond(currBeads,currParams,
-                                                 currNotes))
-                        else: #constraint
-                            currParams = [1,currBParams[0]]
-                            resCons.append(Bond(currBeads,currParams,
-                                                currNotes))
-                    elif len(currBInds) == 3:#angle
-                        currParams = [2,currBParams[0],currBParams[1]]
-                        resAngs.append(Angle(currBeads,currParams,currNotes))
-                    elif len(currBInds) == 4:#dihedral
-                        currParams = [2,currBParams[0],currBParams[1]]
-                        resDihs.append(Dihedral(currBeads,currParams,
-                                                currNotes))
-                    else:#???
-                        warn("Unknown bonded interaction. Not adding SC bonds.")
+            for (kind,currBInds,currParams) in rp['scterms']:
+                currBeads = [resAtoms[cbind] for cbind in currBInds]
+                currNotes = ''.join([bead.resname + '-' for bead in currBeads])
+                currParams = list(currParams)
+                if kind == 'bond':
+                    resBonds.append(Bond(currBeads,currParams,currNotes))
+                elif kind == 'constraint':
+                    resCons.append(Bond(currBeads,currParams,currNotes))
+                elif kind == 'angle':
+                    resAngs.append(Angle(currBeads,currParams,currNotes))
+                else:
+                    resDihs.append(Dihedral(currBeads,currParams,currNotes))
                         
         return (resAtoms,resBonds,resCons,resAngs,resDihs)
     
+    def placeSideChains(self,resIDs=None):
+        """
+        Re-place the side chain beads of many residues at once, each 
+        pointing away from its neighbouring backbone beads (see 
+        sideChainPositions)
+        
+        ----------
+        Parameters
+        ----------
+        resIDs: list of ints
+            the residues to place, by default every residue whose side 
+            chain matches the martini22 sidechains table
+        """
+        ff = getForceField()
+        self.indexResidues()
+        if resIDs is None:
+            resIDs = sorted(self.resRange.keys())
+        nan = np.array([np.nan,np.nan,np.nan])
+        groups = {}
+        for resID in resIDs:
+            bbID = self.findBBinRes(resID)
+            if bbID is None:
+                continue
+            bbAtom = self.atomlist[bbID]
+            if bbAtom.resname not in ff.sidechains or \
+               len(ff.sidechains[bbAtom.resname]) == 0:
+                continue
+            scBeads = [self.atomlist[ind] for ind in self.resAtomIndices(resID)\
+                       if self.atomlist[ind].name != 'BB']
+            scbonds = ff.sidechains[bbAtom.resname][1]
+            if len(scBeads) != len(ff.sidechains[bbAtom.resname][0]):
+                continue
+            neighbours = []
+            for otherID in [resID-1,resID+1]:
+                otherBB = self.findBBinRes(otherID)
+                if otherBB is None:
+                    neighbours.append(nan)
+                else:
+                    neighbours.append(self.atomlist[otherBB].pos)
+            key = (len(scBeads),len(scbonds))
+            groups.setdefault(key,[]).append((bbAtom.pos,neighbours[0],
+                                              neighbours[1],
+                                              [bond[0] for bond in scbonds],
+                                              resID % 2 == 1,scBeads))
+        for ((nBeads,nBonds),members) in groups.items():
+            scpos = sideChainPositions([m[0] for m in members],
+                                       [m[1] for m in members],
+                                       [m[2] for m in members],
+                                       [m[3] for m in members],nBeads,
+                                       [m[4] for m in members])
+            for (i,member) in enumerate(members):
+                for (j,bead) in enumerate(member[5]):
+                    bead.pos = scpos[i,j,:].copy()
+    
     def getSCPos(self,scs,bbPos,nBeads):
         """
         get the starting positions for the SC beads
@@ -759,6 +2090,7 @@ class ResidueTopology(Topology):
         btype = 'P4'
         Ala = Bead(resNo,resname,name,number,pos,vel,btype)
         self.atomlist.append(Ala)
+        self.indexResidues()
         self.atomno = 1
         self.title = 'Single amino acid residue created from Martini 2.2 FF'
     
@@ -782,10 +2114,11 @@ class ResidueTopology(Topology):
         for i in range(len(self.atomlist)):
             self.atomlist[i].number += 1
             self.atomlist[i].resNo = 1
+        self.indexResidues()
         
             
         
-    def write(self,fname):
+    def write(self,fname,target=None):
         """
         Write out an itp file, a top file and a gro file corresponding to 
         the system
@@ -795,23 +2128,118 @@ class ResidueTopology(Topology):
         ----------
         fname: string
             the base name to use for both fname.itp and fname.gro
+        target: DirectoryTarget, MemoryTarget or ArchiveTarget
+            where to put the files, by default plain files on disk
         """
         title = 'This file was created by createMartiniModel for a single res'
-        gro = Gro(title,len(self.atomlist),self.atomlist,self.box)
-        gro.write(fname+'.gro')
-        itp = Itp(self.chemName,self.moltype,self.atomlist,self.bondlist,
+        if target is None:
+            target = DirectoryTarget()
+        gro = Gro(title,len(self.atomlist),self.atomTable(),self.box)
+        target.add(fname+'.gro',gro.text())
+        itp = Itp(self.chemName,self.moltype,self.atomTable(),self.bondlist,
                        self.conlist,
                        self.anglist,self.dihlist)
-        itp.write(fname+'.itp') 
-        top = open(fname+'.top','w')
-        top.write('#include "martini.itp"\n')
-        top.write('#include "{}"\n'.format(fname+'.itp'))
-        top.write('[ system ]\n\n')
-        top.write('; name\n')
-        top.write('{} system\n\n'.format(self.chemName))
-        top.write('[ molecules ]\n\n')
-        top.write('; name \t number\n\n')
-        top.write('{} \t {}\n'.format(self.moltype[0],self.moltype[1]))
+        target.add(fname+'.itp',itp.text())
+        target.add(fname+'.top',self.topText(fname))
+
+#bump whenever the layout of the parsed template changes
+TEMPLATECACHEVERSION = 2
+
+def _fileSignature(fname):
+    """
+    Cheap signature of a file: absolute path, modification time and size
+    """
+    stat = os.stat(fname)
+    return (os.path.abspath(fname),stat.st_mtime,stat.st_size)
+
+def _fileHash(fname):
+    """
+    sha1 hex digest of the contents of a file
+    """
+    fid = open(fname,'rb')
+    digest = hashlib.sha1(fid.read()).hexdigest()
+    fid.close()
+    return digest
+
+def templateCacheName(itpname,groname):
+    """
+    Name of the sidecar file holding the parsed template for a pair of
+    itp and gro files, ie DFAG.itp.DFAG.gro.cache next to the itp file
+    """
+    return itpname + '.' + os.path.basename(groname) + '.cache'
+
+def loadTemplateCache(itpname,groname):
+    """
+    Load a parsed template topology from its sidecar cache, if the cache
+    exists and still matches the itp and gro files.  The modification times
+    and sizes are checked first; if those differ, the file hashes decide.
+    
+    ----------
+    Parameters
+    ----------
+    itpname: string
+        template itp file
+    groname: string
+        template gro file
+        
+    -------
+    Returns
+    -------
+    state: dict or None
+        the attributes of the parsed DXXXTopology, None on a cache miss
+    """
+    cachename = templateCacheName(itpname,groname)
+    if not os.path.isfile(cachename):
+        return None
+    try:
+        fid = open(cachename,'rb')
+        cached = pickle.load(fid)
+        fid.close()
+    except Exception:
+        warn('Unreadable template cache {}, reparsing.'.format(cachename))
+        return None
+    if cached.get('version') != TEMPLATECACHEVERSION:
+        return None
+    signatures = [_fileSignature(itpname),_fileSignature(groname)]
+    if signatures == cached['signatures']:
+        return cached['state']
+    hashes = [_fileHash(itpname),_fileHash(groname)]
+    if hashes == cached['hashes']:
+        #files were touched but not changed, so refresh the signatures
+        saveTemplateCache(itpname,groname,cached['state'],hashes)
+        return cached['state']
+    return None
+
+def saveTemplateCache(itpname,groname,state,hashes=None):
+    """
+    Write a parsed template topology to its sidecar cache.  The file is 
+    written under a temporary name and then renamed, so concurrent readers
+    never see a partial cache.
+    
+    ----------
+    Parameters
+    ----------
+    itpname: string
+        template itp file
+    groname: string
+        template gro file
+    state: dict
+        the attributes of the parsed DXXXTopology
+    hashes: list of two strings
+        file hashes of the itp and gro files, computed if not given
+    """
+    if hashes is None:
+        hashes = [_fileHash(itpname),_fileHash(groname)]
+    cached = {'version':TEMPLATECACHEVERSION,
+              'signatures':[_fileSignature(itpname),_fileSignature(groname)],
+              'hashes':hashes,
+              'state':state}
+    cachename = templateCacheName(itpname,groname)
+    tmpname = cachename + '.' + str(os.getpid())
+    fid = open(tmpname,'wb')
+    pickle.dump(cached,fid,pickle.HIGHEST_PROTOCOL)
+    fid.close()
+    os.rename(tmpname,cachename)
 
 class DXXXTopology(Topology):
     """
@@ -884,17 +2312,104 @@ class DXXXTopology(Topology):
         """
         Topology.__init__(self)
         
-    def __init__(self,itpname,groname):
+    def __init__(self,itpname,groname,cache=False):
         """
         Initialize topology from a base itp file (preferably DFAG) and grofile
         
         ----------
         Parameters
         ----------
-        fname: string
+        itpname: string
             location of topology file to initialize from
+        groname: string
+            location of the matching coordinate file
+        cache: bool
+            if True, load the parsed template from a sidecar cache next to
+            the itp file when it is up to date, and write one otherwise
         """
         Topology.__init__(self)
+        if cache:
+            state = loadTemplateCache(itpname,groname)
+            if state is not None:
+                self.setTemplateState(state)
+                return
+        self.readTemplate(itpname,groname)
+        if cache:
+            saveTemplateCache(itpname,groname,self.getTemplateState())
+    
+    def getTemplateState(self):
+        """
+        Flatten the topology into plain tuples and arrays for caching
+        
+        -------
+        Returns
+        -------
+        state: dict
+            title, moltype, box, atom records, N x 3 pos and vel arrays, and
+            for each of bondlist/conlist/anglist/dihlist a list of 
+            (atom indices,params,notes)
+        """
+        atomIndex = dict([(id(atom),ind) for (ind,atom) \
+                          in enumerate(self.atomlist)])
+        state = {'title':self.title,'moltype':list(self.moltype),
+                 'box':list(self.box),'chemName':self.chemName}
+        state['atoms'] = [(atom.resNo,atom.resname,atom.name,atom.number,
+                           atom.btype,atom.charge,atom.structure) \
+                          for atom in self.atomlist]
+        state['pos'] = np.array([atom.pos for atom in self.atomlist])
+        state['vel'] = np.array([atom.vel for atom in self.atomlist])
+        for lname in ['bondlist','conlist','anglist','dihlist']:
+            state[lname] = [(tuple([atomIndex[id(a)] for a in entry.ainds]),
+                             entry.params,entry.notes) \
+                            for entry in getattr(self,lname)]
+        return state
+    
+    def setTemplateState(self,state):
+        """
+        Rebuild the topology from the output of getTemplateState
+        
+        ----------
+        Parameters
+        ----------
+        state: dict
+            see getTemplateState
+        """
+        Topology.__init__(self)
+        self.title = state['title']
+        self.moltype = list(state['moltype'])
+        self.box = list(state['box'])
+        self.chemName = state['chemName']
+        pos = np.array(state['pos'],dtype=float).reshape((-1,3))
+        vel = np.array(state['vel'],dtype=float).reshape((-1,3))
+        for (ind,record) in enumerate(state['atoms']):
+            (resNo,resname,name,number,btype,charge,structure) = record
+            A = Bead(resNo,resname,name,number,pos[ind].copy(),
+                     vel[ind].copy(),btype)
+            A.charge = charge
+            A.structure = structure
+            self.atomlist.append(A)
+        for (lname,kind) in [('bondlist',Bond),('conlist',Bond),
+                             ('anglist',Angle),('dihlist',Dihedral)]:
+            blist = getattr(self,lname)
+            #the template was already checked for disjoint bonds when it
+            #was first parsed, so don't warn again
+            for (inds,params,notes) in state[lname]:
+                blist.append(kind([self.atomlist[i] for i in inds],
+                                  list(params),notes,True))
+        self.indexResidues()
+            
+    def readTemplate(self,itpname,groname):
+        """
+        Parse a base itp file and its gro file into this topology
+        
+        ----------
+        Parameters
+        ----------
+        itpname: string
+            location of topology file to initialize from
+        groname: string
+            location of the matching coordinate file
+        """
         fid = open(itpname)
         topology = fid.readlines()
         fid.close()
@@ -967,9 +2482,10 @@ class DXXXTopology(Topology):
                         (beads,params,notes) = self.__bangle__(spline,4)
                         D = Dihedral(beads,params,notes)
                         self.dihlist.append(D)
+        self.indexResidues()
         
     
-    def write(self,fname):
+    def write(self,fname,target=None):
         """
         Write out an itp file, a top file and a gro file corresponding to 
         the system
@@ -979,23 +2495,19 @@ class DXXXTopology(Topology):
         ----------
         fname: string
             the base name to use for both fname.itp and fname.gro
+        target: DirectoryTarget, MemoryTarget or ArchiveTarget
+            where to put the files, by default plain files on disk
         """
         title = 'This file was created by createMartiniModel for the DXXX-OPV3-XXXD system with side residues PHE, ALA, and GLY'
-        gro = Gro(title,len(self.atomlist),self.atomlist,self.box)
-        gro.write(fname+'.gro')
-        itp = Itp(self.chemName,self.moltype,self.atomlist,self.bondlist,
+        if target is None:
+            target = DirectoryTarget()
+        gro = Gro(title,len(self.atomlist),self.atomTable(),self.box)
+        target.add(fname+'.gro',gro.text())
+        itp = Itp(self.chemName,self.moltype,self.atomTable(),self.bondlist,
                        self.conlist,
                        self.anglist,self.dihlist)
-        itp.write(fname+'.itp') 
-        top = open(fname+'.top','w')
-        top.write('#include "martini.itp"\n')
-        top.write('#include "{}"\n'.format(fname+'.itp'))
-        top.write('[ system ]\n\n')
-        top.write('; name\n')
-        top.write('{} system\n\n'.format(self.chemName))
-        top.write('[ molecules ]\n\n')
-        top.write('; name \t number\n\n')
-        top.write('{} \t {}\n'.format(self.moltype[0],self.moltype[1]))
+        target.add(fname+'.itp',itp.text())
+        target.add(fname+'.top',self.topText(fname))
     
     def resSwap(self,name,structure,resID):
         """
@@ -1027,10 +2539,8 @@ class DXXXTopology(Topology):
             Once again make sure to renumber the atoms that come after these 
             atoms.
         """
-        IDs = []
-        for atom in self.atomlist:
-            if atom.resNo == resID:
-                IDs.append(atom.number-1)
+        IDs = [self.atomlist[ind].number-1 for ind in \
+               self.resAtomIndices(resID)]
         #pdb.set_trace()
         ind0 = min(IDs)
         newRes = self.createRes(name,structure,ind0)
@@ -1040,7 +2550,108 @@ class DXXXTopology(Topology):
         
         self.addRes(newRes,resID,ind0)
     
+    def resSwapMany(self,mutations):
+        """
+        Swap out several residues at once.  The result is identical to 
+        calling resSwap for each residue in turn, but the atomlist is only
+        renumbered, and each Blist only rebuilt, once.
         
+        ----------
+        Parameters
+        ----------
+        mutations: dict or list
+            {resID: (name,structure)}, applied in order of increasing resID,
+            or a list of (resID,(name,structure)) pairs, applied in the order
+            given
+        
+        -----
+        Notes
+        -----
+        Every bonded term gets an ordering key: (position,) for the terms 
+        already in a Blist, and anchorKey + (-swap,i) for the i-th term of a
+        swap inserted after the term with anchorKey (anchorKey is () when
+        inserting at the front).  Later insertions after the same anchor 
+        sort first, exactly as list insertion in insertByResIndex would
+        place them, so sorting the surviving terms by key reproduces the 
+        order the sequential swaps would give.
+        """
+        if isinstance(mutations,dict):
+            order = sorted(mutations.items())
+        else:
+            order = list(mutations)
+        resIDs = [resID for (resID,change) in order]
+        if len(set(resIDs)) != len(resIDs):
+            raise ValueError('A residue can only be swapped once per pass.')
+        lists = [self.bondlist,self.conlist,self.anglist,self.dihlist]
+        keys = {}
+        for blist in lists:
+            for (pos,entry) in enumerate(blist.entries):
+                keys[id(entry)] = (pos,)
+        removed = set()
+        added = [[] for blist in lists]
+        addedIndex = [{} for blist in lists]
+        newAtoms = {}
+        neighbours = {}
+        
+        def containing(lind,beads):
+            #entries currently in list lind that contain any of the beads
+            found = []
+            for bead in beads:
+                for entry in lists[lind].beadIndex.get(bead,[]) + \
+                             addedIndex[lind].get(bead,[]):
+                    if id(entry) not in removed:
+                        found.append(entry)
+            return found
+        
+        for (swap,(resID,(name,structure))) in enumerate(order):
+            inds = self.resAtomIndices(resID)
+            oldBeads = [self.atomlist[ind] for ind in inds]
+            newRes = self.createRes(name,structure,inds[0],neighbours)
+            if resID-1 in newAtoms:
+                prevBeads = newAtoms[resID-1]
+            else:
+                prevBeads = [self.atomlist[ind] for ind in \
+                             self.resAtomIndices(resID-1)]
+            for lind in range(len(lists)):
+                for entry in containing(lind,oldBeads):
+                    removed.add(id(entry))
+                candidates = [keys[id(entry)] for entry in \
+                              containing(lind,prevBeads)]
+                if len(candidates) > 0:
+                    anchorKey = max(candidates)
+                else:
+                    anchorKey = ()
+                for (i,entry) in enumerate(newRes[lind+1]):
+                    keys[id(entry)] = anchorKey + (-(swap+1),i)
+                    added[lind].append(entry)
+                    for a in entry.ainds:
+                        addedIndex[lind].setdefault(a,[]).append(entry)
+            newAtoms[resID] = newRes[0]
+            neighbours[resID] = newRes[0][0]
+        
+        #one pass over the atoms to splice in the new residues and renumber
+        natomlist = []
+        for atom in self.atomlist:
+            if atom.resNo in newAtoms:
+                if len(newAtoms[atom.resNo]) > 0:
+                    for newAtom in newAtoms[atom.resNo]:
+                        newAtom.resNo = atom.resNo
+                        natomlist.append(newAtom)
+                    newAtoms[atom.resNo] = []
+            else:
+                natomlist.append(atom)
+        for (ind,atom) in enumerate(natomlist):
+            atom.number = ind+1
+        self.atomlist = natomlist
+        self.indexResidues()
+        
+        #one pass per Blist to drop the removed terms and order the rest
+        for lind in range(len(lists)):
+            survivors = [entry for entry in lists[lind].entries + added[lind] \
+                         if id(entry) not in removed]
+            survivors.sort(key=lambda entry: keys[id(entry)])
+            lists[lind]._setEntries(survivors)
+    
     def removeRes(self,resID):
         """
         Remove the residue comprised of the atoms with the given resID
@@ -1059,16 +2670,12 @@ class DXXXTopology(Topology):
         * find and remove all beads with the given indices
         * renumber all beads with indices larger than the given indices
         """
-        IDs = []
-        for atom in self.atomlist:
-            if atom.resNo == resID:
-                IDs.append(atom.number)
+        IDs = set([self.atomlist[ind].number for ind in \
+                   self.resAtomIndices(resID)])
                 
-        for ID in IDs:
-            self.bondlist.removeByIndex(ID)
-            self.conlist.removeByIndex(ID)
-            self.anglist.removeByIndex(ID)
-            self.dihlist.removeByIndex(ID)
+        beads = [self.atomlist[ind] for ind in self.resAtomIndices(resID)]
+        for blist in [self.bondlist,self.conlist,self.anglist,self.dihlist]:
+            blist.removeByAtoms(beads)
         
         reind = 0
         
@@ -1082,6 +2689,7 @@ class DXXXTopology(Topology):
             else:
                 reind -= 1
         self.atomlist = natomlist
+        self.indexResidues()
     
     def addRes(self,newRes,resID,ind):
         """
@@ -1129,17 +2737,301 @@ class DXXXTopology(Topology):
             newatoms.append(atom)
         #pdb.set_trace()
         self.atomlist = newatoms
-        self.bondlist.insertByResIndex(resBonds,resID)
-        self.conlist.insertByResIndex(resCons,resID)
-        self.anglist.insertByResIndex(resAngs,resID)
-        self.dihlist.insertByResIndex(resDihs,resID)
+        self.indexResidues()
+        prevBeads = [self.atomlist[i] for i in self.resAtomIndices(resID-1)]
+        self.bondlist.insertByResIndex(resBonds,resID,prevBeads)
+        self.conlist.insertByResIndex(resCons,resID,prevBeads)
+        self.anglist.insertByResIndex(resAngs,resID,prevBeads)
+        self.dihlist.insertByResIndex(resDihs,resID,prevBeads)
         
 
-def main():
+class PeptideTopology(DXXXTopology):
     """
-    A function that creates and writes out itp, top, and gro files for
-    use with Gromacs, for DXXX peptides. 
-    Parameters are given via the command-line.
+    Topology of a DX_n-OPV3-X_nD type molecule with peptide arms of any 
+    length, assembled directly from the residue sequence instead of by 
+    swapping residues into a template one at a time
+    
+    The OPV3 core (every residue of the template that is not in the Martini
+    2.2 side chain tables) and all the bonded terms among its beads are 
+    copied from the template; everything else is built from the Martini 2.2
+    lookup tables in a single pass over the sequence.
+    
+    ----------
+    Attributes
+    ----------
+    see DXXXTopology
+    leftArm: list of strings
+        residue names of the N-terminal arm, from the terminus to the core
+    rightArm: list of strings
+        residue names of the C-terminal arm, from the core to the terminus
+    """
+    def __init__(self,leftArm,rightArm,structure='C',template=None,
+                 itpname='DFAG.itp',groname='DFAG.gro'):
+        """
+        Build the topology of the given sequence
+        
+        ----------
+        Parameters
+        ----------
+        leftArm: list of strings
+            residue names of the N-terminal arm, from the terminus to the core
+            (ie ['PAS','PHE','ALA','GLY'] for DFAG)
+        rightArm: list of strings
+            residue names of the C-terminal arm, from the core to the terminus
+            (ie ['GLY','ALA','PHE','PAS'] for DFAG)
+        structure: string
+            secondary structure of the arm residues, either a single code 
+            for all of them or one code per residue of leftArm + rightArm
+        template: DXXXTopology
+            template to take the core and the box from, read from itpname
+            and groname if not given
+        itpname: string
+            location of the template topology file
+        groname: string
+            location of the template coordinate file
+            
+        -----
+        Notes
+        -----
+        Bonded terms between backbone beads are built for every window of
+        consecutive residues that contains at least one arm residue.  Each
+        window takes its parameters from the highest numbered arm residue
+        in it, which is the residue that would have created it last when
+        swapping the arm residues into a template in order of increasing
+        resID, so a sequence with the template's arm lengths gives the same
+        bonds, constraints and dihedrals as resSwapMany on the template.
+        Unlike sequential swaps, every side chain keeps its backbone-
+        backbone-side chain angle, which always points towards the core.
+        
+        Arm backbone beads are placed on the template's arm beads, counting
+        outwards from the core, and beyond those continue in a straight 
+        line along the direction of the last two template beads.  Side 
+        chains are then placed with placeSideChains.
+        """
+        Topology.__init__(self)
+        if template is None:
+            template = DXXXTopology(itpname,groname)
+        self.leftArm = list(leftArm)
+        self.rightArm = list(rightArm)
+        narm = len(self.leftArm) + len(self.rightArm)
+        if len(structure) == 1:
+            structures = [structure] * narm
+        elif len(structure) == narm:
+            structures = list(structure)
+        else:
+            raise ValueError('Need one secondary structure code or one per arm residue.')
+        ff = getForceField()
+        
+        #find the core in the template
+        template.indexResidues()
+        resNos = sorted(template.resRange.keys())
+        coreNos = [resNo for resNo in resNos if \
+                   template.atomlist[template.resRange[resNo][0]].resname \
+                   not in ff.sidechains]
+        if len(coreNos) == 0:
+            raise ValueError('Template has no core residues.')
+        if coreNos != range(coreNos[0],coreNos[-1]+1):
+            raise ValueError('Template core residues are not contiguous.')
+        templateLeft = [template.bbBead(resNo).pos for resNo in \
+                        range(coreNos[0]-1,resNos[0]-1,-1)]
+        templateRight = [template.bbBead(resNo).pos for resNo in \
+                         range(coreNos[-1]+1,resNos[-1]+1)]
+        nleft = len(self.leftArm)
+        ncore = len(coreNos)
+        nres = narm + ncore
+        self.title = template.title
+        self.box = list(template.box)
+        self.moltype = list(template.moltype)
+        self.chemName = template.chemName
+        
+        #residue by residue: names, parameters (None for the core) and beads
+        names = []
+        rps = []
+        residues = []
+        for (i,name) in enumerate(self.leftArm):
+            names.append(name)
+            rps.append(ff.residueParameters(name,structures[i]))
+        beadMap = {}
+        coreStart = template.resRange[coreNos[0]][0]
+        coreStop = template.resRange[coreNos[-1]][1]
+        for atom in template.atomlist[coreStart:coreStop]:
+            beadMap[id(atom)] = atom.copy()
+        for resNo in coreNos:
+            names.append(template.atomlist[template.resRange[resNo][0]].resname)
+            rps.append(None)
+        for (i,name) in enumerate(self.rightArm):
+            names.append(name)
+            rps.append(ff.residueParameters(name,structures[nleft+i]))
+        coreFirst = template.bbBead(coreNos[0]).pos
+        coreLast = template.bbBead(coreNos[-1]).pos
+        leftPos = self.armPositions(templateLeft,coreFirst,
+                                    [rps[i]['bbbond'][1] for i in \
+                                     range(nleft-1,-1,-1)],
+                                    coreFirst - coreLast)[::-1]
+        rightPos = self.armPositions(templateRight,coreLast,
+                                     [rps[i]['bbbond'][1] for i in \
+                                      range(nleft+ncore,nres)],
+                                     coreLast - coreFirst)
+        armPos = list(leftPos) + [None] * ncore + list(rightPos)
+        
+        bbBeads = []
+        for ri in range(nres):
+            resNo = ri + 1
+            if rps[ri] is None:
+                coreNo = coreNos[ri-nleft]
+                (start,stop) = template.resRange[coreNo]
+                resBeads = [beadMap[id(atom)] for atom in \
+                            template.atomlist[start:stop]]
+                for atom in resBeads:
+                    atom.resNo = resNo
+                bbBeads.append(beadMap[id(template.bbBead(coreNo))])
+            else:
+                rp = rps[ri]
+                bbbead = Bead(resNo,names[ri],'BB',0,armPos[ri].copy(),
+                              np.array([0.,0.,0.]),rp['bbtype'])
+                if rp['bbcharge'] is not None:
+                    bbbead.charge = rp['bbcharge']
+                resBeads = [bbbead]
+                if len(rp['sctypes']) > 0:
+                    scpos = self.getSCPos(rp['scbonds'],bbbead.pos,
+                                          len(rp['sctypes']))
+                    for sci in range(len(rp['sctypes'])):
+                        scbead = Bead(resNo,names[ri],'SC'+str(sci+1),0,
+                                      scpos[sci,:],np.array([0.,0.,0.]),
+                                      rp['sctypes'][sci])
+                        if rp['sccharges'][sci] is not None:
+                            scbead.charge = rp['sccharges'][sci]
+                        resBeads.append(scbead)
+                bbBeads.append(bbbead)
+            residues.append(resBeads)
+            self.atomlist += resBeads
+        for (ind,atom) in enumerate(self.atomlist):
+            atom.number = ind+1
+        
+        #bonded terms, in residue order
+        lists = {'bond':[],'constraint':[],'angle':[],'dihedral':[]}
+        kinds = {'bond':Bond,'constraint':Bond,'angle':Angle,
+                 'dihedral':Dihedral}
+        for ri in range(nres):
+            rp = rps[ri]
+            if rp is None:
+                if ri == nleft:
+                    for (src,lname) in [(template.bondlist,'bond'),
+                                        (template.conlist,'constraint'),
+                                        (template.anglist,'angle'),
+                                        (template.dihlist,'dihedral')]:
+                        lists[lname] += [entry.remap(beadMap) for entry in \
+                                         src if all([id(a) in beadMap for a \
+                                                     in entry.ainds])]
+                continue
+            #backbone windows whose highest numbered arm residue is this one
+            if rp['bbconstraint']:
+                bbkind = 'constraint'
+            else:
+                bbkind = 'bond'
+            for (shiftID,params,lname) in [(1,rp['bbbond'],bbkind),
+                                           (2,rp['bbangle'],'angle'),
+                                           (3,rp['bbdihedral'],'dihedral')]:
+                if params is None:
+                    continue
+                if ri == nleft-1:
+                    ends = range(ri,min(ri+shiftID,nleft+ncore-1)+1)
+                else:
+                    ends = [ri]
+                for end in ends:
+                    if end-shiftID < 0:
+                        continue
+                    beads = bbBeads[end-shiftID:end+1]
+                    notes = ''.join([bead.resname + '-' for bead in beads])
+                    lists[lname].append(kinds[lname](beads,list(params),
+                                                     notes,True))
+            if len(rp['sctypes']) == 0:
+                continue
+            #backbone-backbone-side chain angle, pointing towards the core
+            resBeads = residues[ri]
+            if ri < nleft:
+                beads = [resBeads[1],resBeads[0],bbBeads[ri+1]]
+            else:
+                beads = [bbBeads[ri-1],resBeads[0],resBeads[1]]
+            notes = '-'.join([bead.resname for bead in beads])
+            lists['angle'].append(Angle(beads,list(rp['bbsangle']),notes,
+                                        True))
+            for (kind,inds,params) in rp['scterms']:
+                beads = [resBeads[ind] for ind in inds]
+                notes = ''.join([bead.resname + '-' for bead in beads])
+                lists[kind].append(kinds[kind](beads,list(params),notes,True))
+        self.bondlist._setEntries(lists['bond'])
+        self.conlist._setEntries(lists['constraint'])
+        self.anglist._setEntries(lists['angle'])
+        self.dihlist._setEntries(lists['dihedral'])
+        self.indexResidues()
+        self.placeSideChains(range(1,nleft+1) + range(nleft+ncore+1,nres+1))
+    
+    def armPositions(self,refs,anchor,bondLengths,away):
+        """
+        Place the backbone beads of one arm, counting outwards from the core
+        
+        ----------
+        Parameters
+        ----------
+        refs: list of numpy arrays
+            template backbone positions of the arm, outwards from the core
+        anchor: numpy array
+            position of the core backbone bead the arm is attached to
+        bondLengths: list of floats
+            backbone bond length of each new arm residue, outwards from the
+            core
+        away: numpy array
+            direction to grow the arm in when the template arm has no beads
+            
+        -------
+        Returns
+        -------
+        pos: numpy array, n x 3
+            backbone positions of the n new arm residues
+        """
+        n = len(bondLengths)
+        pos = np.zeros((n,3))
+        m = min(n,len(refs))
+        for i in range(m):
+            pos[i,:] = refs[i]
+        if n == m:
+            return pos
+        if m >= 2:
+            direction = pos[m-1,:] - pos[m-2,:]
+        elif m == 1:
+            direction = pos[0,:] - anchor
+        else:
+            direction = np.array(away,dtype=float)
+        if m > 0:
+            last = pos[m-1,:]
+        else:
+            last = np.array(anchor,dtype=float)
+        direction = direction/np.sqrt(np.sum(direction**2))
+        steps = np.cumsum(bondLengths[m:])
+        pos[m:,:] = last + steps[:,None]*direction
+        return pos
+    
+
+#the twenty standard amino acids, as named in the martini22 lookup tables
+AMINOACIDS = ['ALA','ARG','ASN','ASP','CYS','GLN','GLU','GLY','HIS','ILE',
+              'LEU','LYS','MET','PHE','PRO','SER','THR','TRP','TYR','VAL']
+
+#one letter codes used for naming generated chemistries
+ONELETTER = {'ALA':'A','ARG':'R','ASN':'N','ASP':'D','CYS':'C','GLN':'Q',
+             'GLU':'E','GLY':'G','HIS':'H','ILE':'I','LEU':'L','LYS':'K',
+             'MET':'M','PHE':'F','PRO':'P','SER':'S','THR':'T','TRP':'W',
+             'TYR':'Y','VAL':'V'}
+
+#residue IDs of the X, Y, and Z positions in the DFAG template, for the
+#N-terminal and C-terminal arms respectively
+LEFTARM = [2,3,4]
+RIGHTARM = [14,13,12]
+
+def swapList(residues,symmetry):
+    """
+    Find the residue swaps needed to turn the DFAG template into a DXYZ
+    chemistry
     
     ----------
     Parameters
@@ -1150,6 +3042,574 @@ def main():
         if symmetry is true, we are of the form DXYZ-OPV3-ZYXD
         else, we are of the form DXYZ-OPV3-XYZD
         
+    -------
+    Returns
+    -------
+    swaps: list of (string,int)
+        residue name and residue ID for each swap
+    """
+    swaps = [(res,resID) for (res,resID) in zip(residues,LEFTARM)]
+    if symmetry:
+        swaps += [(res,resID) for (res,resID) in zip(residues,RIGHTARM)]
+    else:
+        swaps += [(res,resID) for (res,resID) in zip(residues,
+                                                    RIGHTARM[::-1])]
+    return swaps
+
+def chemistryName(residues,symmetry):
+    """
+    Deterministic name for a chemistry, ie DFAG_sym or DFAG_asym
+    
+    ----------
+    Parameters
+    ----------
+    residues: list of three strings
+        the three amino acids of the DXXX side chain, in order
+    symmetry: bool
+        whether the chemistry is of the form DXYZ-OPV3-ZYXD
+    """
+    name = 'D' + ''.join([ONELETTER.get(res,res) for res in residues])
+    if symmetry:
+        return name + '_sym'
+    return name + '_asym'
+
+def mutateTemplate(template,residues,symmetry,structure='C',
+                   placeSideChains=True):
+    """
+    Create a new DXXXTopology from a template without touching the template
+    
+    ----------
+    Parameters
+    ----------
+    template: DXXXTopology
+        parsed DFAG (or similar) base topology
+    residues: list of three strings
+        the three amino acids of the DXXX side chain, in order
+    symmetry: bool
+        whether the chemistry is of the form DXYZ-OPV3-ZYXD
+    structure: string
+        secondary structure of the swapped in residues, coil by default
+    placeSideChains: bool
+        re-place the swapped in side chains pointing away from their
+        neighbouring backbone beads (see Topology.placeSideChains), rather
+        than leaving them in the yz-plane where getSCPos puts them
+        
+    -------
+    Returns
+    -------
+    Top: DXXXTopology
+        the new topology
+    """
+    Top = template.clone()
+    swaps = swapList(residues,symmetry)
+    Top.resSwapMany([(resID,(name,structure)) for (name,resID) in swaps])
+    if placeSideChains:
+        Top.placeSideChains([resID for (name,resID) in swaps])
+    Top.chemName = chemistryName(residues,symmetry)
+    return Top
+
+def constructTopology(residues,symmetry,itpname='DFAG.itp',
+                      groname='DFAG.gro'):
+    """
+    Build the Itp and Gro objects for a single DXYZ chemistry starting from
+    the DFAG template files
+    
+    ----------
+    Parameters
+    ----------
+    residues: list of three strings
+        the three amino acids of the DXXX side chain, in order
+    symmetry: bool
+        whether the chemistry is of the form DXYZ-OPV3-ZYXD
+    itpname: string
+        template itp file
+    groname: string
+        template gro file
+        
+    -------
+    Returns
+    -------
+    itp: Itp
+    gro: Gro
+    """
+    template = DXXXTopology(itpname,groname)
+    Top = mutateTemplate(template,residues,symmetry)
+    title = 'This file was created by createMartiniModel for ' + \
+            chemistryName(residues,symmetry)
+    gro = Gro(title,len(Top.atomlist),Top.atomlist,Top.box)
+    itp = Itp(Top.chemName,Top.moltype,Top.atomlist,Top.bondlist,Top.conlist,
+              Top.anglist,Top.dihlist)
+    return (itp,gro)
+
+def readManifest(fname):
+    """
+    Read a list of chemistries to generate from a manifest file
+    
+    ----------
+    Parameters
+    ----------
+    fname: string
+        name of the manifest file, in which each line contains three residue
+        names followed by sym or asym, ie "PHE ALA GLY sym".  Blank lines and
+        lines starting with ; or # are ignored.
+    
+    -------
+    Returns
+    -------
+    specs: list of ([string,string,string],bool)
+        residues and symmetry of each chemistry
+    """
+    specs = []
+    fid = open(fname)
+    for line in fid:
+        spline = line.split()
+        if len(spline) == 0 or spline[0][0] in ';#':
+            continue
+        if len(spline) != 4 or spline[3] not in ['sym','asym']:
+            raise ValueError('Cannot parse manifest line: ' + line.strip())
+        specs.append(([res.upper() for res in spline[0:3]],
+                      spline[3] == 'sym'))
+    fid.close()
+    return specs
+
+def combinatorialSpec(residues=AMINOACIDS,symmetries=(True,False)):
+    """
+    Enumerate every X,Y,Z triple that can be built from a set of residues
+    
+    ----------
+    Parameters
+    ----------
+    residues: list of strings
+        the amino acids to draw X, Y, and Z from
+    symmetries: tuple of bools
+        which of the symmetric and antisymmetric forms to generate
+        
+    -------
+    Returns
+    -------
+    specs: list of ([string,string,string],bool)
+        residues and symmetry of each chemistry, in a fixed order
+    """
+    specs = []
+    for symmetry in symmetries:
+        for triple in itertools.product(residues,repeat=3):
+            specs.append((list(triple),symmetry))
+    return specs
+
+#bump whenever a change to this module changes the files it writes
+OUTPUTCACHEVERSION = 2
+
+def _canonical(obj):
+    """
+    Deterministic string form of nested dicts, lists, tuples and scalars,
+    with dict items sorted by key
+    """
+    if isinstance(obj,dict):
+        return '{' + ','.join([_canonical(key) + ':' + _canonical(obj[key]) \
+                               for key in sorted(obj.keys())]) + '}'
+    if isinstance(obj,(list,tuple)):
+        return '[' + ','.join([_canonical(item) for item in obj]) + ']'
+    return repr(obj)
+
+def forceFieldHash():
+    """
+    sha1 hex digest of the parameter tables of the martini22 force field
+    """
+    params = dict([(key,value) for (key,value) in martini22().__dict__.items() \
+                   if not callable(value)])
+    return hashlib.sha1(_canonical(params).encode('utf-8')).hexdigest()
+
+def sourceHashes(itpname='DFAG.itp',groname='DFAG.gro'):
+    """
+    Hashes of everything besides the requested chemistry that determines
+    the generated files
+    
+    ----------
+    Parameters
+    ----------
+    itpname: string
+        template itp file
+    groname: string
+        template gro file
+        
+    -------
+    Returns
+    -------
+    hashes: tuple of strings
+        hashes of the itp file, the gro file, and the force field 
+        parameters
+    """
+    return (_fileHash(itpname),_fileHash(groname),forceFieldHash())
+
+def outputKey(residues,symmetry,sources,structure='C',placeSideChains=True):
+    """
+    Content address of the files generated for one chemistry
+    
+    ----------
+    Parameters
+    ----------
+    residues: list of three strings
+        the three amino acids of the DXXX side chain, in order
+    symmetry: bool
+        whether the chemistry is of the form DXYZ-OPV3-ZYXD
+    sources: tuple of strings
+        see sourceHashes
+    structure: string
+        secondary structure of the swapped residues
+    placeSideChains: bool
+        whether the swapped side chains were re-placed (see mutateTemplate)
+        
+    -------
+    Returns
+    -------
+    key: string
+        sha1 hex digest
+    """
+    description = _canonical([OUTPUTCACHEVERSION,list(sources),
+                              [res.upper() for res in residues],
+                              bool(symmetry),structure,
+                              bool(placeSideChains)])
+    return hashlib.sha1(description.encode('utf-8')).hexdigest()
+
+class OutputCache(object):
+    """
+    Content-addressed store of generated files.  Each entry is a directory
+    named by its key (see outputKey) holding that chemistry's files.  When
+    the store grows past maxBytes, the least recently used entries are 
+    removed.
+    
+    ----------
+    Attributes
+    ----------
+    directory: string
+        where the entries live
+    maxBytes: int
+        size bound of the store, None for no bound
+    totalBytes: int
+        current size of the store
+    entries: OrderedDict
+        key -> size in bytes, from least to most recently used
+    """
+    def __init__(self,directory,maxBytes=None):
+        self.directory = directory
+        self.maxBytes = maxBytes
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        self.scan()
+    
+    def scan(self):
+        """
+        Rebuild the entry index from the store on disk
+        """
+        found = []
+        for key in os.listdir(self.directory):
+            path = os.path.join(self.directory,key)
+            if key.startswith('.') or not os.path.isdir(path):
+                continue
+            size = sum([os.path.getsize(os.path.join(path,fname)) \
+                        for fname in os.listdir(path)])
+            found.append((os.path.getmtime(path),key,size))
+        found.sort()
+        self.entries = collections.OrderedDict([(key,size) for \
+                                                (mtime,key,size) in found])
+        self.totalBytes = sum(self.entries.values())
+    
+    def get(self,key):
+        """
+        Look up an entry, marking it as recently used
+        
+        ----------
+        Parameters
+        ----------
+        key: string
+        
+        -------
+        Returns
+        -------
+        paths: list of strings or None
+            the cached files, None on a miss
+        """
+        if key not in self.entries:
+            return None
+        path = os.path.join(self.directory,key)
+        if not os.path.isdir(path):
+            self.totalBytes -= self.entries.pop(key)
+            return None
+        os.utime(path,None)
+        self.entries[key] = self.entries.pop(key)
+        return [os.path.join(path,fname) for fname in sorted(os.listdir(path))]
+    
+    def put(self,key,files):
+        """
+        Store an entry, then evict old entries if the store is too big
+        
+        ----------
+        Parameters
+        ----------
+        key: string
+        files: list of (string,string)
+            (file name,contents) of each file; only the base names are kept
+            
+        -------
+        Returns
+        -------
+        paths: list of strings
+            the cached files
+        """
+        path = os.path.join(self.directory,key)
+        if key in self.entries:
+            self.totalBytes -= self.entries.pop(key)
+            shutil.rmtree(path,True)
+        tmppath = os.path.join(self.directory,'.tmp.' + key + '.' + \
+                               str(os.getpid()))
+        os.makedirs(tmppath)
+        size = 0
+        for (fname,text) in files:
+            writeOutput(os.path.join(tmppath,os.path.basename(fname)),text)
+            size += os.path.getsize(os.path.join(tmppath,
+                                                 os.path.basename(fname)))
+        os.rename(tmppath,path)
+        self.entries[key] = size
+        self.totalBytes += size
+        self.evict()
+        return [os.path.join(path,os.path.basename(fname)) \
+                for (fname,text) in files]
+    
+    def evict(self):
+        """
+        Remove least recently used entries until the store fits in 
+        maxBytes, always keeping the newest one
+        """
+        if self.maxBytes is None:
+            return
+        while self.totalBytes > self.maxBytes and len(self.entries) > 1:
+            (key,size) = self.entries.popitem(last=False)
+            shutil.rmtree(os.path.join(self.directory,key),True)
+            self.totalBytes -= size
+
+#template topology shared with library worker processes
+_libraryTemplate = None
+
+def _initLibraryWorker(template):
+    """
+    Pool initializer that hands the parsed template to a worker process
+    """
+    global _libraryTemplate
+    _libraryTemplate = template
+
+def _buildLibraryMember(job):
+    """
+    Pool task that builds and writes a single chemistry
+    
+    ----------
+    Parameters
+    ----------
+    job: (list of strings,bool,string,bool,bool)
+        residues, symmetry, output directory, whether to hand the files
+        back instead of writing them, and whether to re-place the swapped
+        side chains
+    
+    -------
+    Returns
+    -------
+    name: string
+        base name of the files written
+    files: list of (string,string)
+        (file name,contents) of each file if they were handed back, else 
+        None
+    """
+    (residues,symmetry,outdir,inMemory,placeSideChains) = job
+    name = chemistryName(residues,symmetry)
+    Top = mutateTemplate(_libraryTemplate,residues,symmetry,
+                         placeSideChains=placeSideChains)
+    if inMemory:
+        target = MemoryTarget()
+        Top.write(os.path.join(outdir,name),target)
+        return (name,[(fname,target.files[fname]) for fname in target.names])
+    Top.write(os.path.join(outdir,name))
+    return (name,None)
+
+def generateLibrary(specs,outdir='.',itpname='DFAG.itp',groname='DFAG.gro',
+                    nprocs=None,chunksize=8,cacheTemplate=False,bundle=None,
+                    cache=None,placeSideChains=True):
+    """
+    Build and write a whole library of chemistries in parallel.  The 
+    template files are only parsed once, in the parent process.
+    
+    ----------
+    Parameters
+    ----------
+    specs: list of ([string,string,string],bool)
+        residues and symmetry of each chemistry, as returned by readManifest
+        or combinatorialSpec
+    outdir: string
+        directory to write name.itp, name.gro, and name.top into
+    itpname: string
+        template itp file
+    groname: string
+        template gro file
+    nprocs: int
+        number of worker processes, by default the number of CPUs.  If 1,
+        everything runs in the calling process.
+    chunksize: int
+        number of chemistries handed to a worker at once
+    cacheTemplate: bool
+        load the parsed template from (or save it to) its sidecar cache
+    bundle: string
+        if given, write every file into this single archive (see 
+        ArchiveTarget) instead, with outdir as the directory inside it
+    cache: OutputCache or string
+        if given, chemistries already in this cache (or cache directory) 
+        are copied from it instead of being rebuilt, and new ones are added
+        to it
+    placeSideChains: bool
+        re-place the swapped in side chains clear of the backbone (see 
+        mutateTemplate); if False they are left where getSCPos puts them
+        
+    -------
+    Returns
+    -------
+    names: list of strings
+        base names of the written chemistries, in the order of specs
+    rate: float
+        throughput in molecules per second
+    """
+    start = time.time()
+    if bundle is None and not os.path.isdir(outdir):
+        os.makedirs(outdir)
+    keys = [None] * len(specs)
+    hits = {}
+    if cache is not None:
+        if not isinstance(cache,OutputCache):
+            cache = OutputCache(cache)
+        sources = sourceHashes(itpname,groname)
+        for (i,(residues,symmetry)) in enumerate(specs):
+            keys[i] = outputKey(residues,symmetry,sources,
+                                placeSideChains=placeSideChains)
+            paths = cache.get(keys[i])
+            if paths is not None:
+                hits[i] = paths
+    inMemory = bundle is not None or cache is not None
+    jobs = [(residues,symmetry,outdir,inMemory,placeSideChains) for \
+            (i,(residues,symmetry)) in enumerate(specs) if i not in hits]
+    if bundle is not None:
+        target = ArchiveTarget(bundle)
+    else:
+        target = DirectoryTarget()
+    names = []
+    pool = None
+    try:
+        if len(jobs) == 0:
+            results = iter([])
+        else:
+            template = DXXXTopology(itpname,groname,cacheTemplate)
+            #build the force field before forking so every worker shares it
+            getForceField()
+            if nprocs == 1:
+                _initLibraryWorker(template)
+                results = (_buildLibraryMember(job) for job in jobs)
+            else:
+                pool = multiprocessing.Pool(nprocs,_initLibraryWorker,
+                                            (template,))
+                results = pool.imap(_buildLibraryMember,jobs,chunksize)
+        #the archive and the cache are only ever written from this process
+        for i in range(len(specs)):
+            if i in hits:
+                names.append(chemistryName(*specs[i]))
+                for path in hits[i]:
+                    fid = open(path)
+                    target.add(os.path.join(outdir,os.path.basename(path)),
+                               fid.read())
+                    fid.close()
+                continue
+            (name,files) = next(results)
+            names.append(name)
+            if files is not None:
+                if cache is not None:
+                    cache.put(keys[i],files)
+                for (fname,text) in files:
+                    target.add(fname,text)
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+        target.close()
+    elapsed = time.time() - start
+    rate = len(names) / elapsed if elapsed > 0 else float('inf')
+    return (names,rate)
+
+def batchMain(argv):
+    """
+    Command-line entry point for generating a library of DXXX chemistries,
+    called as
+    
+        python createMartiniModel.py batch [options]
+        
+    Either a manifest (see readManifest) or a combinatorial set of residues
+    may be given; by default all 20^3 triples are built in both symmetric
+    and antisymmetric forms.
+    """
+    parser = argparse.ArgumentParser(description='build a library of DXXX \
+                                     peptide structures')
+    parser.add_argument('--manifest',metavar='M',default=None)
+    parser.add_argument('--residues',metavar='R',nargs='+',
+                        default=AMINOACIDS)
+    parser.add_argument('--symmetry',choices=['sym','asym','both'],
+                        default='both')
+    parser.add_argument('--outdir',metavar='O',default='.')
+    parser.add_argument('--nprocs',metavar='N',type=int,default=None)
+    parser.add_argument('--itp',metavar='I',default='DFAG.itp')
+    parser.add_argument('--gro',metavar='G',default='DFAG.gro')
+    parser.add_argument('--cache-template',dest='cacheTemplate',
+                        action='store_true')
+    parser.add_argument('--bundle',metavar='B',default=None)
+    parser.add_argument('--cache',metavar='C',default=None)
+    parser.add_argument('--cache-size',dest='cacheSize',metavar='MB',
+                        type=float,default=None)
+    parser.add_argument('--planar-side-chains',dest='placeSideChains',
+                        action='store_false')
+    args = parser.parse_args(argv)
+    if args.manifest is not None:
+        specs = readManifest(args.manifest)
+    else:
+        symmetries = {'sym':(True,),'asym':(False,),
+                      'both':(True,False)}[args.symmetry]
+        specs = combinatorialSpec(args.residues,symmetries)
+    if args.cache is not None:
+        if args.cacheSize is not None:
+            maxBytes = int(args.cacheSize * 1024 * 1024)
+        else:
+            maxBytes = None
+        cache = OutputCache(args.cache,maxBytes)
+    else:
+        cache = None
+    (names,rate) = generateLibrary(specs,args.outdir,args.itp,args.gro,
+                                   args.nprocs,
+                                   cacheTemplate=args.cacheTemplate,
+                                   bundle=args.bundle,cache=cache,
+                                   placeSideChains=args.placeSideChains)
+    if args.bundle is not None:
+        destination = args.bundle
+    else:
+        destination = args.outdir
+    print('Wrote {} molecules to {} ({:.1f} molecules/s)'.format(len(names),
+          destination,rate))
+
+def main(argv=None):
+    """
+    A function that creates and writes out itp, top, and gro files for
+    use with Gromacs, for DXXX peptides. 
+    Parameters are given via the command-line, or argv if it is given.
+    
+    ----------
+    Parameters
+    ----------
+    residues: list of three strings
+        the three amino acids of the DXXX side chain, in order
+    symmetry: sym or asym
+        if sym, we are of the form DXYZ-OPV3-ZYXD
+        if asym, we are of the form DXYZ-OPV3-XYZD
+        
     -------
     Returns
     -------
@@ -1159,12 +3619,12 @@ def main():
     """
     parser = argparse.ArgumentParser(description='get DXXX peptide structure')
     parser.add_argument('residues',metavar='R',nargs=3)
-    parser.add_argument('symmetry',metavar='S',type=bool)
+    parser.add_argument('symmetry',metavar='S',choices=['sym','asym'])
     parser.add_argument('pdbname',metavar='P')
     parser.add_argument('itpname',metavar='I')
-    args = parser.parse_args()
+    args = parser.parse_args(argv)
     residues = args.residues
-    symmetry = args.symmetry
+    symmetry = args.symmetry == 'sym'
     pdbname = args.pdbname
     itpname = args.itpname
     (Itp,Gro) = constructTopology(residues,symmetry)
@@ -1172,4 +3632,7 @@ def main():
     Itp.write(itpname)
 
 if __name__ == "__main__":
-    main()
+    if len(sys.argv) > 1 and sys.argv[1] == 'batch':
+        batchMain(sys.argv[2:])
+    else:
+        main()
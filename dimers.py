@@ -0,0 +1,316 @@
+# -*- coding: utf-8 -*-
+"""
+Rigid-body scan for dimer starting structures.  A second copy of a
+molecule is rotated over a quaternion grid and translated over spherical
+shells around the first; placements with overlapping beads are rejected
+with a cell list, the rest are scored with NonbondedModel, and the best
+distinct ones are written out as .gro files.  Run as
+
+python dimers.py name.itp name.gro [-o basename] [-k 5]
+
+to write basename_1.gro ... basename_5.gro, lowest energy first (basename
+defaults to name_dimer).
+"""
+from __future__ import absolute_import, division, print_function
+import os,argparse,numpy as np
+from createMartiniModel import DXXXTopology,AtomTable,Gro,DirectoryTarget
+from nonbonded import NonbondedModel,loadNonbonded
+from neighbours import cellListPairs
+
+#constants of the super-Fibonacci spiral, Alexa (2022)
+PHI = np.sqrt(2.)
+PSI = 1.533751168755204288118041
+
+#fields of the scored placements
+CANDIDATEDTYPE = [('rotation',int),('translation',int),('energy',float),
+                  ('lj',float),('coulomb',float),('contacts',int)]
+
+def quaternionGrid(n):
+    """
+    Unit quaternions evenly covering the rotation group, from the
+    super-Fibonacci spiral
+
+    ----------
+    Parameters
+    ----------
+    n: int
+        number of rotations
+
+    -------
+    Returns
+    -------
+    q: numpy array, n x 4
+        quaternions (w,x,y,z)
+    """
+    s = np.arange(n) + 0.5
+    r = np.sqrt(s / n)
+    R = np.sqrt(1. - s / n)
+    alpha = 2. * np.pi * s / PHI
+    beta = 2. * np.pi * s / PSI
+    return np.column_stack([r * np.sin(alpha),r * np.cos(alpha),
+                            R * np.sin(beta),R * np.cos(beta)])
+
+def rotationMatrices(q):
+    """
+    Rotation matrices of unit quaternions
+
+    ----------
+    Parameters
+    ----------
+    q: numpy array, n x 4
+        quaternions (w,x,y,z)
+
+    -------
+    Returns
+    -------
+    rotations: numpy array, n x 3 x 3
+        matrices applied to column vectors
+    """
+    q = np.asarray(q,dtype=float).reshape(-1,4)
+    q = q / np.sqrt(np.sum(q**2,axis=1))[:,None]
+    (w,x,y,z) = q.T
+    return np.array([[1.-2.*(y*y+z*z),2.*(x*y-z*w),2.*(x*z+y*w)],
+                     [2.*(x*y+z*w),1.-2.*(x*x+z*z),2.*(y*z-x*w)],
+                     [2.*(x*z-y*w),2.*(y*z+x*w),1.-2.*(x*x+y*y)]]
+                   ).transpose(2,0,1)
+
+def sphereDirections(n):
+    """
+    Unit vectors evenly covering the sphere, from the Fibonacci spiral
+
+    -------
+    Returns
+    -------
+    directions: numpy array, n x 3
+    """
+    s = np.arange(n) + 0.5
+    z = 1. - 2. * s / n
+    phi = np.pi * (3. - np.sqrt(5.)) * s
+    rho = np.sqrt(1. - z**2)
+    return np.column_stack([rho * np.cos(phi),rho * np.sin(phi),z])
+
+def shellTranslations(ndirections,distances):
+    """
+    Translations of the second molecule's centroid: every direction of
+    sphereDirections(ndirections) at every distance
+
+    ----------
+    Parameters
+    ----------
+    ndirections: int
+    distances: list of floats
+        centroid separations in nm
+
+    -------
+    Returns
+    -------
+    translations: numpy array, (ndirections*len(distances)) x 3
+    """
+    directions = sphereDirections(ndirections)
+    distances = np.asarray(distances,dtype=float)
+    return (distances[:,None,None] * directions[None,:,:]).reshape(-1,3)
+
+def placeCopies(pos,rotations,translations,rotInds,transInds):
+    """
+    Positions of rigid copies of a molecule, each rotated about the
+    molecule's centroid and then translated
+
+    ----------
+    Parameters
+    ----------
+    pos: numpy array, N x 3
+    rotations: numpy array, R x 3 x 3
+    translations: numpy array, T x 3
+    rotInds: numpy vector of ints, length K
+    transInds: numpy vector of ints, length K
+
+    -------
+    Returns
+    -------
+    placements: numpy array, K x N x 3
+    """
+    center = pos.mean(axis=0)
+    rotated = np.einsum('rab,nb->rna',rotations,pos - center)
+    return rotated[rotInds] + (center + translations[transInds])[:,None,:]
+
+def scanDimers(Top,rotations,translations,nb=None,minDistance=0.35,
+               contactDistance=0.6,chunkSize=20000,**kwargs):
+    """
+    Score every combination of a rotation and a translation of a second
+    copy of a molecule against the first
+
+    ----------
+    Parameters
+    ----------
+    Top: Topology
+        the molecule, in its own coordinates
+    rotations: numpy array, R x 3 x 3
+        eg rotationMatrices(quaternionGrid(R))
+    translations: numpy array, T x 3
+        eg shellTranslations(64,[0.5,0.75,1.])
+    nb: NonbondedParameters
+        defaults to loadNonbonded('martini.itp')
+    minDistance: float
+        placements with any pair of beads closer than this (nm) overlap and
+        are rejected
+    contactDistance: float
+        pairs of beads closer than this count as contacts; placements
+        without any contact are rejected
+    chunkSize: int
+        number of placements handled at once, which bounds memory use
+    kwargs:
+        passed on to NonbondedModel (cutoff, epsilonR, epsilonRF)
+
+    -------
+    Returns
+    -------
+    candidates: numpy record array
+        rotation, translation, energy, lj, coulomb and contacts of every
+        accepted placement, lowest energy first
+    """
+    if nb is None:
+        nb = loadNonbonded('martini.itp')
+    model = NonbondedModel(Top,nb=nb,**kwargs)
+    pos = Top.positions().copy()
+    rotations = np.asarray(rotations,dtype=float).reshape(-1,3,3)
+    translations = np.asarray(translations,dtype=float).reshape(-1,3)
+    ntotal = len(rotations) * len(translations)
+    chunks = [np.zeros(0,dtype=CANDIDATEDTYPE)]
+    for first in range(0,ntotal,chunkSize):
+        (rotInds,transInds) = np.divmod(np.arange(first,min(first+chunkSize,
+                                                            ntotal)),
+                                        len(translations))
+        placements = placeCopies(pos,rotations,translations,rotInds,
+                                 transInds)
+        #cheap overlap pass at the short distance first
+        (i,j,d) = cellListPairs(pos,minDistance,placements.reshape(-1,3))
+        keep = np.ones(len(placements),dtype=bool)
+        keep[j // len(pos)] = False
+        (rotInds,transInds,placements) = (rotInds[keep],transInds[keep],
+                                          placements[keep])
+        chunk = np.zeros(len(placements),dtype=CANDIDATEDTYPE)
+        chunk['rotation'] = rotInds
+        chunk['translation'] = transInds
+        (chunk['lj'],chunk['coulomb']) = model.scorePlacements(pos,placements)
+        chunk['energy'] = chunk['lj'] + chunk['coulomb']
+        (i,j,d) = cellListPairs(pos,contactDistance,placements.reshape(-1,3))
+        chunk['contacts'] = np.bincount(j // len(pos),
+                                        minlength=len(placements))
+        chunks.append(chunk[chunk['contacts'] > 0])
+    candidates = np.concatenate(chunks).view(np.recarray)
+    return candidates[np.argsort(candidates.energy,kind='mergesort')]
+
+def bestDimers(Top,candidates,rotations,translations,nbest=5,minRMSD=0.1):
+    """
+    The lowest energy placements that differ from each other
+
+    ----------
+    Parameters
+    ----------
+    Top: Topology
+    candidates: numpy record array
+        from scanDimers, lowest energy first
+    rotations: numpy array, R x 3 x 3
+        as passed to scanDimers
+    translations: numpy array, T x 3
+        as passed to scanDimers
+    nbest: int
+        number of placements to return
+    minRMSD: float
+        a placement whose second molecule lies within this RMSD (nm) of an
+        already chosen one is skipped
+
+    -------
+    Returns
+    -------
+    chosen: numpy record array
+        the chosen candidates
+    placements: numpy array, nbest x N x 3
+        positions of the second molecule in each
+    """
+    pos = Top.positions()
+    chosen = []
+    placements = np.zeros((0,len(pos),3))
+    for first in range(0,len(candidates),1000):
+        block = candidates[first:first+1000]
+        blockPos = placeCopies(pos,rotations,translations,block.rotation,
+                               block.translation)
+        for (ind,placement) in enumerate(blockPos):
+            if len(chosen) == nbest:
+                break
+            msd = np.mean(np.sum((placements - placement)**2,axis=2),axis=1)
+            if np.all(msd >= minRMSD**2):
+                chosen.append(first + ind)
+                placements = np.concatenate([placements,placement[None]])
+        if len(chosen) == nbest:
+            break
+    return (candidates[chosen],placements)
+
+def writeDimers(Top,placements,basename,energies=None,target=None,
+                margin=1.5):
+    """
+    Write a .gro file of the molecule plus each placement of its copy,
+    basename_1.gro, basename_2.gro and so on, each in a box sized to the
+    dimer
+
+    ----------
+    Parameters
+    ----------
+    Top: Topology
+    placements: numpy array, K x N x 3
+        positions of the second molecule
+    basename: string
+    energies: list of floats
+        nonbonded energies, noted in the titles if given
+    target: DirectoryTarget, MemoryTarget or ArchiveTarget
+        where to put the files, by default plain files on disk
+    margin: float
+        box edges exceed the extent of the dimer by this much (nm), so
+        periodic images stay at least this far apart
+    """
+    if target is None:
+        target = DirectoryTarget()
+    table = Top.atomTable()
+    for (ind,placement) in enumerate(placements):
+        second = table.copy()
+        second.pos[:] = placement
+        dimer = AtomTable.concatenate([table,second])
+        title = '{} dimer {}'.format(Top.chemName,ind+1)
+        if energies is not None:
+            title += ', nonbonded energy {:.1f} kJ/mol'.format(energies[ind])
+        extent = dimer.pos.max(axis=0) - dimer.pos.min(axis=0)
+        box = [float(b) for b in np.round(extent + margin,3)]
+        gro = Gro(title,len(dimer),dimer,box)
+        target.add('{}_{}.gro'.format(basename,ind+1),gro.text())
+
+def main():
+    parser = argparse.ArgumentParser(description='scan rigid-body dimer \
+                                     placements of a Martini molecule')
+    parser.add_argument('itp',metavar='I')
+    parser.add_argument('gro',metavar='G')
+    parser.add_argument('-o','--output',metavar='O',default=None)
+    parser.add_argument('-k','--nbest',metavar='K',type=int,default=5)
+    parser.add_argument('--rotations',metavar='R',type=int,default=500)
+    parser.add_argument('--directions',metavar='D',type=int,default=64)
+    parser.add_argument('--distances',metavar='X',type=float,nargs='+',
+                        default=[0.5,0.75,1.,1.25,1.5])
+    parser.add_argument('--ff',metavar='F',default='martini.itp')
+    args = parser.parse_args()
+    Top = DXXXTopology(args.itp,args.gro)
+    if args.output is None:
+        output = os.path.splitext(os.path.basename(args.gro))[0] + '_dimer'
+    else:
+        output = args.output
+    rotations = rotationMatrices(quaternionGrid(args.rotations))
+    translations = shellTranslations(args.directions,args.distances)
+    candidates = scanDimers(Top,rotations,translations,
+                            nb=loadNonbonded(args.ff))
+    (chosen,placements) = bestDimers(Top,candidates,rotations,translations,
+                                     args.nbest)
+    writeDimers(Top,placements,output,chosen.energy)
+    print('Scored {} of {} placements, wrote {} dimers, energies {}'.format(
+          len(candidates),len(rotations)*len(translations),len(chosen),
+          ' '.join(['{:.1f}'.format(e) for e in chosen.energy])))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,172 @@
+# -*- coding: utf-8 -*-
+"""
+Build a box of many copies of one molecule for aggregation simulations,
+in the manner of gmx insert-molecules: copies get random rotations and
+positions, and candidates that come too close to beads already in the box
+are rejected with a cell list.  Candidates are drawn and checked in
+batches, so boxes of 10^5 beads take seconds.  Run as
+
+python insertMolecules.py name.itp name.gro -n 1000 -b 30 30 30 [-o box]
+
+to write box.gro, box.itp and a box.top whose [ molecules ] count matches
+the number of copies actually inserted.
+"""
+from __future__ import absolute_import, division, print_function
+import argparse,numpy as np
+from warnings import warn
+from createMartiniModel import DXXXTopology,AtomTable,Gro,Itp,DirectoryTarget
+from neighbours import cellListPairs
+from dimers import rotationMatrices
+
+def randomRotations(n,random):
+    """
+    Rotation matrices drawn uniformly from the rotation group
+
+    ----------
+    Parameters
+    ----------
+    n: int
+    random: numpy RandomState
+
+    -------
+    Returns
+    -------
+    rotations: numpy array, n x 3 x 3
+    """
+    return rotationMatrices(random.randn(n,4))
+
+def insertMolecules(Top,nmol,box,minDistance=0.4,seed=0,maxTries=None,
+                    batchSize=1000,existing=None):
+    """
+    Place copies of a molecule at random positions and orientations in a
+    periodic box without overlaps
+
+    ----------
+    Parameters
+    ----------
+    Top: Topology
+        the molecule
+    nmol: int
+        number of copies wanted
+    box: list of floats, length 3
+        edges of the rectangular periodic box in nm
+    minDistance: float
+        closest allowed approach (nm) of beads of different copies
+    seed: int
+        seed of the random rotations and positions
+    maxTries: int
+        give up after this many candidates, by default 10 per copy wanted
+    batchSize: int
+        most candidates drawn and checked at once
+    existing: numpy array, M x 3
+        positions of beads already in the box, which copies must avoid too
+
+    -------
+    Returns
+    -------
+    positions: numpy array, K x N x 3
+        bead positions of the K <= nmol copies placed; each copy is kept
+        whole, so beads may stick out of the box
+    """
+    box = np.asarray(box,dtype=float)
+    if maxTries is None:
+        maxTries = 10 * nmol
+    random = np.random.RandomState(seed)
+    pos = Top.positions()
+    centered = pos - pos.mean(axis=0)
+    natoms = len(pos)
+    if existing is None:
+        placed = np.zeros((0,3))
+    else:
+        placed = np.asarray(existing,dtype=float).reshape(-1,3)
+    nexisting = len(placed)
+    accepted = []
+    naccepted = 0
+    tries = 0
+    while naccepted < nmol and tries < maxTries:
+        nbatch = min(batchSize,nmol - naccepted,maxTries - tries)
+        tries += nbatch
+        candidates = np.einsum('kij,nj->kni',randomRotations(nbatch,random),
+                               centered) + \
+                     (box * random.rand(nbatch,3))[:,None,:]
+        flat = candidates.reshape(-1,3)
+        bad = np.zeros(nbatch,dtype=bool)
+        if len(placed) > 0:
+            (i,j,d) = cellListPairs(flat,minDistance,placed,box)
+            bad[i // natoms] = True
+        #clashes within the batch: the later of two copies gives way
+        (i,j,d) = cellListPairs(flat,minDistance,box=box)
+        (mi,mj) = (i // natoms,j // natoms)
+        clash = (mi != mj) & ~bad[np.minimum(mi,mj)]
+        bad[np.maximum(mi,mj)[clash]] = True
+        good = candidates[~bad]
+        if len(good) > 0:
+            accepted.append(good)
+            naccepted += len(good)
+            placed = np.concatenate([placed,good.reshape(-1,3)])
+    if naccepted < nmol:
+        warn('Inserted only {} of {} molecules after {} tries.'.format(
+             naccepted,nmol,tries))
+    return placed[nexisting:].reshape(-1,natoms,3)
+
+def writeBox(Top,positions,box,fname,target=None,title=None):
+    """
+    Write fname.gro with every copy of a molecule, fname.itp with the
+    molecule and fname.top including it once per copy
+
+    ----------
+    Parameters
+    ----------
+    Top: Topology
+        the molecule
+    positions: numpy array, K x N x 3
+        from insertMolecules
+    box: list of floats, length 3
+    fname: string
+        base name of the files
+    target: DirectoryTarget, MemoryTarget or ArchiveTarget
+        where to put the files, by default plain files on disk
+    title: string
+        title of the gro file
+    """
+    if target is None:
+        target = DirectoryTarget()
+    if title is None:
+        title = 'Box of {} {} molecules built by createMartiniModel'.format(
+                len(positions),Top.chemName)
+    table = Top.atomTable()
+    copies = []
+    for pos in positions:
+        copy = table.copy()
+        copy.pos[:] = pos
+        copies.append(copy)
+    system = AtomTable.concatenate(copies)
+    gro = Gro(title,len(system),system,list(box))
+    target.add(fname+'.gro',gro.text())
+    itp = Itp(Top.chemName,Top.moltype,table,Top.bondlist,Top.conlist,
+              Top.anglist,Top.dihlist)
+    target.add(fname+'.itp',itp.text())
+    target.add(fname+'.top',Top.topText(fname,len(positions)))
+
+def main():
+    parser = argparse.ArgumentParser(description='fill a box with copies \
+                                     of a Martini molecule')
+    parser.add_argument('itp',metavar='I')
+    parser.add_argument('gro',metavar='G')
+    parser.add_argument('-n','--nmol',metavar='N',type=int,required=True)
+    parser.add_argument('-b','--box',metavar='B',type=float,nargs=3,
+                        required=True)
+    parser.add_argument('-o','--output',metavar='O',default='box')
+    parser.add_argument('--min-distance',metavar='D',type=float,default=0.4)
+    parser.add_argument('--seed',metavar='S',type=int,default=0)
+    args = parser.parse_args()
+    Top = DXXXTopology(args.itp,args.gro)
+    positions = insertMolecules(Top,args.nmol,args.box,args.min_distance,
+                                args.seed)
+    writeBox(Top,positions,args.box,args.output)
+    print('Inserted {} molecules, {} beads, wrote {}.gro, {}.itp, {}.top'\
+          .format(len(positions),len(positions)*len(Top.atomlist),
+                  args.output,args.output,args.output))
+
+if __name__ == "__main__":
+    main()
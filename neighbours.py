@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+"""
+Vectorized cell-list neighbour search.  Points are binned into cubic cells
+at least one cutoff wide, so the neighbours of a point can only be in its
+own cell or the 26 around it; all candidate pairs are gathered with a
+handful of NumPy calls instead of a Python loop over points.
+"""
+from __future__ import absolute_import, division, print_function
+import numpy as np
+
+def _cellGrid(points,cutoff,box):
+    """
+    Number of cells along each axis, the cell edge lengths and the lower
+    corner of the grid holding all the points
+    """
+    if box is not None:
+        ncell = np.maximum(np.floor(box / cutoff).astype(int),1)
+        return (ncell,box / ncell,np.zeros(3))
+    lower = np.min([p.min(axis=0) for p in points if len(p) > 0],axis=0)
+    upper = np.max([p.max(axis=0) for p in points if len(p) > 0],axis=0)
+    ncell = np.floor((upper - lower) / cutoff).astype(int) + 1
+    return (ncell,np.ones(3) * cutoff,lower)
+
+def _cellOffsets(ncell,periodic):
+    """
+    Offsets from a cell to the cells that may hold its neighbours.  Along
+    periodic axes with fewer than three cells every cell is a neighbour,
+    and is only listed once.
+    """
+    axes = []
+    for n in ncell:
+        if periodic and n < 3:
+            axes.append(np.arange(n))
+        else:
+            axes.append(np.array([-1,0,1]))
+    grid = np.meshgrid(*axes,indexing='ij')
+    return np.column_stack([g.ravel() for g in grid])
+
+def cellListPairs(posA,cutoff,posB=None,box=None):
+    """
+    All pairs of points closer than a cutoff, found with a cell list
+
+    ----------
+    Parameters
+    ----------
+    posA: numpy array, N x 3
+        first set of points
+    cutoff: float
+        pair distance cutoff
+    posB: numpy array, M x 3
+        second set of points; if not given, pairs within posA are returned
+        once each, with i < j
+    box: list of floats, length 3
+        edge lengths of a rectangular periodic box, in which case the
+        minimum image convention is used; the cutoff may be at most half
+        the shortest edge
+
+    -------
+    Returns
+    -------
+    i: numpy vector of ints
+        indices into posA
+    j: numpy vector of ints
+        indices into posB (or posA)
+    d: numpy array, P x 3
+        minimum image vectors posB[j] - posA[i]
+    """
+    posA = np.asarray(posA,dtype=float).reshape(-1,3)
+    same = posB is None
+    if same:
+        posB = posA
+    else:
+        posB = np.asarray(posB,dtype=float).reshape(-1,3)
+    if len(posA) == 0 or len(posB) == 0:
+        return (np.zeros(0,dtype=int),np.zeros(0,dtype=int),np.zeros((0,3)))
+    if box is not None:
+        box = np.asarray(box,dtype=float)
+        if cutoff > 0.5 * box.min():
+            raise ValueError('Cutoff {} is longer than half the box'.format(
+                             cutoff))
+    (ncell,size,lower) = _cellGrid([posA,posB],cutoff,box)
+    cellA = np.floor((posA - lower) / size).astype(int)
+    cellB = np.floor((posB - lower) / size).astype(int)
+    if box is not None:
+        cellA %= ncell
+        cellB %= ncell
+    else:
+        #points on the upper edge of the grid
+        cellA = np.minimum(cellA,ncell - 1)
+        cellB = np.minimum(cellB,ncell - 1)
+    keyB = np.ravel_multi_index(cellB.T,ncell)
+    order = np.argsort(keyB)
+    sortedKeys = keyB[order]
+
+    offsets = _cellOffsets(ncell,box is not None)
+    neighbours = (cellA[:,None,:] + offsets[None,:,:]).reshape(-1,3)
+    owners = np.repeat(np.arange(len(posA)),len(offsets))
+    if box is not None:
+        neighbours %= ncell
+    else:
+        inside = np.all((neighbours >= 0) & (neighbours < ncell),axis=1)
+        neighbours = neighbours[inside]
+        owners = owners[inside]
+    keys = np.ravel_multi_index(neighbours.T,ncell)
+    start = np.searchsorted(sortedKeys,keys,side='left')
+    counts = np.searchsorted(sortedKeys,keys,side='right') - start
+    nonzero = counts > 0
+    (start,counts,owners) = (start[nonzero],counts[nonzero],owners[nonzero])
+
+    #expand the [start,start+count) ranges of the sorted points
+    total = counts.sum()
+    first = np.cumsum(counts) - counts
+    slots = np.arange(total) - np.repeat(first,counts) + \
+            np.repeat(start,counts)
+    i = np.repeat(owners,counts)
+    j = order[slots]
+    if same:
+        keep = i < j
+        (i,j) = (i[keep],j[keep])
+    d = posB[j] - posA[i]
+    if box is not None:
+        d -= box * np.round(d / box)
+    keep = np.sum(d**2,axis=1) < cutoff**2
+    return (i[keep],j[keep],d[keep])
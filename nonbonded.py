@@ -0,0 +1,453 @@
+# -*- coding: utf-8 -*-
+"""
+Martini nonbonded parameters as dense NumPy matrices.  The [ atomtypes ]
+and [ nonbond_params ] sections of a force field itp (martini.itp by
+default) are parsed into C6 and C12 matrices indexed by bead type, so pair
+parameters of any set of beads can be looked up by array indexing:
+
+nb = loadNonbonded('martini.itp')
+inds = nb.typeIndices([bead.btype for bead in Top.atomlist])
+c6 = nb.c6[inds[:,None],inds[None,:]]
+
+The parsed tables are kept in a binary sidecar file next to the itp file,
+which is reused for as long as the itp file does not change.
+
+NonbondedModel evaluates Martini Lennard-Jones plus reaction-field Coulomb
+energies between two molecules over a cell list, for screening many 
+candidate placements of one molecule against another at once.
+"""
+from __future__ import absolute_import, division, print_function
+import os,numpy as np
+from warnings import warn
+from createMartiniModel import _fileSignature,_fileHash
+from neighbours import cellListPairs
+
+#bump whenever the layout of the binary cache changes
+NONBONDEDCACHEVERSION = 1
+
+#GROMACS electric conversion factor 1/(4 pi eps0), kJ mol^-1 nm e^-2
+ELECTRIC = 138.935458
+
+#obsolete types of the non-polarizable amino acids, which martini.itp says
+#to replace by the regular C1 and C2 types
+TYPEALIASES = {'AC1':'C1','AC2':'C2'}
+
+def _sections(itpname):
+    """
+    Iterate over (section,fields) of the uncommented lines of an itp file,
+    stopping at the first [ moleculetype ]
+    """
+    section = None
+    fid = open(itpname)
+    for line in fid:
+        line = line.split(';')[0].strip()
+        if len(line) == 0:
+            continue
+        if line.startswith('['):
+            section = line.strip('[] \t').lower()
+            if section == 'moleculetype':
+                break
+            continue
+        yield (section,line.split())
+    fid.close()
+
+def _combine(a,b,rule):
+    """
+    Matrices of the C6 and C12 (rule 1) or sigma and epsilon (rules 2 and 3)
+    combinations of the per-type values a and b
+    """
+    if rule == 2:
+        first = 0.5 * (a[:,None] + a[None,:])
+    else:
+        first = np.sqrt(a[:,None] * a[None,:])
+    second = np.sqrt(b[:,None] * b[None,:])
+    return (first,second)
+
+class NonbondedParameters(object):
+    """
+    Lennard-Jones parameters of every pair of bead types in a force field
+
+    ----------
+    Attributes
+    ----------
+    types: list of strings
+        bead type names, in the order of the [ atomtypes ] section
+    index: dict
+        bead type name -> row of the matrices
+    mass: numpy vector of floats
+        mass of each type
+    charge: numpy vector of floats
+        default charge of each type
+    c6: numpy array of floats, N x N
+        C6 coefficients in kJ mol^-1 nm^6
+    c12: numpy array of floats, N x N
+        C12 coefficients in kJ mol^-1 nm^12
+    combinationRule: int
+        the GROMACS combination rule of the [ defaults ] section, used to
+        fill in the pairs without an explicit [ nonbond_params ] line
+    """
+    def __init__(self,types,mass,charge,c6,c12,combinationRule=1):
+        self.types = list(types)
+        self.index = dict((t,i) for (i,t) in enumerate(self.types))
+        self.mass = np.asarray(mass,dtype=float)
+        self.charge = np.asarray(charge,dtype=float)
+        self.c6 = np.asarray(c6,dtype=float)
+        self.c12 = np.asarray(c12,dtype=float)
+        self.combinationRule = int(combinationRule)
+
+    def typeIndex(self,btype):
+        """
+        Row of the matrices belonging to a bead type, resolving the
+        obsolete AC1 and AC2 types
+        """
+        try:
+            return self.index[TYPEALIASES.get(btype,btype)]
+        except KeyError:
+            raise KeyError('Unknown bead type ' + str(btype))
+
+    def typeIndices(self,btypes):
+        """
+        Rows of the matrices belonging to a list of bead types
+
+        ----------
+        Parameters
+        ----------
+        btypes: list of strings
+            bead types, eg [bead.btype for bead in Top.atomlist]
+
+        -------
+        Returns
+        -------
+        inds: numpy vector of ints
+        """
+        (names,inverse) = np.unique(np.asarray(btypes,dtype=str),
+                                    return_inverse=True)
+        rows = np.array([self.typeIndex(name) for name in names],dtype=int)
+        return rows[inverse]
+
+    def sigma(self):
+        """
+        Matrix of sigma = (C12/C6)^(1/6) in nm, zero for pairs without
+        dispersion
+        """
+        sigma = np.zeros(self.c6.shape)
+        nz = self.c6 > 0.
+        sigma[nz] = (self.c12[nz] / self.c6[nz]) ** (1. / 6.)
+        return sigma
+
+    def epsilon(self):
+        """
+        Matrix of epsilon = C6^2/(4 C12) in kJ/mol, zero for pairs without
+        repulsion
+        """
+        epsilon = np.zeros(self.c6.shape)
+        nz = self.c12 > 0.
+        epsilon[nz] = self.c6[nz] ** 2 / (4. * self.c12[nz])
+        return epsilon
+
+    def pairParameters(self,btypesA,btypesB=None):
+        """
+        C6 and C12 of every pair of beads from two lists of bead types
+
+        ----------
+        Parameters
+        ----------
+        btypesA: list of strings
+        btypesB: list of strings
+            defaults to btypesA
+
+        -------
+        Returns
+        -------
+        c6: numpy array of floats, len(btypesA) x len(btypesB)
+        c12: numpy array of floats, len(btypesA) x len(btypesB)
+        """
+        indsA = self.typeIndices(btypesA)
+        if btypesB is None:
+            indsB = indsA
+        else:
+            indsB = self.typeIndices(btypesB)
+        return (self.c6[indsA[:,None],indsB[None,:]],
+                self.c12[indsA[:,None],indsB[None,:]])
+
+def parseNonbonded(itpname='martini.itp'):
+    """
+    Read the [ defaults ], [ atomtypes ] and [ nonbond_params ] sections of
+    a force field itp file.  Pairs without an explicit [ nonbond_params ]
+    line get the combination of their [ atomtypes ] values.
+
+    ----------
+    Parameters
+    ----------
+    itpname: string
+        force field file
+
+    -------
+    Returns
+    -------
+    nb: NonbondedParameters
+    """
+    rule = 1
+    types = []
+    mass = []
+    charge = []
+    first = []
+    second = []
+    pairs = []
+    for (section,fields) in _sections(itpname):
+        if section == 'defaults':
+            rule = int(fields[1])
+        elif section == 'atomtypes':
+            #name [at.num] mass charge ptype c6 c12, at.num is optional
+            ptype = [i for i in range(1,len(fields))
+                     if fields[i] in ('A','S','V','D')]
+            p = ptype[-1]
+            types.append(fields[0])
+            mass.append(float(fields[p-2]))
+            charge.append(float(fields[p-1]))
+            first.append(float(fields[p+1]))
+            second.append(float(fields[p+2]))
+        elif section == 'nonbond_params':
+            pairs.append((fields[0],fields[1],float(fields[3]),
+                          float(fields[4])))
+    (c6,c12) = _combine(np.array(first),np.array(second),rule)
+    if rule != 1:
+        #sigma and epsilon to C6 and C12
+        (c6,c12) = (4. * c12 * c6 ** 6,4. * c12 * c6 ** 12)
+    index = dict((t,i) for (i,t) in enumerate(types))
+    for (ti,tj,a,b) in pairs:
+        if ti not in index or tj not in index:
+            warn('Skipping nonbond_params of undefined types {} {}'.format(
+                 ti,tj))
+            continue
+        if rule != 1:
+            (a,b) = (4. * b * a ** 6,4. * b * a ** 12)
+        (i,j) = (index[ti],index[tj])
+        c6[i,j] = c6[j,i] = a
+        c12[i,j] = c12[j,i] = b
+    return NonbondedParameters(types,mass,charge,c6,c12,rule)
+
+def nonbondedCacheName(itpname):
+    """
+    Name of the binary sidecar file of a force field itp file, ie
+    martini.itp.nonbonded.cache
+    """
+    return itpname + '.nonbonded.cache'
+
+def _readCache(itpname):
+    """
+    Parsed tables from the binary cache of itpname, or None when the cache
+    is missing, unreadable or stale
+    """
+    cachename = nonbondedCacheName(itpname)
+    if not os.path.isfile(cachename):
+        return None
+    try:
+        fid = open(cachename,'rb')
+        data = np.load(fid,allow_pickle=False)
+        cached = dict((key,data[key]) for key in data.files)
+        fid.close()
+    except Exception:
+        warn('Unreadable nonbonded cache {}, reparsing.'.format(cachename))
+        return None
+    if int(cached['version']) != NONBONDEDCACHEVERSION:
+        return None
+    (path,mtime,size) = _fileSignature(itpname)
+    if str(cached['path']) != path or float(cached['mtime']) != mtime \
+       or int(cached['size']) != size:
+        if str(cached['hash']) != _fileHash(itpname):
+            return None
+        #file was touched but not changed, so refresh the signature
+        _writeCache(itpname,cached)
+    return cached
+
+def _writeCache(itpname,cached):
+    """
+    Write the binary cache of itpname under a temporary name and rename it,
+    so concurrent readers never see a partial file
+    """
+    (path,mtime,size) = _fileSignature(itpname)
+    cached = dict(cached)
+    cached.update(version=NONBONDEDCACHEVERSION,path=path,mtime=mtime,
+                  size=size)
+    if 'hash' not in cached:
+        cached['hash'] = _fileHash(itpname)
+    cachename = nonbondedCacheName(itpname)
+    tmpname = cachename + '.' + str(os.getpid())
+    fid = open(tmpname,'wb')
+    np.savez(fid,**cached)
+    fid.close()
+    os.rename(tmpname,cachename)
+
+def loadNonbonded(itpname='martini.itp',cache=True):
+    """
+    Nonbonded parameters of a force field itp file, read from the binary
+    sidecar cache when it is current and parsed (and cached) otherwise
+
+    ----------
+    Parameters
+    ----------
+    itpname: string
+        force field file
+    cache: bool
+        whether to use and write the binary cache
+
+    -------
+    Returns
+    -------
+    nb: NonbondedParameters
+    """
+    cached = None
+    if cache:
+        cached = _readCache(itpname)
+    if cached is not None:
+        return NonbondedParameters([str(t) for t in cached['types']],
+                                   cached['mass'],cached['charge'],
+                                   cached['c6'],cached['c12'],
+                                   cached['combinationRule'])
+    nb = parseNonbonded(itpname)
+    if cache:
+        try:
+            _writeCache(itpname,{'types':np.array(nb.types,dtype=str),
+                                 'mass':nb.mass,'charge':nb.charge,
+                                 'c6':nb.c6,'c12':nb.c12,
+                                 'combinationRule':nb.combinationRule})
+        except (IOError,OSError):
+            warn('Could not write the nonbonded cache of ' + itpname)
+    return nb
+
+class NonbondedModel(object):
+    """
+    Martini nonbonded energies between the beads of two molecules: 
+    Lennard-Jones shifted to zero at the cutoff plus reaction-field 
+    Coulomb, as GROMACS computes them with cutoff-scheme Verlet.  Pairs are
+    found with a cell list, optionally in a periodic box.
+    
+    ----------
+    Attributes
+    ----------
+    typesA: numpy vector of ints
+        rows of the parameter matrices for the beads of the first molecule
+    typesB: numpy vector of ints
+        rows of the parameter matrices for the beads of the second molecule
+    qq: numpy array of floats, NA x NB
+        ELECTRIC*qi*qj/epsilonR for every pair of beads
+    c6: numpy array of floats, NA x NB
+    c12: numpy array of floats, NA x NB
+    cutoff: float
+        nm
+    box: numpy vector of floats or None
+        periodic box edges in nm
+    """
+    def __init__(self,TopA,TopB=None,nb=None,cutoff=1.1,epsilonR=15.,
+                 epsilonRF=0.,box=None):
+        """
+        ----------
+        Parameters
+        ----------
+        TopA: Topology
+            first molecule
+        TopB: Topology
+            second molecule, the same as the first if not given
+        nb: NonbondedParameters
+            defaults to loadNonbonded('martini.itp')
+        cutoff: float
+            LJ and Coulomb cutoff in nm
+        epsilonR: float
+            relative dielectric constant, 15 for standard Martini and 2.5
+            with polarizable water
+        epsilonRF: float
+            dielectric constant beyond the cutoff, 0 meaning infinity
+        box: list of floats, length 3
+            rectangular periodic box, None for an open system
+        """
+        if nb is None:
+            nb = loadNonbonded('martini.itp')
+        if TopB is None:
+            TopB = TopA
+        tableA = TopA.atomTable()
+        tableB = TopB.atomTable()
+        self.typesA = nb.typeIndices(tableA.btype)
+        self.typesB = nb.typeIndices(tableB.btype)
+        self.c6 = nb.c6[self.typesA[:,None],self.typesB[None,:]]
+        self.c12 = nb.c12[self.typesA[:,None],self.typesB[None,:]]
+        self.qq = ELECTRIC * np.outer(tableA.charge,tableB.charge) / epsilonR
+        self.cutoff = float(cutoff)
+        if epsilonRF == 0.:
+            self.krf = 1. / (2. * cutoff**3)
+        else:
+            self.krf = (epsilonRF - epsilonR) / \
+                       ((2. * epsilonRF + epsilonR) * cutoff**3)
+        self.crf = 1. / cutoff + self.krf * cutoff**2
+        if box is None:
+            self.box = None
+        else:
+            self.box = np.asarray(box,dtype=float)
+    
+    def pairEnergies(self,i,j,r2):
+        """
+        LJ and Coulomb energies of bead pairs (i,j) at squared distances r2
+        
+        -------
+        Returns
+        -------
+        lj: numpy vector of floats
+        coulomb: numpy vector of floats
+        """
+        (c6,c12) = (self.c6[i,j],self.c12[i,j])
+        rc6 = self.cutoff**-6
+        ir6 = 1. / r2**3
+        lj = c12 * (ir6**2 - rc6**2) - c6 * (ir6 - rc6)
+        coulomb = self.qq[i,j] * (1. / np.sqrt(r2) + self.krf * r2 - self.crf)
+        return (lj,coulomb)
+    
+    def energy(self,posA,posB):
+        """
+        Total LJ and Coulomb energies between the two molecules
+        
+        ----------
+        Parameters
+        ----------
+        posA: numpy array, NA x 3
+        posB: numpy array, NB x 3
+        
+        -------
+        Returns
+        -------
+        lj: float
+            kJ/mol
+        coulomb: float
+            kJ/mol
+        """
+        (lj,coulomb) = self.scorePlacements(posA,np.asarray(posB)[None])
+        return (lj[0],coulomb[0])
+    
+    def scorePlacements(self,posA,placements):
+        """
+        LJ and Coulomb energies between the first molecule and each of many
+        placements of the second.  All placements go through a single cell
+        list, and only pairs between the first molecule and a placement are
+        ever considered, so placements may overlap each other freely.
+        
+        ----------
+        Parameters
+        ----------
+        posA: numpy array, NA x 3
+            positions of the first molecule
+        placements: numpy array, K x NB x 3
+            positions of the second molecule in each candidate placement
+        
+        -------
+        Returns
+        -------
+        lj: numpy vector of floats, length K
+        coulomb: numpy vector of floats, length K
+        """
+        placements = np.asarray(placements,dtype=float)
+        (nplace,nB) = placements.shape[:2]
+        (i,jflat,d) = cellListPairs(posA,self.cutoff,
+                                    placements.reshape(-1,3),self.box)
+        (k,j) = np.divmod(jflat,nB)
+        (lj,coulomb) = self.pairEnergies(i,j,np.sum(d**2,axis=1))
+        return (np.bincount(k,lj,minlength=nplace),
+                np.bincount(k,coulomb,minlength=nplace))
@@ -0,0 +1,541 @@
+# -*- coding: utf-8 -*-
+"""
+Vectorized Martini bonded energies and minimizers, used to relax generated
+structures before they are handed to GROMACS.  Run as
+
+python relax.py name.itp name.gro [-o relaxed.gro]
+
+to relax the coordinates of an existing pair of files.
+"""
+from __future__ import absolute_import, division, print_function
+import argparse,numpy as np
+from warnings import warn
+from createMartiniModel import DXXXTopology,Gro
+
+def _termType(params):
+    """
+    GROMACS function type of a bonded term, whose params may be numbers or
+    the strings read from an itp file
+    """
+    return int(float(params[0]))
+
+def _floats(params,start,count):
+    """
+    The numeric parameters params[start:start+count] of a bonded term
+    """
+    return [float(p) for p in params[start:start+count]]
+
+def _bondVectors(pos,i,j):
+    """
+    Vectors from bead i to bead j and their lengths
+    """
+    d = pos[j] - pos[i]
+    r = np.sqrt(np.sum(d**2,axis=1))
+    return (d,r)
+
+def _angles(pos,i,j,k):
+    """
+    Cosines of the angles i-j-k and their gradients with respect to the
+    positions of i and k (the gradient for j is minus their sum)
+    """
+    a = pos[i] - pos[j]
+    b = pos[k] - pos[j]
+    la = np.sqrt(np.sum(a**2,axis=1))
+    lb = np.sqrt(np.sum(b**2,axis=1))
+    la = np.maximum(la,1e-8)
+    lb = np.maximum(lb,1e-8)
+    c = np.sum(a*b,axis=1)/(la*lb)
+    c = np.clip(c,-1.,1.)
+    dci = b/(la*lb)[:,None] - (c/la**2)[:,None]*a
+    dck = a/(la*lb)[:,None] - (c/lb**2)[:,None]*b
+    return (c,dci,dck)
+
+def _dihedrals(pos,i,j,k,l):
+    """
+    Dihedral angles i-j-k-l (IUPAC convention, as in GROMACS) and the
+    vectors needed for their forces
+    """
+    rij = pos[i] - pos[j]
+    rkj = pos[k] - pos[j]
+    rkl = pos[k] - pos[l]
+    m = np.cross(rij,rkj)
+    n = np.cross(rkj,rkl)
+    mm = np.maximum(np.sum(m**2,axis=1),1e-12)
+    nn = np.maximum(np.sum(n**2,axis=1),1e-12)
+    cosphi = np.sum(m*n,axis=1)/np.sqrt(mm*nn)
+    phi = np.arccos(np.clip(cosphi,-1.,1.))
+    phi = np.where(np.sum(rij*n,axis=1) < 0.,-phi,phi)
+    return (phi,rij,rkj,rkl,m,n,mm,nn)
+
+def _accumulate(forces,inds,f):
+    """
+    forces[inds] += f, summing over repeated indices (much faster than 
+    np.add.at)
+    """
+    for d in range(3):
+        forces[:,d] += np.bincount(inds,weights=f[:,d],
+                                   minlength=len(forces))
+
+def _dihedralForces(forces,i,j,k,l,ddphi,geometry):
+    """
+    Add the forces of dihedral potentials with derivatives ddphi = dV/dphi
+    """
+    (phi,rij,rkj,rkl,m,n,mm,nn) = geometry
+    nrkj2 = np.maximum(np.sum(rkj**2,axis=1),1e-12)
+    nrkj = np.sqrt(nrkj2)
+    fi = -(ddphi*nrkj/mm)[:,None]*m
+    fl = (ddphi*nrkj/nn)[:,None]*n
+    p = np.sum(rij*rkj,axis=1)/nrkj2
+    q = np.sum(rkl*rkj,axis=1)/nrkj2
+    s = p[:,None]*fi - q[:,None]*fl
+    fj = fi - s
+    fk = fl + s
+    _accumulate(forces,i,fi)
+    _accumulate(forces,j,-fj)
+    _accumulate(forces,k,-fk)
+    _accumulate(forces,l,fl)
+
+class BondedModel(object):
+    """
+    The bonded terms of a Topology gathered into arrays by functional form,
+    so energies and forces of the whole molecule are computed at once
+
+    ----------
+    Attributes
+    ----------
+    natoms: int
+        number of beads, in atomlist order
+    bonds: dict of numpy arrays
+        i, j, b0, kb of harmonic bonds (type 1), including the constraints
+    harmonicAngles: dict of numpy arrays
+        i, j, k, theta0 (radians), ktheta of harmonic angles (type 1)
+    cosineAngles: dict of numpy arrays
+        i, j, k, cos0, ktheta of cosine-harmonic angles (type 2)
+    periodicDihedrals: dict of numpy arrays
+        i, j, k, l, phi0 (radians), kphi, mult of proper dihedrals (types 1
+        and 9)
+    improperDihedrals: dict of numpy arrays
+        i, j, k, l, xi0 (radians), kxi of harmonic impropers (type 2)
+    skipped: int
+        number of terms that could not be evaluated and were left out
+    """
+    def __init__(self,Top,constraintK=20000.,tabulated='restrain',
+                 restraintK=1000.):
+        """
+        Gather the bonded terms of a topology
+
+        ----------
+        Parameters
+        ----------
+        Top: Topology
+        constraintK: float
+            force constant (kJ/mol/nm^2) of the harmonic bonds that stand
+            in for constraints
+        tabulated: string
+            what to do with terms whose functional form is not known here,
+            such as the tabulated (type 8) terms of the DFAG core:
+            'restrain' holds them at their starting geometry with
+            harmonic terms, 'skip' leaves them out
+        restraintK: float
+            force constant of those restraints, per nm^2 for bonds and per
+            rad^2 for angles and dihedrals
+        """
+        if tabulated not in ['restrain','skip']:
+            raise ValueError('tabulated must be restrain or skip')
+        self.natoms = len(Top.atomlist)
+        index = dict([(id(atom),ind) for (ind,atom) in \
+                      enumerate(Top.atomlist)])
+        pos = np.array([atom.pos for atom in Top.atomlist],
+                       dtype=float).reshape((-1,3))
+        bonds = []
+        hangles = []
+        cangles = []
+        pdihs = []
+        idihs = []
+        self.skipped = 0
+        restrain = []
+        for (blist,constraint) in [(Top.bondlist,False),(Top.conlist,True)]:
+            for entry in blist:
+                inds = [index[id(a)] for a in entry.ainds]
+                ftype = _termType(entry.params)
+                if ftype == 1 and constraint:
+                    bonds.append(inds + _floats(entry.params,1,1) +
+                                 [constraintK])
+                elif ftype == 1:
+                    bonds.append(inds + _floats(entry.params,1,2))
+                else:
+                    restrain.append(inds)
+        for entry in Top.anglist:
+            inds = [index[id(a)] for a in entry.ainds]
+            ftype = _termType(entry.params)
+            if ftype == 1:
+                (theta0,k) = _floats(entry.params,1,2)
+                hangles.append(inds + [np.radians(theta0),k])
+            elif ftype == 2:
+                (theta0,k) = _floats(entry.params,1,2)
+                cangles.append(inds + [np.cos(np.radians(theta0)),k])
+            else:
+                restrain.append(inds)
+        for entry in Top.dihlist:
+            inds = [index[id(a)] for a in entry.ainds]
+            ftype = _termType(entry.params)
+            if ftype in [1,9]:
+                (phi0,k,mult) = _floats(entry.params,1,3)
+                pdihs.append(inds + [np.radians(phi0),k,mult])
+            elif ftype == 2:
+                (xi0,k) = _floats(entry.params,1,2)
+                idihs.append(inds + [np.radians(xi0),k])
+            else:
+                restrain.append(inds)
+        for inds in restrain:
+            if tabulated == 'skip':
+                self.skipped += 1
+            elif len(inds) == 2:
+                (d,r) = _bondVectors(pos,[inds[0]],[inds[1]])
+                bonds.append(inds + [r[0],restraintK])
+            elif len(inds) == 3:
+                (c,dci,dck) = _angles(pos,[inds[0]],[inds[1]],[inds[2]])
+                hangles.append(inds + [np.arccos(c[0]),restraintK])
+            else:
+                geometry = _dihedrals(pos,[inds[0]],[inds[1]],[inds[2]],
+                                      [inds[3]])
+                idihs.append(inds + [geometry[0][0],restraintK])
+        if self.skipped > 0:
+            warn('Skipped {} bonded terms of unknown form.'.format(
+                 self.skipped))
+        self.bonds = self._columns(bonds,['i','j','b0','kb'])
+        self.harmonicAngles = self._columns(hangles,['i','j','k','theta0',
+                                                     'ktheta'])
+        self.cosineAngles = self._columns(cangles,['i','j','k','cos0',
+                                                   'ktheta'])
+        self.periodicDihedrals = self._columns(pdihs,['i','j','k','l','phi0',
+                                                      'kphi','mult'])
+        self.improperDihedrals = self._columns(idihs,['i','j','k','l','xi0',
+                                                      'kxi'])
+
+    def _columns(self,rows,names):
+        """
+        Turn a list of rows into a dict of column arrays, with integer
+        arrays for the bead indices
+        """
+        table = np.array(rows,dtype=float).reshape((-1,len(names)))
+        columns = {}
+        for (c,name) in enumerate(names):
+            if name in ['i','j','k','l']:
+                columns[name] = table[:,c].astype(int)
+            else:
+                columns[name] = table[:,c]
+        return columns
+
+    def degenerate(self,pos,tol=1e-4):
+        """
+        Find the beads of dihedrals whose first or last three beads are 
+        (nearly) collinear, where the dihedral angle is undefined
+        
+        ----------
+        Parameters
+        ----------
+        pos: numpy array, N x 3
+        tol: float
+            squared length (nm^4) of the cross products below which a 
+            dihedral counts as degenerate
+            
+        -------
+        Returns
+        -------
+        beads: numpy array of ints
+            indices of the beads involved
+        """
+        beads = []
+        for q in [self.periodicDihedrals,self.improperDihedrals]:
+            if len(q['i']) == 0:
+                continue
+            geometry = _dihedrals(pos,q['i'],q['j'],q['k'],q['l'])
+            bad = (geometry[6] < tol) | (geometry[7] < tol)
+            for name in ['i','j','k','l']:
+                beads.append(q[name][bad])
+        if len(beads) == 0:
+            return np.array([],dtype=int)
+        return np.unique(np.concatenate(beads))
+    
+    def energy(self,pos):
+        """
+        Total bonded energy
+
+        ----------
+        Parameters
+        ----------
+        pos: numpy array, N x 3
+            positions in nm
+
+        -------
+        Returns
+        -------
+        energy: float
+            in kJ/mol
+        """
+        return self.energyAndForces(pos)[0]
+
+    def energyAndForces(self,pos):
+        """
+        Total bonded energy and the forces on every bead
+
+        ----------
+        Parameters
+        ----------
+        pos: numpy array, N x 3
+            positions in nm
+
+        -------
+        Returns
+        -------
+        energy: float
+            in kJ/mol
+        forces: numpy array, N x 3
+            in kJ/mol/nm
+        """
+        pos = np.asarray(pos,dtype=float)
+        forces = np.zeros((self.natoms,3))
+        energy = 0.
+
+        b = self.bonds
+        if len(b['i']) > 0:
+            (d,r) = _bondVectors(pos,b['i'],b['j'])
+            dr = r - b['b0']
+            energy += 0.5*np.sum(b['kb']*dr**2)
+            f = (b['kb']*dr/np.maximum(r,1e-8))[:,None]*d
+            _accumulate(forces,b['i'],f)
+            _accumulate(forces,b['j'],-f)
+
+        for (a,cosine) in [(self.harmonicAngles,False),
+                           (self.cosineAngles,True)]:
+            if len(a['i']) == 0:
+                continue
+            (c,dci,dck) = _angles(pos,a['i'],a['j'],a['k'])
+            if cosine:
+                dc = c - a['cos0']
+                energy += 0.5*np.sum(a['ktheta']*dc**2)
+                dEdc = a['ktheta']*dc
+            else:
+                theta = np.arccos(c)
+                dtheta = theta - a['theta0']
+                energy += 0.5*np.sum(a['ktheta']*dtheta**2)
+                dEdc = -a['ktheta']*dtheta/np.maximum(np.sqrt(1. - c**2),
+                                                       1e-8)
+            fi = -dEdc[:,None]*dci
+            fk = -dEdc[:,None]*dck
+            _accumulate(forces,a['i'],fi)
+            _accumulate(forces,a['k'],fk)
+            _accumulate(forces,a['j'],-(fi + fk))
+
+        p = self.periodicDihedrals
+        if len(p['i']) > 0:
+            geometry = _dihedrals(pos,p['i'],p['j'],p['k'],p['l'])
+            arg = p['mult']*geometry[0] - p['phi0']
+            energy += np.sum(p['kphi']*(1. + np.cos(arg)))
+            ddphi = -p['kphi']*p['mult']*np.sin(arg)
+            _dihedralForces(forces,p['i'],p['j'],p['k'],p['l'],ddphi,geometry)
+
+        q = self.improperDihedrals
+        if len(q['i']) > 0:
+            geometry = _dihedrals(pos,q['i'],q['j'],q['k'],q['l'])
+            dxi = geometry[0] - q['xi0']
+            dxi = dxi - 2.*np.pi*np.round(dxi/(2.*np.pi))
+            energy += 0.5*np.sum(q['kxi']*dxi**2)
+            _dihedralForces(forces,q['i'],q['j'],q['k'],q['l'],q['kxi']*dxi,
+                            geometry)
+        return (energy,forces)
+
+def steepestDescent(model,pos,nsteps=5000,ftol=10.,stepSize=0.01):
+    """
+    Minimize with the adaptive steepest descent scheme of GROMACS: move
+    every bead along its force, scaled so the largest move is the step
+    size, growing the step by 1.2 after an accepted move and halving it
+    after a rejected one
+
+    ----------
+    Parameters
+    ----------
+    model: BondedModel
+    pos: numpy array, N x 3
+        starting positions in nm
+    nsteps: int
+        maximum number of steps
+    ftol: float
+        stop once the largest force is below this (kJ/mol/nm)
+    stepSize: float
+        initial largest move in nm
+
+    -------
+    Returns
+    -------
+    pos: numpy array, N x 3
+        relaxed positions
+    energy: float
+        final energy
+    steps: int
+        number of steps taken
+    """
+    pos = np.array(pos,dtype=float)
+    (energy,forces) = model.energyAndForces(pos)
+    for step in range(nsteps):
+        fmax = np.sqrt(np.max(np.sum(forces**2,axis=1))) \
+               if len(forces) > 0 else 0.
+        if fmax < ftol:
+            return (pos,energy,step)
+        trial = pos + (stepSize/fmax)*forces
+        (trialEnergy,trialForces) = model.energyAndForces(trial)
+        if trialEnergy < energy:
+            (pos,energy,forces) = (trial,trialEnergy,trialForces)
+            stepSize *= 1.2
+        else:
+            stepSize *= 0.5
+            if stepSize < 1e-12:
+                return (pos,energy,step)
+    return (pos,energy,nsteps)
+
+def fire(model,pos,nsteps=5000,ftol=10.,dt=0.001,dtMax=0.01,maxMove=0.01):
+    """
+    Minimize with the FIRE algorithm [Bitzek 2006], unit masses
+
+    ----------
+    Parameters
+    ----------
+    model: BondedModel
+    pos: numpy array, N x 3
+        starting positions in nm
+    nsteps: int
+        maximum number of steps
+    ftol: float
+        stop once the largest force is below this (kJ/mol/nm)
+    dt: float
+        initial time step
+    dtMax: float
+        largest time step
+    maxMove: float
+        largest distance (nm) any bead may move in one step
+
+    -------
+    Returns
+    -------
+    pos: numpy array, N x 3
+        relaxed positions
+    energy: float
+        final energy
+    steps: int
+        number of steps taken
+    """
+    nMin = 5
+    fInc = 1.1
+    fDec = 0.5
+    alphaStart = 0.1
+    fAlpha = 0.99
+    alpha = alphaStart
+    sincePositive = 0
+    pos = np.array(pos,dtype=float)
+    vel = np.zeros(pos.shape)
+    (energy,forces) = model.energyAndForces(pos)
+    for step in range(nsteps):
+        fnorm2 = np.sum(forces**2,axis=1)
+        if len(fnorm2) == 0 or np.sqrt(np.max(fnorm2)) < ftol:
+            return (pos,energy,step)
+        power = np.sum(forces*vel)
+        fnorm = np.sqrt(np.sum(fnorm2))
+        vnorm = np.sqrt(np.sum(vel**2))
+        vel = (1. - alpha)*vel + alpha*vnorm*forces/fnorm
+        if power > 0.:
+            sincePositive += 1
+            if sincePositive > nMin:
+                dt = min(dt*fInc,dtMax)
+                alpha *= fAlpha
+        else:
+            sincePositive = 0
+            dt *= fDec
+            alpha = alphaStart
+            vel[:] = 0.
+        vel += dt*forces
+        move = dt*vel
+        largest = np.sqrt(np.max(np.sum(move**2,axis=1)))
+        if largest > maxMove:
+            move *= maxMove/largest
+        pos = pos + move
+        (energy,forces) = model.energyAndForces(pos)
+    return (pos,energy,nsteps)
+
+def relaxTopology(Top,method='fire',nsteps=5000,ftol=10.,groname=None,
+                  jitter=0.01,seed=0,**kwargs):
+    """
+    Relax the bonded geometry of a topology in place, and optionally write
+    the relaxed coordinates out
+
+    ----------
+    Parameters
+    ----------
+    Top: Topology
+    method: string
+        'fire' or 'steep'
+    nsteps: int
+        maximum number of minimizer steps
+    ftol: float
+        force tolerance in kJ/mol/nm
+    groname: string
+        if given, write the relaxed structure to this gro file
+    jitter: float
+        beads of dihedrals that start out undefined (three collinear
+        backbone beads, as on straight generated arms) are first displaced
+        randomly by about this much (nm) so the minimizer can move them
+    seed: int
+        seed of those displacements
+    kwargs:
+        passed on to BondedModel
+
+    -------
+    Returns
+    -------
+    energies: (float,float)
+        bonded energy before and after
+    steps: int
+        number of minimizer steps taken
+    """
+    model = BondedModel(Top,**kwargs)
+    pos = Top.positions()
+    stuck = model.degenerate(pos)
+    if len(stuck) > 0 and jitter > 0.:
+        random = np.random.RandomState(seed)
+        pos[stuck] += jitter*random.randn(len(stuck),3)
+    start = model.energy(pos)
+    if method == 'fire':
+        (newPos,energy,steps) = fire(model,pos,nsteps,ftol)
+    elif method == 'steep':
+        (newPos,energy,steps) = steepestDescent(model,pos,nsteps,ftol)
+    else:
+        raise ValueError('Unknown minimizer ' + str(method))
+    pos[:] = newPos
+    if groname is not None:
+        title = 'Relaxed by createMartiniModel, bonded energy {:.1f} kJ/mol'\
+                .format(energy)
+        Gro(title,len(Top.atomlist),Top.atomTable(),Top.box).write(groname)
+    return ((start,energy),steps)
+
+def main():
+    parser = argparse.ArgumentParser(description='relax the bonded geometry \
+                                     of a Martini structure')
+    parser.add_argument('itp',metavar='I')
+    parser.add_argument('gro',metavar='G')
+    parser.add_argument('-o','--output',metavar='O',default=None)
+    parser.add_argument('--method',choices=['fire','steep'],default='fire')
+    parser.add_argument('--nsteps',metavar='N',type=int,default=5000)
+    parser.add_argument('--ftol',metavar='F',type=float,default=10.)
+    args = parser.parse_args()
+    if args.output is None:
+        output = args.gro
+    else:
+        output = args.output
+    Top = DXXXTopology(args.itp,args.gro)
+    ((start,energy),steps) = relaxTopology(Top,args.method,args.nsteps,
+                                           args.ftol,output)
+    print('Bonded energy {:.1f} -> {:.1f} kJ/mol in {} steps, wrote {}'.format(
+          start,energy,steps,output))
+
+if __name__ == "__main__":
+    main()
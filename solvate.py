@@ -0,0 +1,268 @@
+# -*- coding: utf-8 -*-
+"""
+In-process Martini solvation, in place of gmx solvate and gmx genion.  The
+box is filled with W beads on a slightly jittered lattice at the density
+of Martini water, waters within a minimum distance of the solute are
+removed with a cell list, and random waters are replaced by NA+ and CL-
+ions to neutralize the topology charges (plus any added salt).  Run as
+
+python solvate.py name.itp name.gro [-b X Y Z] [--conc 0.15] [-o solvated]
+
+where name.gro may hold one or many copies of the molecule (eg from
+insertMolecules.py), to write grompp-ready solvated.gro and solvated.top,
+with solvated.itp for the molecule and solvated_solvent.itp for whichever
+of W, NA and CL martini.itp does not define.
+"""
+from __future__ import absolute_import, division, print_function
+import os,argparse,numpy as np
+from warnings import warn
+from createMartiniModel import DXXXTopology,AtomTable,Gro,Itp,DirectoryTarget,\
+                               readGroFrames
+from neighbours import cellListPairs
+
+#Martini W beads per nm^3, four waters each
+WATERDENSITY = 8.36
+
+#Avogadro's number times 1e-24, ions per nm^3 per mol/L
+MOLARITY = 0.6022140857
+
+#single-bead solvent molecules: name, bead type and charge
+SOLVENTS = [('W','P4',0.),('NA','Qd',1.),('CL','Qa',-1.)]
+
+def waterLattice(box,density=WATERDENSITY,jitter=0.1,random=None):
+    """
+    Positions of water beads on a cubic lattice filling a periodic box.  The
+    number of sites along each edge is rounded so the lattice tiles across
+    the boundaries, and each site is displaced randomly by up to jitter
+    times the spacing so the water does not start out crystalline.
+
+    ----------
+    Parameters
+    ----------
+    box: list of floats, length 3
+    density: float
+        beads per nm^3
+    jitter: float
+        largest displacement, as a fraction of the lattice spacing
+    random: numpy RandomState
+
+    -------
+    Returns
+    -------
+    pos: numpy array, M x 3
+    """
+    box = np.asarray(box,dtype=float)
+    if random is None:
+        random = np.random.RandomState(0)
+    nsites = np.maximum(np.round(box * density ** (1. / 3.)).astype(int),1)
+    spacing = box / nsites
+    grid = np.meshgrid(*[np.arange(n) for n in nsites],indexing='ij')
+    sites = np.column_stack([g.ravel() for g in grid]) + 0.5
+    sites += jitter * (2. * random.rand(len(sites),3) - 1.)
+    return sites * spacing
+
+def solventDefinitions(ffname='martini.itp'):
+    """
+    Text of an itp file defining the solvent molecules of SOLVENTS that the
+    force field file does not define itself, empty if it defines them all
+    """
+    defined = set()
+    flag = None
+    fid = open(ffname)
+    for line in fid:
+        line = line.split(';')[0].strip()
+        if line.startswith('['):
+            flag = line.strip('[] \t').lower()
+        elif flag == 'moleculetype' and len(line) > 0:
+            defined.add(line.split()[0])
+            flag = None
+    fid.close()
+    text = ''
+    for (name,btype,charge) in SOLVENTS:
+        if name in defined:
+            continue
+        text += '[ moleculetype ]\n; molname\tnrexcl\n{}\t\t1\n\n'.format(
+                name)
+        text += '[ atoms ]\n; id\ttype\tresnr\tresidu\tatom\tcgnr\tcharge\n'
+        text += '1\t{}\t1\t{}\t{}\t1\t{:g}\n\n'.format(btype,name,name,charge)
+    return text
+
+class SolvatedSystem(object):
+    """
+    Copies of one molecule with water and ions in a periodic box
+
+    ----------
+    Attributes
+    ----------
+    Top: Topology
+        the molecule
+    positions: numpy array, K x N x 3
+        bead positions of each copy
+    box: numpy vector of floats, length 3
+    solvent: list of (name,numpy array of positions)
+        W, NA and CL beads, in the order they are written out
+    """
+    def __init__(self,Top,positions,box,solvent):
+        self.Top = Top
+        self.positions = positions
+        self.box = np.asarray(box,dtype=float)
+        self.solvent = solvent
+
+    def charge(self):
+        """
+        Net charge of the system
+        """
+        charges = dict((name,charge) for (name,btype,charge) in SOLVENTS)
+        return len(self.positions) * np.sum(self.Top.atomTable().charge) + \
+               sum([charges[name] * len(pos) for (name,pos) in self.solvent])
+
+    def counts(self):
+        """
+        [ molecules ] entries of the system, (name,count) in gro order
+        """
+        return [(self.Top.moltype[0],len(self.positions))] + \
+               [(name,len(pos)) for (name,pos) in self.solvent if len(pos)]
+
+    def write(self,fname,target=None,ffname='martini.itp',title=None):
+        """
+        Write fname.gro, fname.itp (the molecule), fname_solvent.itp (if
+        the force field lacks any of the solvent molecules) and fname.top
+
+        ----------
+        Parameters
+        ----------
+        fname: string
+            base name of the files
+        target: DirectoryTarget, MemoryTarget or ArchiveTarget
+            where to put the files, by default plain files on disk
+        ffname: string
+            force field file, which the top file includes
+        title: string
+            title of the gro file
+        """
+        if target is None:
+            target = DirectoryTarget()
+        if title is None:
+            title = 'Solvated {} built by createMartiniModel'.format(
+                    self.Top.chemName)
+        table = self.Top.atomTable()
+        tables = []
+        for pos in self.positions:
+            copy = table.copy()
+            copy.pos[:] = pos
+            tables.append(copy)
+        types = dict((name,(btype,charge)) for (name,btype,charge)
+                     in SOLVENTS)
+        for (name,pos) in self.solvent:
+            n = len(pos)
+            (btype,charge) = types[name]
+            tables.append(AtomTable(np.arange(1,n+1),[name] * n,[name] * n,
+                                    np.arange(1,n+1),pos,np.zeros((n,3)),
+                                    [btype] * n,[charge] * n,['C'] * n))
+        system = AtomTable.concatenate(tables)
+        target.add(fname+'.gro',Gro(title,len(system),system,
+                                    list(self.box)).text())
+        itp = Itp(self.Top.chemName,self.Top.moltype,table,self.Top.bondlist,
+                  self.Top.conlist,self.Top.anglist,self.Top.dihlist)
+        target.add(fname+'.itp',itp.text())
+        base = os.path.basename(fname)
+        includes = '#include "{}"\n'.format(os.path.basename(ffname)) + \
+                   '#include "{}.itp"\n'.format(base)
+        definitions = solventDefinitions(ffname)
+        if len(definitions) > 0:
+            target.add(fname+'_solvent.itp',definitions)
+            includes += '#include "{}_solvent.itp"\n'.format(base)
+        molecules = ''.join(['{} \t {}\n'.format(name,count)
+                             for (name,count) in self.counts()])
+        target.add(fname+'.top',includes + '[ system ]\n\n' + '; name\n' + \
+                   '{} in water\n\n'.format(self.Top.chemName) + \
+                   '[ molecules ]\n\n' + '; name \t number\n\n' + molecules)
+
+def solvate(Top,box,positions=None,concentration=0.,minDistance=0.4,
+            density=WATERDENSITY,jitter=0.1,seed=0):
+    """
+    Fill a box around copies of a molecule with water, and swap waters for
+    ions to neutralize it
+
+    ----------
+    Parameters
+    ----------
+    Top: Topology
+        the molecule
+    box: list of floats, length 3
+        periodic box edges in nm
+    positions: numpy array, K x N x 3
+        bead positions of each copy, by default the single copy in Top
+    concentration: float
+        NaCl added on top of the neutralizing ions, in mol/L of box
+    minDistance: float
+        waters closer than this (nm) to any solute bead are removed
+    density: float
+        water beads per nm^3
+    jitter: float
+        random displacement of the lattice sites, as a fraction of their
+        spacing
+    seed: int
+        seed of the lattice jitter and of the choice of waters to replace
+
+    -------
+    Returns
+    -------
+    system: SolvatedSystem
+    """
+    box = np.asarray(box,dtype=float)
+    if positions is None:
+        positions = Top.positions()[None].copy()
+    positions = np.asarray(positions,dtype=float)
+    random = np.random.RandomState(seed)
+    water = waterLattice(box,density,jitter,random)
+    (i,j,d) = cellListPairs(water,minDistance,positions.reshape(-1,3),box)
+    keep = np.ones(len(water),dtype=bool)
+    keep[i] = False
+    water = water[keep]
+    charge = len(positions) * np.sum(Top.atomTable().charge)
+    netCharge = int(np.round(charge))
+    if abs(charge - netCharge) > 1e-3:
+        warn('System charge {:.4f} is not an integer.'.format(charge))
+    salt = int(np.round(concentration * MOLARITY * np.prod(box)))
+    nNA = salt + max(0,-netCharge)
+    nCL = salt + max(0,netCharge)
+    if nNA + nCL > len(water):
+        raise ValueError('Only {} waters to replace by {} ions'.format(
+                         len(water),nNA + nCL))
+    swapped = random.permutation(len(water))
+    ions = water[swapped[:nNA + nCL]]
+    water = water[np.sort(swapped[nNA + nCL:])]
+    return SolvatedSystem(Top,positions,box,[('W',water),('NA',ions[:nNA]),
+                                             ('CL',ions[nNA:])])
+
+def main():
+    parser = argparse.ArgumentParser(description='solvate a Martini system \
+                                     in water and neutralize it with ions')
+    parser.add_argument('itp',metavar='I')
+    parser.add_argument('gro',metavar='G')
+    parser.add_argument('-b','--box',metavar='B',type=float,nargs=3,
+                        default=None)
+    parser.add_argument('-o','--output',metavar='O',default='solvated')
+    parser.add_argument('--conc',metavar='C',type=float,default=0.)
+    parser.add_argument('--min-distance',metavar='D',type=float,default=0.4)
+    parser.add_argument('--ff',metavar='F',default='martini.itp')
+    parser.add_argument('--seed',metavar='S',type=int,default=0)
+    args = parser.parse_args()
+    Top = DXXXTopology(args.itp,args.gro)
+    (table,frames,boxes,titles) = readGroFrames(args.gro)
+    positions = frames[0].reshape(-1,len(Top.atomlist),3)
+    if args.box is None:
+        box = list(boxes[0])
+    else:
+        box = args.box
+    system = solvate(Top,box,positions,args.conc,args.min_distance,
+                     seed=args.seed)
+    system.write(args.output,ffname=args.ff)
+    print('Solvated {} molecules: {}, wrote {}.gro and {}.top'.format(
+          len(positions),', '.join(['{} {}'.format(name,count) for
+                                    (name,count) in system.counts()[1:]]),
+          args.output,args.output))
+
+if __name__ == "__main__":
+    main()
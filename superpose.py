@@ -0,0 +1,232 @@
+# -*- coding: utf-8 -*-
+"""
+Kabsch superposition of generated molecules onto a reference structure, so
+the backbone and OPV3 core of a new chemistry sit exactly where they sit in
+a reference DFAG dimer (or any other multimer, over one or many frames).
+Run as
+
+python superpose.py reference.gro name1.gro [name2.gro ...]
+
+to write name1_superposed.gro and so on, each holding one copy of the
+molecule on every copy of the reference molecule in every frame.
+"""
+from __future__ import absolute_import, division, print_function
+import os,argparse,numpy as np
+from createMartiniModel import AtomTable,Gro,DirectoryTarget,getForceField,\
+                               readGroFrames
+
+def moleculeSize(table):
+    """
+    Number of beads per molecule of a system of identical molecules: the
+    shortest period of the residue and bead names that divides the system
+    """
+    labels = np.array(['{}:{}'.format(r,n) for (r,n) in
+                       zip(table.resname,table.name)])
+    natoms = len(labels)
+    for size in range(1,natoms+1):
+        if natoms % size == 0 and \
+           np.all(labels.reshape(-1,size) == labels[:size]):
+            return size
+
+def anchorKeys(table):
+    """
+    The beads that pin a molecule in place, every BB bead and every bead of
+    a residue without a Martini side chain (the OPV3 core), with keys that
+    identify them across chemistries: (residue offset from the first core
+    residue,bead name,occurrence of that name within the residue).  Arms
+    of different lengths thus still match around the core.
+
+    ----------
+    Parameters
+    ----------
+    table: AtomTable
+        a single molecule
+
+    -------
+    Returns
+    -------
+    inds: numpy vector of ints
+        rows of the anchor beads
+    keys: list of tuples
+    """
+    sidechains = getForceField().sidechains
+    core = np.array([str(resname) not in sidechains 
+                     for resname in table.resname],dtype=bool)
+    if np.any(core):
+        first = table.resNo[core].min()
+    else:
+        first = table.resNo.min()
+    seen = {}
+    inds = []
+    keys = []
+    for ind in range(len(table)):
+        (resNo,name) = (table.resNo[ind],str(table.name[ind]))
+        count = seen.get((resNo,name),0)
+        seen[(resNo,name)] = count + 1
+        if name == 'BB' or core[ind]:
+            inds.append(ind)
+            keys.append((resNo - first,name,count))
+    return (np.array(inds,dtype=int),keys)
+
+def kabsch(mobile,reference):
+    """
+    Batched least-squares superposition without reflections.  Leading
+    dimensions of the two point sets broadcast against each other.
+
+    ----------
+    Parameters
+    ----------
+    mobile: numpy array, ... x A x 3
+    reference: numpy array, ... x A x 3
+
+    -------
+    Returns
+    -------
+    rotations: numpy array, ... x 3 x 3
+    shifts: numpy array, ... x 3
+        mobile points go to np.dot(mobile,rotation.T) + shift
+    rmsd: numpy array, ...
+        after superposition
+    """
+    mobile = np.asarray(mobile,dtype=float)
+    reference = np.asarray(reference,dtype=float)
+    mobileCenter = mobile.mean(axis=-2)
+    referenceCenter = reference.mean(axis=-2)
+    m = mobile - mobileCenter[...,None,:]
+    r = reference - referenceCenter[...,None,:]
+    H = np.matmul(np.swapaxes(m,-1,-2),r)
+    (U,S,Vt) = np.linalg.svd(H)
+    V = np.swapaxes(Vt,-1,-2)
+    Ut = np.swapaxes(U,-1,-2)
+    sign = np.sign(np.linalg.det(np.matmul(V,Ut)))
+    V[...,:,2] *= sign[...,None]
+    rotations = np.matmul(V,Ut)
+    shifts = referenceCenter - np.einsum('...ij,...j->...i',rotations,
+                                         mobileCenter)
+    aligned = np.matmul(m,np.swapaxes(rotations,-1,-2))
+    rmsd = np.sqrt(np.mean(np.sum((aligned - r)**2,axis=-1),axis=-1))
+    return (rotations,shifts,rmsd)
+
+def _firstMolecule(table,size):
+    """
+    AtomTable of the first size beads of a table
+    """
+    return AtomTable(table.resNo[:size],table.resname[:size],
+                     table.name[:size],table.number[:size],table.pos[:size],
+                     table.vel[:size],table.btype[:size],table.charge[:size],
+                     table.structure[:size])
+
+def superposeLibrary(tables,refTable,refFrames,refSize=None):
+    """
+    Superpose every molecule of a library onto every copy of the reference
+    molecule in every reference frame, matching anchor beads (see
+    anchorKeys).  Molecules with the same anchors are aligned together in
+    one batched Kabsch call.
+
+    ----------
+    Parameters
+    ----------
+    tables: list of AtomTable objects
+        one molecule each, eg [Top.atomTable() for Top in library]
+    refTable: AtomTable
+        names of the reference system (from readGroFrames)
+    refFrames: numpy array, F x N x 3
+        reference positions
+    refSize: int
+        beads per reference molecule, by default found from the repeating
+        names of the reference system
+
+    -------
+    Returns
+    -------
+    positions: list of numpy arrays, F x C x n x 3
+        each molecule superposed onto the C reference copies of each frame
+    rmsds: list of numpy arrays, F x C
+        RMSD of the anchor beads after superposition
+    """
+    if refSize is None:
+        refSize = moleculeSize(refTable)
+    refFrames = np.asarray(refFrames,dtype=float)
+    (nframes,natoms) = refFrames.shape[:2]
+    copies = refFrames.reshape(nframes,natoms // refSize,refSize,3)
+    (refInds,refKeys) = anchorKeys(_firstMolecule(refTable,refSize))
+    refLookup = dict(zip(refKeys,refInds))
+    groups = {}
+    for (t,table) in enumerate(tables):
+        (inds,keys) = anchorKeys(table)
+        common = [(ind,refLookup[key]) for (ind,key) in zip(inds,keys)
+                  if key in refLookup]
+        if len(common) < 3:
+            raise ValueError('Molecule {} shares fewer than three anchor '
+                             'beads with the reference'.format(t))
+        (mobileInds,matched) = zip(*common)
+        groups.setdefault(tuple(matched),[]).append((t,list(mobileInds)))
+    positions = [None] * len(tables)
+    rmsds = [None] * len(tables)
+    for (matched,members) in groups.items():
+        mobile = np.array([tables[t].pos[inds] for (t,inds) in members])
+        reference = copies[:,:,list(matched),:]
+        (rotations,shifts,rmsd) = kabsch(mobile[:,None,None,:,:],
+                                         reference[None,:,:,:,:])
+        for (g,(t,inds)) in enumerate(members):
+            positions[t] = np.einsum('fcij,nj->fcni',rotations[g],
+                                     tables[t].pos) + shifts[g][:,:,None,:]
+            rmsds[t] = rmsd[g]
+    return (positions,rmsds)
+
+def writeSuperposed(table,positions,boxes,fname,target=None,title=None):
+    """
+    Write a molecule superposed onto a reference as a gro file with one
+    frame per reference frame and one copy per reference molecule
+
+    ----------
+    Parameters
+    ----------
+    table: AtomTable
+        the molecule
+    positions: numpy array, F x C x n x 3
+        from superposeLibrary
+    boxes: numpy array, F x 3
+        box of each reference frame
+    fname: string
+        name of the gro file
+    target: DirectoryTarget, MemoryTarget or ArchiveTarget
+        where to put the file, by default plain files on disk
+    title: string
+        title of every frame
+    """
+    if target is None:
+        target = DirectoryTarget()
+    if title is None:
+        title = 'Superposed onto reference by createMartiniModel'
+    text = []
+    for (frame,box) in zip(positions,boxes):
+        copies = []
+        for pos in frame:
+            copy = table.copy()
+            copy.pos[:] = pos
+            copies.append(copy)
+        system = AtomTable.concatenate(copies)
+        text.append(Gro(title,len(system),system,list(box)).text())
+    target.add(fname,''.join(text))
+
+def main():
+    parser = argparse.ArgumentParser(description='superpose Martini \
+                                     molecules onto a reference structure')
+    parser.add_argument('reference',metavar='R')
+    parser.add_argument('gro',metavar='G',nargs='+')
+    parser.add_argument('-s','--suffix',metavar='S',default='_superposed')
+    parser.add_argument('-n','--refsize',metavar='N',type=int,default=None)
+    args = parser.parse_args()
+    (refTable,refFrames,boxes,titles) = readGroFrames(args.reference)
+    tables = [readGroFrames(groname)[0] for groname in args.gro]
+    (positions,rmsds) = superposeLibrary(tables,refTable,refFrames,
+                                         args.refsize)
+    for (groname,table,pos,rmsd) in zip(args.gro,tables,positions,rmsds):
+        outname = os.path.splitext(groname)[0] + args.suffix + '.gro'
+        writeSuperposed(table,pos,boxes,outname)
+        print('{}: anchor RMSD {:.3f} nm (max over frames and copies {:.3f}),'
+              ' wrote {}'.format(groname,rmsd.mean(),rmsd.max(),outname))
+
+if __name__ == "__main__":
+    main()
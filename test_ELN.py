@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+"""
+Unit tests for the grid-based elastic network in ELN
+"""
+import numpy as np
+import ELN
+
+def randomChain(n,seed=0):
+    """
+    (atom id,coordinates in Angstrom) of a random walk of 3.8 A steps folded
+    into a box at roughly protein density
+    """
+    random = np.random.RandomState(seed)
+    steps = random.randn(n,3)
+    steps *= 3.8 / np.sqrt(np.sum(steps**2,axis=1))[:,None]
+    pos = np.mod(np.cumsum(steps,axis=0),(n * 110.) ** (1. / 3.))
+    return [(k+1,tuple([float(x) for x in p])) for (k,p) in enumerate(pos)]
+
+def test_rubberBands():
+    """
+    make sure the grid search gives exactly the bonds of the pair loop, in
+    the same order, without consuming its input
+    """
+    for n in [0,3,4,5,60,800]:
+        atoms = randomChain(n,n)
+        for args in [(0.5,0.9,0.,1.,500.,0.),(0.5,0.9,1.,1.,500.,300.),
+                     (0.6,0.8,0.5,2.,300.,10.)]:
+            bonds = ELN.rubberBands(atoms,*args)
+            assert len(atoms) == n
+            assert bonds == ELN.rubberBandsLoop(list(atoms),*args)
+    assert len(bonds) > 0
+    assert all([type(b['parameters'][0]) == float for b in bonds])
+
+def test_rubberBands_domain():
+    """
+    make sure a fractional decay power below the lower bound fails as it
+    does in the pair loop
+    """
+    atoms = randomChain(50)
+    for rubberBands in [ELN.rubberBands,ELN.rubberBandsLoop]:
+        try:
+            rubberBands(list(atoms),0.9,0.95,1.,0.5,500.,0.)
+            assert False
+        except ValueError:
+            pass
+
+def test_rubberBandsAveraged_single():
+    """
+    make sure the network averaged over one frame is that of the frame
+    """
+    atoms = randomChain(300,1)
+    average = ELN.DistanceAverage(0.9)
+    average.add([x for (bi,x) in atoms])
+    bonds = ELN.rubberBandsAveraged([bi for (bi,x) in atoms],average,0.5,1.,
+                                    1.,500.,300.)
+    assert bonds == ELN.rubberBands(atoms,0.5,0.9,1.,1.,500.,300.)
+
+def test_DistanceAverage():
+    """
+    make sure the streamed means match the means over all frames, and that
+    pairs missed in early frames are left out and counted
+    """
+    atoms = randomChain(200,2)
+    pos = np.array([x for (bi,x) in atoms])
+    random = np.random.RandomState(3)
+    frames = [pos + random.randn(*pos.shape) for k in range(6)]
+    (ii,jj) = np.triu_indices(len(pos),3)
+    mean = np.mean([np.sqrt(np.sum((f[ii] - f[jj])**2,axis=1)) / 10
+                    for f in frames],axis=0)
+    want = mean < 0.9
+    for skin in [10.,0.]:
+        average = ELN.DistanceAverage(0.9,skin)
+        for f in frames:
+            average.add(f)
+        (i,j,dij,dropped) = average.distances()
+        assert average.frames == 6
+        assert np.all(j >= i + 3)
+        assert np.all(np.diff(i * len(pos) + j) > 0)
+        #only exact means are returned, and the pairs missed are counted
+        pairs = dict(zip(zip(ii[want],jj[want]),mean[want]))
+        assert np.allclose(dij,[pairs[p] for p in zip(i,j)],rtol=0,atol=1e-12)
+        if skin > 0:
+            assert dropped == 0
+            assert len(i) == len(pairs)
+        else:
+            assert dropped > 0
+            assert len(i) + dropped >= len(pairs)
+    try:
+        average.add(pos[:-1])
+        assert False
+    except ValueError:
+        pass
@@ -0,0 +1,179 @@
+# -*- coding: utf-8 -*-
+"""
+Unit tests for the NumPy GRO and PDB frame readers and the frame index in IO
+"""
+import os,tempfile,shutil
+import numpy as np
+import IO
+
+def groLines(nframes,natoms,seed=0):
+    """
+    Lines of a multi-frame gro file of residues of three atoms, some lines
+    with velocities
+    """
+    random = np.random.RandomState(seed)
+    lines = []
+    for frame in range(nframes):
+        lines += ['Frame {}\n'.format(frame),' {}\n'.format(natoms)]
+        for k in range(natoms):
+            (x,y,z) = 20. * random.rand(3) - 5.
+            line = IO.groline % (k // 3 + 1,['ALA','GLY'][(k // 3) % 2],
+                                 ['N','CA','C'][k % 3],k+1,x,y,z)
+            if k % 5 == 0:
+                line = line[:-1] + '  0.1000 -0.2000  0.3000\n'
+            lines.append(line)
+        lines.append('   3.00000   3.00000   3.00000\n')
+    return lines
+
+def test_groFrameIterator():
+    """
+    make sure the array frames hold the atoms of groAtom and split into the
+    same residues
+    """
+    lines = groLines(3,301)
+    frames = list(IO.groFrameIterator(iter(lines)))
+    assert len(frames) == 3
+    for (f,(title,atoms,box)) in enumerate(frames):
+        assert title == 'Frame {}\n'.format(f)
+        assert box == IO.groBoxRead(lines[f*304+303])
+        want = [IO.groAtom(line) for line in lines[f*304+2:f*304+303]]
+        got = [a for r in IO.residues(atoms) for a in r]
+        assert got == want
+        assert [len(r) for r in IO.residues(atoms)] == \
+               [len(r) for r in IO.residues(want)]
+        assert all([type(r) == IO.Residue for r in IO.residues(atoms)])
+
+def test_groFrame_numbers():
+    """
+    make sure odd numbers read as with float(), and bad ones still fail
+    """
+    lines = ['    1PRN      N    1  -0.000     0.1   -12.5\n',
+             '99999PRN     CA    2 123.456-7.00001     0.0\n']
+    frame = IO.groFrame(lines)
+    for (atom,line) in zip(frame,lines):
+        want = IO.groAtom(line)
+        assert (atom['name'],atom['resname'],atom['resid']) == want[:3]
+        assert [repr(x) for x in atom['xyz'].tolist()] == \
+               [repr(x) for x in want[4:]]
+    for line in ['    1PRN      N    1  1e.000     0.1   -12.5\n',
+                 '    1PRN      N    1   1-000     0.1   -12.5\n',
+                 '    1PRN      N    1   2.0.0     0.1   -12.5\n',
+                 '    1PRN      N    1   1.000     0.1        \n',
+                 '    1PRN      N    1   1.000   0 .1    -12.5\n',
+                 '  1.5PRN      N    1   1.000     0.1   -12.5\n']:
+        for read in [IO.groAtom,lambda line: IO.groFrame([line])]:
+            try:
+                read(line)
+                assert False
+            except ValueError:
+                pass
+
+def pdbLines(nmodels,natoms,seed=0):
+    """
+    Lines of a multi-model pdb file with two chains, one of them without
+    identifier, and insertion codes
+    """
+    random = np.random.RandomState(seed)
+    lines = ['TITLE     test\n',
+             IO.pdbBoxLine % (50.,60.,70.,90.,90.,90.)]
+    for model in range(nmodels):
+        lines.append('MODEL {:8d}\n'.format(model+1))
+        for k in range(natoms):
+            (x,y,z) = 200. * random.rand(3) - 50.
+            chain = k < natoms // 2 and 'A' or ' '
+            insertion = ' AB'[(k // 4) % 3]
+            lines.append('{:6s}{:5d} {:^4s} {:3s} {:1s}{:4d}{:1s}   '
+                         '{:8.3f}{:8.3f}{:8.3f}  1.00  0.00\n'.format(
+                         ['ATOM','HETATM'][k % 7 == 0],k+1,
+                         ['N','CA','C','O'][k % 4],['ALA','GLY'][k % 2 // 1],
+                         chain,k // 12 - 3,insertion,x,y,z))
+            if k == natoms // 2 - 1:
+                lines.append('TER\n')
+        lines.append('ENDMDL\n')
+    return lines
+
+def test_pdbFrameIterator():
+    """
+    make sure the array models hold the atoms of pdbAtom and split into the
+    same chains and residues
+    """
+    lines = pdbLines(3,202)
+    frames = list(IO.pdbFrameIterator(iter(lines)))
+    assert len(frames) == 3
+    for (f,(title,atoms,box)) in enumerate(frames):
+        if f == 0:
+            assert title == 'TITLE     test\n'
+            assert box == IO.pdbBoxRead(lines[1])
+        want = [IO.pdbAtom(line) for line in lines[f*205+3:f*205+207]
+                if line.startswith('ATOM') or line.startswith('HETATM')]
+        assert [a for c in IO.pdbChains(atoms) for r in IO.residues(c)
+                for a in r] == want
+        assert [[len(r) for r in IO.residues(c)] for c in
+                IO.pdbChains(atoms)] == [[len(r) for r in IO.residues(c)]
+                                         for c in IO.pdbChains(want)]
+
+def sameFrame(a,b):
+    """
+    whether two (title,atoms,box) frames hold the same atoms
+    """
+    return a[0] == b[0] and list(a[2]) == list(b[2]) and \
+           list(IO.residues(a[1])) == list(IO.residues(b[1]))
+
+def test_frameIndex():
+    """
+    make sure frames read through the index are those of the iterators,
+    and that the sidecar index is reused until the file changes
+    """
+    tmpdir = tempfile.mkdtemp()
+    try:
+        for (name,lines,iterator) in [
+                ('frames.gro',groLines(5,31),IO.groFrameIterator),
+                ('models.pdb',pdbLines(4,30),IO.pdbFrameIterator),
+                ('single.pdb',[l for l in pdbLines(1,30) if not
+                               l.startswith('ENDMDL')],IO.pdbFrameIterator)]:
+            fname = os.path.join(tmpdir,name)
+            fid = open(fname,'w')
+            fid.write(''.join(lines))
+            fid.close()
+            frames = list(iterator(iter(lines)))
+            (fileType,offsets) = IO.frameIndex(fname)
+            assert fileType == name.endswith('gro') and 'GRO' or 'PDB'
+            assert len(offsets) == len(frames) + 1
+            assert os.path.exists(IO.frameIndexName(fname))
+            for k in [len(frames)-1,0,-1]:
+                assert sameFrame(IO.readFrame(fname,k),frames[k])
+            assert all([sameFrame(a,b) for (a,b) in
+                        zip(IO.indexedFrames(fname,'1::2'),frames[1::2])])
+            try:
+                IO.readFrame(fname,len(frames))
+                assert False
+            except IndexError:
+                pass
+            #a stale index is replaced
+            fid = open(IO.frameIndexName(fname),'w')
+            fid.write('{} 1 0.0\n0\n1\n'.format(fileType))
+            fid.close()
+            assert IO.frameIndex(fname) == (fileType,offsets)
+            assert IO.frameIndex(fname) == (fileType,offsets)
+    finally:
+        shutil.rmtree(tmpdir)
+
+def test_pdbFrame_numbers():
+    """
+    make sure malformed residue numbers and coordinates fail as in pdbAtom
+    """
+    good = 'ATOM      1  CA  ALA A  12A     -0.000  10.500  -3.250  1.00  0.00\n'
+    assert [tuple(r) for r in IO.residues(IO.pdbFrame([good]))][0][0] == \
+           IO.pdbAtom(good)
+    for line in [good[:22] + '12.5' + good[26:],
+                 good[:22] + '    ' + good[26:],
+                 good[:22] + '1 2 ' + good[26:],
+                 good[:30] + '  1-0.00' + good[38:],
+                 good[:38] + '  2.0.50' + good[46:],
+                 good[:46] + '        ' + good[54:]]:
+        for read in [IO.pdbAtom,lambda line: IO.pdbFrame([line])]:
+            try:
+                read(line)
+                assert False
+            except ValueError:
+                pass
@@ -443,3 +443,544 @@ def test_change_DFAG_to_DTVG():
     Top1.write('DTVG_2midway_test')
     Top1.resSwap('VAL','C',13)
     Top1.write('DTVG_test')
+
+def test_swapList():
+    """
+    make sure symmetric and antisymmetric swaps land on the right residues
+    """
+    swaps = swapList(['PHE','ALA','GLY'],True)
+    assert swaps == [('PHE',2),('ALA',3),('GLY',4),('PHE',14),('ALA',13),
+                     ('GLY',12)]
+    swaps = swapList(['PHE','ALA','GLY'],False)
+    assert swaps == [('PHE',2),('ALA',3),('GLY',4),('PHE',12),('ALA',13),
+                     ('GLY',14)]
+    assert chemistryName(['PHE','ALA','GLY'],True) == 'DFAG_sym'
+    assert chemistryName(['TRP','VAL','GLY'],False) == 'DWVG_asym'
+
+def test_mutateTemplate():
+    """
+    make sure the template is untouched by building a chemistry from it
+    """
+    template = DXXXTopology('DFAG.itp','DFAG.gro')
+    natoms = len(template.atomlist)
+    Top = mutateTemplate(template,['TRP','VAL','GLY'],True)
+    assert len(template.atomlist) == natoms
+    assert template.atomlist[2].resname == 'PHE'
+    assert len(Top.atomlist) == natoms + 4
+    assert Top.atomlist[2].resname == 'TRP'
+    assert Top.chemName == 'DWVG_sym'
+    
+def test_generateLibrary():
+    """
+    make sure serial and parallel library generation write the same files
+    """
+    import tempfile,shutil
+    specs = combinatorialSpec(['ALA','PHE'])
+    assert len(specs) == 16
+    tmpdir = tempfile.mkdtemp()
+    try:
+        serial = os.path.join(tmpdir,'serial')
+        parallel = os.path.join(tmpdir,'parallel')
+        (names,rate) = generateLibrary(specs,serial,nprocs=1)
+        (pnames,prate) = generateLibrary(specs,parallel,nprocs=2)
+        assert names == pnames
+        assert rate > 0
+        for name in names:
+            for suffix in ['.gro','.itp','.top']:
+                check_file_equivalency(os.path.join(serial,name+suffix),
+                                       os.path.join(parallel,name+suffix))
+    finally:
+        shutil.rmtree(tmpdir)
+
+def test_main():
+    """
+    make sure the command line builds the requested symmetry and refuses 
+    anything but sym or asym
+    """
+    import tempfile,shutil
+    tmpdir = tempfile.mkdtemp()
+    try:
+        for form in ['sym','asym']:
+            main(['PHE','ALA','GLY',form,os.path.join(tmpdir,form+'.gro'),
+                  os.path.join(tmpdir,form+'.itp')])
+            assert 'DFAG_' + form in open(os.path.join(tmpdir,
+                                                       form+'.itp')).read()
+        try:
+            main(['PHE','ALA','GLY','False',os.path.join(tmpdir,'no.gro'),
+                  os.path.join(tmpdir,'no.itp')])
+        except SystemExit:
+            pass
+        else:
+            assert False
+        assert not os.path.exists(os.path.join(tmpdir,'no.itp'))
+    finally:
+        shutil.rmtree(tmpdir)
+
+def test_librarySideChainContacts():
+    """
+    make sure no swapped in side chain bead of a library member ends up 
+    within 0.3 nm of a bead it is not bonded to
+    """
+    import tempfile,shutil
+    specs = [(['TRP','LYS','PHE'],True),(['PHE','ARG','TRP'],False),
+             (['GLN','TYR','HIS'],True)]
+    tmpdir = tempfile.mkdtemp()
+    try:
+        (names,rate) = generateLibrary(specs,tmpdir,nprocs=1)
+        for name in names:
+            Top = DXXXTopology(os.path.join(tmpdir,name+'.itp'),
+                               os.path.join(tmpdir,name+'.gro'))
+            index = dict([(id(atom),i) for (i,atom) \
+                          in enumerate(Top.atomlist)])
+            bonded = set()
+            for bond in Top.bondlist.entries + Top.conlist.entries:
+                bonded.add(tuple(sorted([index[id(atom)] \
+                                         for atom in bond.ainds])))
+            pos = np.array([atom.pos for atom in Top.atomlist]).reshape((-1,3))
+            dist = np.sqrt(np.sum((pos[:,None,:] - pos[None,:,:])**2,axis=2))
+            for (i,j) in zip(*np.nonzero(dist < 0.3)):
+                if i < j and (i,j) not in bonded:
+                    assert Top.atomlist[i].name == 'BB' and \
+                           Top.atomlist[j].name == 'BB'
+    finally:
+        shutil.rmtree(tmpdir)
+
+def test_indexResidues():
+    """
+    make sure the residue index stays consistent with the atomlist through
+    removals and swaps
+    """
+    def bruteBB(Top,resID):
+        for ind in range(len(Top.atomlist)):
+            atom = Top.atomlist[ind]
+            if atom.resNo == resID and atom.name == 'BB':
+                return ind
+        return None
+    Top = DXXXTopology('DFAG.itp','DFAG.gro')
+    assert Top.findBBinRes(6) == 9
+    assert Top.resRange[2] == (2,6)
+    Top.resSwap('TRP','C',2)
+    Top.resSwap('VAL','C',13)
+    Top.removeRes(4)
+    for resID in range(0,17):
+        assert Top.findBBinRes(resID) == bruteBB(Top,resID)
+        assert Top.resAtomIndices(resID) == \
+        [ind for ind in range(len(Top.atomlist)) \
+         if Top.atomlist[ind].resNo == resID]
+
+def test_Blist_beadIndex():
+    """
+    test the reverse index of the Blist object through removal and insertion
+    """
+    B1 = Bead(1,'TES','T',1,np.array([0.,0.,0.]),np.array([0.,0.,0.]),'T')
+    B2 = Bead(2,'TES','T',2,np.array([0.,0.,0.]),np.array([0.,0.,0.]),'T')
+    B3 = Bead(3,'TES','T',3,np.array([0.,0.,0.]),np.array([0.,0.,0.]),'T')
+    Blst = Blist()
+    B12 = Bond([B1,B2],[])
+    B23 = Bond([B2,B3],[])
+    Blst.append(B12)
+    Blst.append(B23)
+    assert Blst.entriesContaining([B2]) == [B12,B23]
+    B3.number = 7
+    Blst.removeByAtoms([B3])
+    assert Blst.entries == [B12]
+    assert B3 not in Blst.beadIndex
+    new = Blist()
+    new.append(B23)
+    Blst.insertByResIndex(new,2,[B1])
+    assert Blst.entries == [B12,B23]
+    assert Blst.position(B23) == 1
+    
+def test_Blist_order():
+    """
+    make sure insertions and removals through the ordering keys give the 
+    same order as splicing a plain list, and survive pickling
+    """
+    beads = [Bead(i,'TES','T',i,np.array([0.,0.,0.]),np.array([0.,0.,0.]),
+                  'T') for i in range(1,7)]
+    bonds = [Bond([beads[i],beads[i+1]],[]) for i in range(5)]
+    Blst = Blist()
+    for bond in bonds[:3]:
+        Blst.append(bond)
+    expected = list(bonds[:3])
+    for (bond,prevBeads,after) in [(bonds[3],[beads[1]],2),
+                                   (bonds[4],[beads[0]],1),
+                                   (Bond([beads[5],beads[0]],[]),[],0)]:
+        new = Blist()
+        new.append(bond)
+        Blst.insertByResIndex(new,0,prevBeads)
+        expected[after:after] = [bond]
+        assert Blst.entries == expected
+    Blst.remove(bonds[1])
+    expected.remove(bonds[1])
+    tail = Bond([beads[4],beads[5]],[])
+    Blst.append(tail)
+    expected.append(tail)
+    assert Blst.entries == expected
+    assert len(Blst) == len(expected)
+    assert [Blst.position(bond) for bond in expected] == \
+           list(range(len(expected)))
+    Copy = pickle.loads(pickle.dumps(Blst,pickle.HIGHEST_PROTOCOL))
+    assert [str(bond) for bond in Copy.entries] == \
+           [str(bond) for bond in expected]
+    Copy.remove(Copy.entries[0])
+    assert len(Copy) == len(expected) - 1
+    
+def test_removeRes_beadIndex():
+    """
+    make sure removing residues leaves no stale beads in the reverse index
+    """
+    Top = DXXXTopology('DFAG.itp','DFAG.gro')
+    Top.resSwap('TRP','C',2)
+    Top.removeRes(8)
+    atoms = set(Top.atomlist)
+    for blist in [Top.bondlist,Top.conlist,Top.anglist,Top.dihlist]:
+        for bead in blist.beadIndex:
+            assert bead in atoms
+        for entry in blist:
+            for bead in entry.ainds:
+                assert entry in blist.beadIndex[bead]
+
+def test_getForceField():
+    """
+    make sure the shared force field is built once, read-only, and agrees
+    with a fresh martini22 instance
+    """
+    import pickle
+    ff = getForceField()
+    assert getForceField() is ff
+    ref = martini22()
+    rp = ff.residueParameters('PHE','C')
+    assert rp['bbtype'] == ref.bbdef[8]
+    assert list(rp['sctypes']) == ref.sidechains['PHE'][0]
+    assert rp['bbbond'][1] == ref.bbldef[8]
+    assert len(rp['scterms']) == 4 + 2 + 1
+    assert ff.residueParameters('ALA','C')['bbtype'] == 'P4'
+    try:
+        ff.sidechains['PHE'] = []
+        assert False
+    except TypeError:
+        pass
+    try:
+        ff.bbdef = []
+        assert False
+    except AttributeError:
+        pass
+    ff2 = pickle.loads(pickle.dumps(ff,2))
+    assert ff2.residueParameters('TRP','H') == ff.residueParameters('TRP','H')
+
+def test_templateCache():
+    """
+    make sure a cached template matches a parsed one and that the cache is
+    refreshed when the template changes
+    """
+    import shutil,tempfile
+    tmpdir = tempfile.mkdtemp()
+    itpname = os.path.join(tmpdir,'DFAG.itp')
+    groname = os.path.join(tmpdir,'DFAG.gro')
+    shutil.copy('DFAG.itp',itpname)
+    shutil.copy('DFAG.gro',groname)
+    try:
+        Top1 = DXXXTopology(itpname,groname,cache=True)
+        assert os.path.isfile(templateCacheName(itpname,groname))
+        Top2 = DXXXTopology(itpname,groname,cache=True)
+        assert len(Top2.atomlist) == len(Top1.atomlist)
+        assert Top2.conlist[0].ainds[1] is Top2.atomlist[4]
+        npt.assert_array_equal(Top2.atomlist[7].pos,Top1.atomlist[7].pos)
+        for (l1,l2) in [(Top1.bondlist,Top2.bondlist),
+                        (Top1.anglist,Top2.anglist),
+                        (Top1.dihlist,Top2.dihlist)]:
+            assert [str(e) for e in l1] == [str(e) for e in l2]
+        Top2.resSwap('TRP','C',2)
+        fid = open(groname)
+        lines = fid.readlines()
+        fid.close()
+        lines[2] = lines[2].replace('5.288','9.999')
+        fid = open(groname,'w')
+        fid.writelines(lines)
+        fid.close()
+        Top3 = DXXXTopology(itpname,groname,cache=True)
+        npt.assert_almost_equal(Top3.atomlist[0].pos[0],9.999)
+    finally:
+        shutil.rmtree(tmpdir)
+
+def test_clone():
+    """
+    make sure a clone is independent of its original and writes the same
+    files after the same swaps
+    """
+    Top = DXXXTopology('DFAG.itp','DFAG.gro')
+    Clone = Top.clone()
+    assert Clone.atomlist[0] is not Top.atomlist[0]
+    assert Clone.bondlist[0].ainds[0] is Clone.atomlist[0]
+    Clone.resSwap('TRP','C',2)
+    Clone.atomlist[0].pos[0] = 100.
+    assert len(Top.atomlist) == 29
+    assert Top.atomlist[2].resname == 'PHE'
+    assert Top.atomlist[6].number == 7
+    assert Top.atomlist[0].pos[0] == 5.288
+    assert Top.bondlist[1].ainds[1] is Top.atomlist[6]
+    Top.resSwap('TRP','C',2)
+    ref = MemoryTarget()
+    Top.write('DTAG_clone',ref)
+    Clone.atomlist[0].pos[0] = 5.288
+    test = MemoryTarget()
+    Clone.write('DTAG_clone',test)
+    for suffix in ['.gro','.itp']:
+        assert test.files['DTAG_clone'+suffix] == \
+               ref.files['DTAG_clone'+suffix]
+
+def test_resSwapMany():
+    """
+    make sure a bulk mutation gives exactly the same topology as the
+    equivalent sequence of single swaps
+    """
+    Top = DXXXTopology('DFAG.itp','DFAG.gro')
+    for mutations in [[(2,('TRP','C')),(3,('VAL','C')),(4,('LYS','C')),
+                       (14,('TRP','C')),(13,('VAL','C')),(12,('LYS','C'))],
+                      [(3,('ARG','E')),(2,('GLY','C')),(1,('PHE','H')),
+                       (15,('ALA','C'))],
+                      {7:('TYR','C'),8:('HIS','C'),6:('SER','C')}]:
+        Seq = Top.clone()
+        if isinstance(mutations,dict):
+            order = sorted(mutations.items())
+        else:
+            order = mutations
+        for (resID,(name,structure)) in order:
+            Seq.resSwap(name,structure,resID)
+        Bulk = Top.clone()
+        Bulk.resSwapMany(mutations)
+        assert [str(a) for a in Seq.atomlist] == \
+               [str(a) for a in Bulk.atomlist]
+        for (l1,l2) in [(Seq.bondlist,Bulk.bondlist),
+                        (Seq.conlist,Bulk.conlist),
+                        (Seq.anglist,Bulk.anglist),
+                        (Seq.dihlist,Bulk.dihlist)]:
+            assert [str(e) for e in l1] == [str(e) for e in l2]
+        for (a1,a2) in zip(Seq.atomlist,Bulk.atomlist):
+            npt.assert_array_equal(a1.pos,a2.pos)
+
+def test_PeptideTopology():
+    """
+    make sure building a sequence directly matches swapping every arm
+    residue of the template, apart from the backbone-backbone-side chain
+    angles that sequential swaps drop, and that long arms scale up
+    """
+    Top = DXXXTopology('DFAG.itp','DFAG.gro')
+    left = ['PAS','TRP','VAL','GLY']
+    right = ['GLY','VAL','TRP','PAS']
+    for structure in ['C','E']:
+        Pep = PeptideTopology(left,right,structure,template=Top)
+        Swapped = Top.clone()
+        mutations = dict([(i+1,(name,structure)) for (i,name) \
+                          in enumerate(left)] + \
+                         [(i+12,(name,structure)) for (i,name) \
+                          in enumerate(right)])
+        Swapped.resSwapMany(mutations)
+        assert [str(a) for a in Pep.atomlist] == \
+               [str(a) for a in Swapped.atomlist]
+        for (a1,a2) in zip(Pep.atomlist,Swapped.atomlist):
+            if a1.name == 'BB':
+                npt.assert_array_equal(a1.pos,a2.pos)
+        for (l1,l2) in [(Pep.bondlist,Swapped.bondlist),
+                        (Pep.conlist,Swapped.conlist),
+                        (Pep.dihlist,Swapped.dihlist)]:
+            assert sorted([str(e) for e in l1]) == sorted([str(e) for e in l2])
+        pepAngs = [str(e) for e in Pep.anglist]
+        swapAngs = [str(e) for e in Swapped.anglist]
+        assert set(swapAngs) < set(pepAngs)
+        assert len(pepAngs) == len(swapAngs) + 3
+    assert len(Top.atomlist) == 29
+    n = 500
+    Long = PeptideTopology(['PAS'] + ['ALA'] * n,['ALA'] * n + ['PAS'],
+                           template=Top)
+    assert len(Long.atomlist) == 2 * n + 4 + 13
+    assert Long.atomlist[-1].resNo == 2 * n + 2 + 7
+    assert Long.atomlist[-1].number == len(Long.atomlist)
+    Short = PeptideTopology(['PAS'],['PAS'],template=Top)
+    assert len(Long.bondlist) == len(Short.bondlist) + 2 * n
+    assert len(Long.anglist) == len(Short.anglist) + 2 * n
+    bonds = [np.sqrt(np.sum((b.ainds[0].pos - b.ainds[1].pos)**2)) \
+             for b in Long.bondlist if b.ainds[0].resNo < n - 2 \
+             and b.ainds[0].name == 'BB' and b.ainds[1].name == 'BB']
+    npt.assert_almost_equal(np.array(bonds),0.35,decimal=5)
+
+def test_atomTable():
+    """
+    make sure beads become views of the array-backed table, that whole-
+    molecule transforms move them, and that packing does not change the
+    written files
+    """
+    Top = DXXXTopology('DFAG.itp','DFAG.gro')
+    unpacked = MemoryTarget()
+    Top.write('DFAG_test',unpacked)
+    table = Top.atomTable()
+    assert Top.atomTable() is table
+    assert table.pos.shape == (29,3)
+    assert Top.atomlist[3]._table is table
+    packed = MemoryTarget()
+    Top.write('DFAG_test',packed)
+    for suffix in ['.gro','.itp']:
+        assert packed.files['DFAG_test'+suffix] == \
+               unpacked.files['DFAG_test'+suffix]
+    Top.atomlist[0].pos[0] = 1.
+    assert table.pos[0,0] == 1.
+    table.pos[1,:] = [2.,3.,4.]
+    npt.assert_array_equal(Top.atomlist[1].pos,[2.,3.,4.])
+    Top.atomlist[2].name = 'LONGNAME'
+    assert table.name[2] == 'LONGNAME'
+    assert table.name[3] == 'SC1'
+    Clone = Top.clone()
+    Clone.translate([1.,0.,0.])
+    npt.assert_array_equal(Top.atomlist[1].pos,[2.,3.,4.])
+    npt.assert_array_equal(Clone.atomlist[1].pos,[3.,3.,4.])
+    center = Clone.centroid()
+    Clone.rotate(np.array([[0.,-1.,0.],[1.,0.,0.],[0.,0.,1.]]))
+    npt.assert_almost_equal(Clone.centroid(),center)
+    d = Clone.atomlist[1].pos - center
+    d0 = Top.atomlist[1].pos + np.array([1.,0.,0.]) - center
+    npt.assert_almost_equal(d,[-d0[1],d0[0],d0[2]])
+    Top.resSwap('TRP','C',2)
+    assert not table.holds(Top.atomlist)
+    assert len(Top.atomTable()) == 30
+
+def test_bulkWriters():
+    """
+    make sure a box of stacked molecules is renumbered consecutively and
+    that gro numbers wrap around at 100000
+    """
+    Top = DXXXTopology('DFAG.itp','DFAG.gro')
+    molecule = Top.atomTable()
+    box = AtomTable.concatenate([molecule,molecule.copy(),molecule.copy()])
+    assert len(box) == 87
+    assert box.number[-1] == 87
+    assert box.resNo[29] == 16
+    assert box.resNo[-1] == 45
+    npt.assert_array_equal(box.pos[58:],molecule.pos)
+    box.resNo[0] = 100002
+    box.number[0] = 100001
+    lines = Gro('box',len(box),box,Top.box).atomSection(box).split('\n')
+    assert len(lines) == 88
+    assert lines[0][:5] == '    2'
+    assert lines[0][15:20] == '    1'
+    assert lines[-2][15:20] == '   87'
+
+def test_outputTargets():
+    """
+    make sure writing to memory, compressed files, streams and archives
+    gives the same contents as writing plain files
+    """
+    import tempfile,shutil,gzip,tarfile,zipfile,io
+    tmpdir = tempfile.mkdtemp()
+    try:
+        Top = DXXXTopology('DFAG.itp','DFAG.gro')
+        Top.write(os.path.join(tmpdir,'DFAG_plain'))
+        plain = {}
+        for suffix in ['.gro','.itp','.top']:
+            plain[suffix] = open(os.path.join(tmpdir,'DFAG_plain'+suffix)).read()
+        memory = MemoryTarget()
+        Top.write('DFAG_plain',memory)
+        assert memory.names == ['DFAG_plain.gro','DFAG_plain.itp',
+                                'DFAG_plain.top']
+        for suffix in ['.gro','.itp','.top']:
+            assert memory.files['DFAG_plain'+suffix] == plain[suffix]
+        Top.write('DFAG_plain',DirectoryTarget(tmpdir,'gz'))
+        fid = gzip.open(os.path.join(tmpdir,'DFAG_plain.itp.gz'))
+        assert fid.read().decode('utf-8') == plain['.itp']
+        fid.close()
+        stream = io.BytesIO()
+        Gro('title',len(Top.atomlist),Top.atomlist,Top.box).write(stream)
+        assert stream.getvalue().decode('utf-8') == plain['.gro'].replace(
+            plain['.gro'].split('\n')[0],'title')
+        specs = [(['ALA','TRP','GLY'],True),(['PHE','PHE','PHE'],False)]
+        generateLibrary(specs,os.path.join(tmpdir,'lib'),nprocs=1)
+        for (bundle,nprocs) in [('lib.tar.gz',1),('lib.zip',2)]:
+            (names,rate) = generateLibrary(specs,'lib',nprocs=nprocs,
+                               bundle=os.path.join(tmpdir,bundle))
+            assert names == ['DAWG_sym','DFFF_asym']
+            if bundle.endswith('.zip'):
+                archive = zipfile.ZipFile(os.path.join(tmpdir,bundle))
+                read = lambda name: archive.read(name)
+            else:
+                archive = tarfile.open(os.path.join(tmpdir,bundle))
+                read = lambda name: archive.extractfile(name).read()
+            for name in names:
+                for suffix in ['.gro','.itp','.top']:
+                    ref = open(os.path.join(tmpdir,'lib',name+suffix)).read()
+                    assert read('lib/'+name+suffix).decode('utf-8') == ref
+            archive.close()
+    finally:
+        shutil.rmtree(tmpdir)
+
+def test_outputCache():
+    """
+    make sure cached chemistries are reused, that changing a template file
+    changes the key, and that the cache evicts least recently used entries
+    """
+    import tempfile,shutil
+    tmpdir = tempfile.mkdtemp()
+    try:
+        cachedir = os.path.join(tmpdir,'cache')
+        specs = [(['ALA','TRP','GLY'],True),(['PHE','PHE','PHE'],False)]
+        (names,rate) = generateLibrary(specs,os.path.join(tmpdir,'first'),
+                                       nprocs=1,cache=cachedir)
+        cache = OutputCache(cachedir)
+        assert len(cache.entries) == 2
+        (cnames,crate) = generateLibrary(specs,os.path.join(tmpdir,'second'),
+                                         nprocs=1,cache=cache)
+        assert cnames == names
+        for name in names:
+            for suffix in ['.gro','.itp','.top']:
+                check_file_equivalency(os.path.join(tmpdir,'first',name+suffix),
+                                       os.path.join(tmpdir,'second',name+suffix))
+        sources = sourceHashes()
+        assert sources == sourceHashes('DFAG.itp','DFAG.gro')
+        key = outputKey(['ALA','TRP','GLY'],True,sources)
+        assert cache.get(key) is not None
+        assert outputKey(['ALA','TRP','GLY'],False,sources) != key
+        assert outputKey(['ALA','TRP','GLY'],True,sources,
+                         placeSideChains=False) != key
+        groname = os.path.join(tmpdir,'moved.gro')
+        lines = open('DFAG.gro').readlines()
+        lines[2] = lines[2].replace('5.288','5.289')
+        fid = open(groname,'w')
+        fid.writelines(lines)
+        fid.close()
+        assert outputKey(['ALA','TRP','GLY'],True,
+                         sourceHashes('DFAG.itp',groname)) != key
+        size = cache.entries[key]
+        small = OutputCache(cachedir,maxBytes=size)
+        other = outputKey(['PHE','PHE','PHE'],False,sources)
+        assert small.get(key) is not None
+        small.put('0' * 40,[('a.gro','x' * 10)])
+        assert small.get(other) is None
+        assert small.get(key) is None
+        assert small.get('0' * 40) is not None
+        assert small.totalBytes == 10
+    finally:
+        shutil.rmtree(tmpdir)
+
+def test_sideChainPositions():
+    """
+    make sure batched side chains keep their bond lengths and point away
+    from the neighbouring backbone beads
+    """
+    ff = martini22()
+    bbPos = np.array([[0.,0.,0.],[0.,0.,0.],[1.,1.,1.]])
+    prevPos = np.array([[-0.3,0.2,0.],[-0.35,0.,0.],[np.nan,np.nan,np.nan]])
+    nextPos = np.array([[0.3,0.2,0.],[0.35,0.,0.],[1.35,1.,1.]])
+    lengths = [bond[0] for bond in ff.sidechains['TRP'][1]]
+    scpos = sideChainPositions(bbPos,prevPos,nextPos,[lengths]*3,4,
+                               [False,True,False])
+    assert scpos.shape == (3,4,3)
+    npt.assert_almost_equal(scpos[0,0],[0.,-0.3,0.])
+    npt.assert_almost_equal(np.dot(scpos[1,0],[1.,0.,0.]),0.)
+    beads = np.concatenate([bbPos[:,None,:],scpos],axis=1)
+    for ((i,j),length) in zip(ff.connectivity['TRP'][0],lengths):
+        npt.assert_almost_equal(np.sqrt(np.sum((beads[:,i] - beads[:,j])**2,
+                                               axis=1)),[length]*3)
+    Straight = PeptideTopology(['PAS'] + ['PHE'] * 20,['PHE'] * 20 + ['PAS'])
+    first = [Straight.atomlist[Straight.resAtomIndices(r)[1]].pos - \
+             Straight.bbBead(r).pos for r in [3,4]]
+    npt.assert_almost_equal(first[0],-first[1])
+    npt.assert_almost_equal(np.sqrt(np.sum(first[0]**2)),0.31)
@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+"""
+Unit tests for dimers
+"""
+import numpy as np,numpy.testing as npt
+from createMartiniModel import DXXXTopology,MemoryTarget
+from nonbonded import NonbondedModel,parseNonbonded
+from dimers import *
+
+def test_rotationMatrices():
+    """
+    make sure the quaternion grid gives proper rotations spread over the
+    rotation group
+    """
+    q = quaternionGrid(200)
+    npt.assert_allclose(np.sum(q**2,axis=1),1.)
+    rotations = rotationMatrices(q)
+    for R in rotations:
+        npt.assert_allclose(np.dot(R,R.T),np.eye(3),atol=1e-12)
+        npt.assert_almost_equal(np.linalg.det(R),1.)
+    #the grid does not bunch up: rotated x axes cover the sphere
+    npt.assert_allclose(rotations[:,:,0].mean(axis=0),0.,atol=0.05)
+    quarter = rotationMatrices([np.cos(np.pi/4),0.,0.,np.sin(np.pi/4)])[0]
+    npt.assert_allclose(np.dot(quarter,[1.,0.,0.]),[0.,1.,0.],atol=1e-12)
+    directions = sphereDirections(100)
+    npt.assert_allclose(np.sum(directions**2,axis=1),1.)
+    translations = shellTranslations(100,[0.5,1.])
+    npt.assert_allclose(np.sqrt(np.sum(translations**2,axis=1)),
+                        [0.5] * 100 + [1.] * 100)
+
+def test_scanDimers():
+    """
+    make sure accepted placements touch without overlapping, are sorted by
+    energy and score the same as NonbondedModel, and that the best ones are
+    distinct and written out
+    """
+    Top = DXXXTopology('DFAG.itp','DFAG.gro')
+    nb = parseNonbonded('martini.itp')
+    rotations = rotationMatrices(quaternionGrid(40))
+    translations = shellTranslations(20,[0.5,1.,1.5])
+    candidates = scanDimers(Top,rotations,translations,nb=nb,chunkSize=500)
+    assert 0 < len(candidates) < len(rotations) * len(translations)
+    assert np.all(np.diff(candidates.energy) >= 0.)
+    pos = Top.positions()
+    placements = placeCopies(pos,rotations,translations,
+                             candidates.rotation,candidates.translation)
+    model = NonbondedModel(Top,nb=nb)
+    for (candidate,placement) in zip(candidates[:50],placements[:50]):
+        r2 = np.sum((placement[None,:,:] - pos[:,None,:])**2,axis=2)
+        assert r2.min() >= 0.35**2
+        assert np.sum(r2 < 0.6**2) == candidate.contacts > 0
+        npt.assert_allclose(model.energy(pos,placement),
+                            (candidate.lj,candidate.coulomb))
+    npt.assert_allclose(placements.mean(axis=1),
+                        pos.mean(axis=0) + translations[candidates.translation])
+    (chosen,best) = bestDimers(Top,candidates,rotations,translations,3,0.3)
+    assert len(chosen) == 3
+    assert chosen.energy[0] == candidates.energy[0]
+    for a in range(3):
+        for b in range(a):
+            assert np.mean(np.sum((best[a] - best[b])**2,axis=1)) >= 0.09
+    target = MemoryTarget()
+    writeDimers(Top,best,'DFAG_dimer',chosen.energy,target)
+    assert target.names == ['DFAG_dimer_1.gro','DFAG_dimer_2.gro',
+                            'DFAG_dimer_3.gro']
+    lines = target.files['DFAG_dimer_2.gro'].splitlines()
+    assert int(lines[1]) == 2 * len(pos)
+    second = np.array([[float(line[20+8*d:28+8*d]) for d in range(3)]
+                       for line in lines[2+len(pos):-1]])
+    npt.assert_allclose(second,best[1],atol=6e-4)
+    dimer = np.concatenate([pos,best[1]])
+    box = np.array(lines[-1].split(),dtype=float)
+    npt.assert_allclose(box,dimer.max(axis=0) - dimer.min(axis=0) + 1.5,
+                        atol=6e-4)
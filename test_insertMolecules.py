@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+"""
+Unit tests for insertMolecules
+"""
+import warnings
+import numpy as np,numpy.testing as npt
+from createMartiniModel import DXXXTopology,MemoryTarget
+from neighbours import cellListPairs
+from insertMolecules import *
+
+def test_insertMolecules():
+    """
+    make sure copies are rigid, stay clear of each other and of existing
+    beads across the periodic boundaries, and that a full box gives up
+    """
+    Top = DXXXTopology('DFAG.itp','DFAG.gro')
+    pos = Top.positions()
+    natoms = len(pos)
+    box = [12.,10.,11.]
+    existing = np.random.RandomState(5).rand(300,3) * box
+    positions = insertMolecules(Top,60,box,existing=existing,batchSize=16)
+    assert positions.shape == (60,natoms,3)
+    template = np.sum((pos[:,None,:] - pos[None,:,:])**2,axis=2)
+    for copy in positions[::5]:
+        npt.assert_allclose(np.sum((copy[:,None,:] - copy[None,:,:])**2,
+                                   axis=2),template,atol=1e-10)
+    (i,j,d) = cellListPairs(positions.reshape(-1,3),0.4,box=box)
+    assert np.all(i // natoms == j // natoms)
+    (i,j,d) = cellListPairs(positions.reshape(-1,3),0.4,existing,box)
+    assert len(i) == 0
+    npt.assert_allclose(positions.mean(axis=(0,1)),np.array(box) / 2.,
+                        atol=1.)
+    with warnings.catch_warnings(record=True) as caught:
+        warnings.simplefilter('always')
+        crowded = insertMolecules(Top,100,[5.,5.,5.],seed=1,maxTries=300)
+    assert 0 < len(crowded) < 100
+    assert any(['Inserted only' in str(w.message) for w in caught])
+
+def test_writeBox():
+    """
+    make sure the top file counts the copies in the gro file
+    """
+    Top = DXXXTopology('DFAG.itp','DFAG.gro')
+    positions = insertMolecules(Top,20,[8.,8.,8.])
+    target = MemoryTarget()
+    writeBox(Top,positions,[8.,8.,8.],'DFAG_box',target)
+    assert sorted(target.names) == ['DFAG_box.gro','DFAG_box.itp',
+                                    'DFAG_box.top']
+    gro = target.files['DFAG_box.gro'].splitlines()
+    assert int(gro[1]) == 20 * len(Top.atomlist)
+    assert gro[-1].split() == ['8.0','8.0','8.0']
+    npt.assert_allclose([float(gro[-2][20:28]),float(gro[-2][28:36]),
+                         float(gro[-2][36:44])],positions[-1,-1],atol=6e-4)
+    top = target.files['DFAG_box.top'].splitlines()
+    assert '#include "DFAG_box.itp"' in top
+    assert top[-1].split() == [Top.moltype[0],'20']
@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+"""
+Unit tests for neighbours
+"""
+import numpy as np,numpy.testing as npt
+from neighbours import *
+
+def brutePairs(posA,cutoff,posB=None,box=None):
+    """
+    All pairs closer than cutoff from the full distance matrix
+    """
+    same = posB is None
+    if same:
+        posB = posA
+    d = posB[None,:,:] - posA[:,None,:]
+    if box is not None:
+        d -= box * np.round(d / box)
+    close = np.sum(d**2,axis=2) < cutoff**2
+    if same:
+        close = np.triu(close,1)
+    return set(zip(*np.nonzero(close)))
+
+def test_cellListPairs_open():
+    """
+    make sure the cell list finds exactly the pairs of the distance matrix,
+    within one set of points and between two
+    """
+    random = np.random.RandomState(1)
+    posA = 5. * random.rand(1500,3) - 1.
+    posB = 3. * random.rand(700,3)
+    (i,j,d) = cellListPairs(posA,0.8)
+    assert np.all(i < j)
+    assert set(zip(i,j)) == brutePairs(posA,0.8)
+    npt.assert_allclose(d,posA[j] - posA[i])
+    (i,j,d) = cellListPairs(posA,0.8,posB)
+    assert set(zip(i,j)) == brutePairs(posA,0.8,posB)
+    npt.assert_allclose(d,posB[j] - posA[i])
+
+def test_cellListPairs_periodic():
+    """
+    make sure pairs across the box edges are found once, with minimum image
+    vectors, also in boxes only two or three cells wide
+    """
+    random = np.random.RandomState(2)
+    box = np.array([4.,5.,2.1])
+    pos = box * random.rand(1000,3)
+    pos[:10] += box
+    for cutoff in [0.7,1.,1.05]:
+        (i,j,d) = cellListPairs(pos,cutoff,box=box)
+        pairs = list(zip(i,j))
+        assert len(pairs) == len(set(pairs))
+        assert set(pairs) == brutePairs(pos,cutoff,box=box)
+        assert np.all(np.abs(d) <= 0.5 * box)
+    try:
+        cellListPairs(pos,1.1,box=box)
+        assert False
+    except ValueError:
+        pass
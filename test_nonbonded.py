@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+"""
+Unit tests for nonbonded
+"""
+import os,tempfile,shutil,time
+import numpy as np,numpy.testing as npt
+from createMartiniModel import DXXXTopology
+from nonbonded import *
+
+def test_parseNonbonded():
+    """
+    make sure the matrices match the martini.itp lines and that sigma and
+    epsilon come out as the Martini interaction levels
+    """
+    nb = parseNonbonded('martini.itp')
+    assert len(nb.types) == 38
+    assert nb.types[0] == 'P5' and nb.types[-1] == 'D'
+    npt.assert_almost_equal(nb.mass[nb.index['SP1']],45.)
+    npt.assert_array_equal(nb.c6,nb.c6.T)
+    npt.assert_array_equal(nb.c12,nb.c12.T)
+    (i,j) = (nb.index['P5'],nb.index['Qa'])
+    npt.assert_almost_equal(nb.c6[i,j],0.24145)
+    npt.assert_almost_equal(nb.c12[j,i],0.26027E-02)
+    npt.assert_almost_equal(nb.sigma()[i,j],0.47,decimal=4)
+    npt.assert_almost_equal(nb.epsilon()[i,j],5.6,decimal=3)
+    d = nb.index['D']
+    assert np.all(nb.c6[d] == 0.) and np.all(nb.sigma()[d] == 0.)
+    
+def test_pairParameters():
+    """
+    make sure bead types are looked up by array indexing, with AC1 and AC2
+    standing in for C1 and C2
+    """
+    nb = parseNonbonded('martini.itp')
+    btypes = ['P5','AC1','Qa','P5']
+    inds = nb.typeIndices(btypes)
+    npt.assert_array_equal(inds,[nb.index['P5'],nb.index['C1'],
+                                 nb.index['Qa'],nb.index['P5']])
+    (c6,c12) = nb.pairParameters(btypes,['Qa','AC2'])
+    assert c6.shape == (4,2)
+    npt.assert_almost_equal(c6[0,0],nb.c6[nb.index['P5'],nb.index['Qa']])
+    npt.assert_almost_equal(c12[1,1],nb.c12[nb.index['C1'],nb.index['C2']])
+    try:
+        nb.typeIndices(['P5','XX'])
+        assert False
+    except KeyError:
+        pass
+
+def test_loadNonbonded():
+    """
+    make sure the binary cache is written, reused and refreshed when the itp
+    file changes
+    """
+    tmpdir = tempfile.mkdtemp()
+    try:
+        itpname = os.path.join(tmpdir,'martini.itp')
+        shutil.copy('martini.itp',itpname)
+        nb = loadNonbonded(itpname)
+        assert os.path.isfile(nonbondedCacheName(itpname))
+        cached = loadNonbonded(itpname)
+        assert cached.types == nb.types
+        npt.assert_array_equal(cached.c6,nb.c6)
+        npt.assert_array_equal(cached.c12,nb.c12)
+        text = open(itpname).read().replace(
+               '  P5    P5      1   0.24145E-00     0.26027E-02',
+               '  P5    P5      1   0.34145E-00     0.26027E-02')
+        fid = open(itpname,'w')
+        fid.write(text)
+        fid.close()
+        os.utime(itpname,(time.time() + 10,time.time() + 10))
+        changed = loadNonbonded(itpname)
+        npt.assert_almost_equal(changed.c6[0,0],0.34145)
+    finally:
+        shutil.rmtree(tmpdir)
+
+def test_NonbondedModel():
+    """
+    make sure batched placement scores match the pair sums over the full 
+    distance matrix, in an open and in a periodic box
+    """
+    Top = DXXXTopology('DFAG.itp','DFAG.gro')
+    Top.resSwapMany({1:('LYS','C'),2:('ASP','C'),14:('GLU','C')})
+    pos = Top.positions() - Top.centroid()
+    random = np.random.RandomState(3)
+    placements = np.array([np.dot(pos,np.linalg.qr(random.randn(3,3))[0]) + 
+                           random.randn(3) for k in range(20)])
+    for box in [None,np.array([4.,4.,5.])]:
+        model = NonbondedModel(Top,nb=parseNonbonded('martini.itp'),box=box)
+        (lj,coulomb) = model.scorePlacements(pos,placements)
+        assert np.any(coulomb != 0.)
+        for k in range(len(placements)):
+            d = placements[k][None,:,:] - pos[:,None,:]
+            if box is not None:
+                d -= box * np.round(d / box)
+            r2 = np.sum(d**2,axis=2)
+            (i,j) = np.nonzero(r2 < 1.1**2)
+            (ljRef,coulombRef) = model.pairEnergies(i,j,r2[i,j])
+            npt.assert_allclose(lj[k],ljRef.sum())
+            npt.assert_allclose(coulomb[k],coulombRef.sum())
+        npt.assert_allclose(model.energy(pos,placements[4]),
+                            (lj[4],coulomb[4]))
+    #energies go to zero at the cutoff
+    (lj,coulomb) = model.pairEnergies(np.array([0]),np.array([0]),
+                                      np.array([1.1**2]))
+    npt.assert_almost_equal(lj,0.)
+    npt.assert_almost_equal(coulomb,0.)
@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+"""
+Unit tests for relax
+"""
+import os,tempfile,shutil
+import numpy as np,numpy.testing as npt
+from createMartiniModel import *
+from relax import *
+
+def swappedTopology():
+    Top = DXXXTopology('DFAG.itp','DFAG.gro')
+    Top.resSwapMany({1:('PRO','E'),2:('TRP','E'),3:('LYS','H'),
+                     13:('TYR','C'),14:('ARG','C')})
+    return Top
+
+def test_BondedModel_forces():
+    """
+    make sure the analytic forces of every kind of term match finite 
+    differences of the energy
+    """
+    Top = swappedTopology()
+    model = BondedModel(Top)
+    for terms in [model.bonds,model.harmonicAngles,model.cosineAngles,
+                  model.periodicDihedrals,model.improperDihedrals]:
+        assert len(terms['i']) > 0
+    random = np.random.RandomState(0)
+    pos = Top.positions() + 0.02*random.randn(len(Top.atomlist),3)
+    (energy,forces) = model.energyAndForces(pos)
+    numeric = np.zeros(pos.shape)
+    h = 1e-6
+    for i in range(len(pos)):
+        for d in range(3):
+            shifted = pos.copy()
+            shifted[i,d] += h
+            up = model.energy(shifted)
+            shifted[i,d] -= 2*h
+            down = model.energy(shifted)
+            numeric[i,d] = -(up - down)/(2*h)
+    npt.assert_allclose(forces,numeric,atol=1e-3*np.abs(forces).max())
+
+def test_BondedModel_tabulated():
+    """
+    make sure the tabulated terms of the template are restrained at their
+    starting geometry, or skipped
+    """
+    Top = DXXXTopology('DFAG.itp','DFAG.gro')
+    model = BondedModel(Top)
+    assert len(model.bonds['i']) == len(Top.bondlist) + len(Top.conlist)
+    assert model.skipped == 0
+    skipped = BondedModel(Top,tabulated='skip')
+    npt.assert_almost_equal(model.energy(Top.positions()),
+                            skipped.energy(Top.positions()))
+    assert skipped.skipped == len(Top.bondlist) + len(Top.anglist)
+    assert len(skipped.bonds['i']) == len(Top.conlist)
+
+def test_relaxTopology():
+    """
+    make sure both minimizers lower the bonded energy and that the relaxed
+    coordinates end up in the topology and the gro file
+    """
+    tmpdir = tempfile.mkdtemp()
+    try:
+        for method in ['fire','steep']:
+            Top = swappedTopology()
+            model = BondedModel(Top)
+            groname = os.path.join(tmpdir,method+'.gro')
+            ((start,end),steps) = relaxTopology(Top,method,groname=groname)
+            assert end < 0.1 * start
+            npt.assert_almost_equal(model.energy(Top.positions()),
+                                    end,decimal=5)
+            lines = open(groname).readlines()[2:-1]
+            relaxed = np.array([[float(line[20+8*d:28+8*d]) 
+                                 for d in range(3)] for line in lines])
+            npt.assert_allclose(relaxed,Top.positions(),atol=6e-4)
+        Straight = PeptideTopology(['PAS'] + ['PHE'] * 10,
+                                   ['PHE'] * 10 + ['PAS'],'E')
+        assert len(BondedModel(Straight).degenerate(
+                   Straight.positions())) > 0
+        ((start,end),steps) = relaxTopology(Straight,nsteps=500)
+        assert end < start
+    finally:
+        shutil.rmtree(tmpdir)
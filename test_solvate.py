@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+"""
+Unit tests for solvate
+"""
+import numpy as np,numpy.testing as npt
+from createMartiniModel import DXXXTopology,MemoryTarget
+from neighbours import cellListPairs
+from solvate import *
+
+def test_waterLattice():
+    """
+    make sure the lattice has the density of Martini water and tiles the
+    periodic box without close contacts
+    """
+    box = np.array([5.,6.,7.])
+    water = waterLattice(box)
+    npt.assert_allclose(len(water) / np.prod(box),WATERDENSITY,rtol=0.1)
+    assert np.all(water >= 0.) and np.all(water < box)
+    (i,j,d) = cellListPairs(water,0.35,box=box)
+    assert len(i) == 0
+
+def test_solvate():
+    """
+    make sure water clears the solute, ions neutralize it and the top file
+    lists every molecule in gro order, with missing definitions supplied
+    """
+    Top = DXXXTopology('DFAG.itp','DFAG.gro')
+    Top.resSwapMany({1:('LYS','C'),2:('LYS','C'),14:('GLU','C')})
+    charge = np.sum(Top.atomTable().charge)
+    npt.assert_almost_equal(charge,1.)
+    pos = Top.positions()
+    positions = np.array([pos,pos + [0.,0.,3.]])
+    box = [10.,10.,10.]
+    system = solvate(Top,box,positions,concentration=0.1)
+    npt.assert_almost_equal(system.charge(),0.)
+    counts = dict(system.counts())
+    salt = int(np.round(0.1 * MOLARITY * 1000.))
+    assert counts['CL'] == salt + 2 and counts['NA'] == salt
+    solute = positions.reshape(-1,3)
+    for (name,beads) in system.solvent:
+        (i,j,d) = cellListPairs(beads,0.4,solute,box)
+        assert len(i) == 0
+    target = MemoryTarget()
+    system.write('solvated',target)
+    gro = target.files['solvated.gro'].splitlines()
+    assert int(gro[1]) == 2 * len(pos) + sum([len(beads) for (name,beads)
+                                              in system.solvent])
+    names = [line[10:15].strip() for line in gro[2+2*len(pos):-1]]
+    assert names == ['W'] * counts['W'] + ['NA'] * counts['NA'] + \
+                    ['CL'] * counts['CL']
+    top = target.files['solvated.top']
+    assert top.splitlines()[:3] == ['#include "martini.itp"',
+                                    '#include "solvated.itp"',
+                                    '#include "solvated_solvent.itp"']
+    molecules = [line.split() for line in 
+                 top.split('[ molecules ]')[1].splitlines()
+                 if len(line.split()) == 2]
+    assert molecules == [[Top.moltype[0],'2'],['W',str(counts['W'])],
+                         ['NA',str(counts['NA'])],['CL',str(counts['CL'])]]
+    definitions = target.files['solvated_solvent.itp']
+    assert '\nW\t\t1\n' in definitions and '\nCL\t\t1\n' in definitions
+    assert '\nNA\t\t1\n' not in definitions
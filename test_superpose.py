@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+"""
+Unit tests for superpose
+"""
+import os,tempfile,shutil
+import numpy as np,numpy.testing as npt
+from createMartiniModel import DXXXTopology,AtomTable,MemoryTarget
+from dimers import rotationMatrices,quaternionGrid
+from superpose import *
+
+def test_kabsch():
+    """
+    make sure batched superposition recovers known proper rotations, also
+    of mirrored point sets, with leading dimensions broadcasting
+    """
+    random = np.random.RandomState(4)
+    points = random.randn(12,3)
+    rotations = rotationMatrices(quaternionGrid(6))
+    shifts = random.randn(6,3)
+    moved = np.einsum('kij,nj->kni',rotations,points) + shifts[:,None,:]
+    (R,t,rmsd) = kabsch(points[None,None,:,:],moved[None,:,:,:])
+    assert R.shape == (1,6,3,3) and rmsd.shape == (1,6)
+    npt.assert_allclose(R[0],rotations,atol=1e-10)
+    npt.assert_allclose(t[0],shifts,atol=1e-10)
+    npt.assert_allclose(rmsd,0.,atol=1e-10)
+    (R,t,rmsd) = kabsch(points,points * [1.,1.,-1.])
+    npt.assert_almost_equal(np.linalg.det(R),1.)
+    assert rmsd > 0.1
+
+def test_superposeLibrary():
+    """
+    make sure swapped, moved chemistries land on every copy of a two frame
+    reference dimer, and are written out frame by frame
+    """
+    Top = DXXXTopology('DFAG.itp','DFAG.gro')
+    refPos = Top.positions().copy()
+    rotation = rotationMatrices(quaternionGrid(5))[3]
+    second = np.dot(refPos - refPos.mean(axis=0),rotation.T) + \
+             refPos.mean(axis=0) + [0.5,0.,0.]
+    frames = np.array([np.concatenate([refPos,second]),
+                       np.concatenate([refPos,second]) + [0.1,0.2,0.3]])
+    table = Top.atomTable()
+    refTable = AtomTable.concatenate([table,table])
+    assert moleculeSize(refTable) == len(refPos)
+    library = []
+    for (k,swaps) in enumerate([{1:('TRP','C')},
+                                {2:('LYS','C'),14:('GLU','C')}]):
+        Swapped = Top.clone()
+        Swapped.resSwapMany(swaps)
+        Swapped.rotate(rotationMatrices(quaternionGrid(7))[k])
+        Swapped.translate([1.,2.,3.])
+        library.append(Swapped)
+    (positions,rmsds) = superposeLibrary([Lib.atomTable() for Lib in library],
+                                         refTable,frames)
+    (anchors,keys) = anchorKeys(table)
+    assert len(anchors) == 21
+    for (Lib,pos,rmsd) in zip(library,positions,rmsds):
+        assert pos.shape == (2,2,len(Lib.atomlist),3)
+        npt.assert_allclose(rmsd,0.,atol=1e-8)
+        (inds,keys) = anchorKeys(Lib.atomTable())
+        npt.assert_allclose(pos[:,0][:,inds],frames[:,anchors],atol=1e-8)
+        npt.assert_allclose(pos[:,1][:,inds],
+                            frames[:,len(refPos)+anchors],atol=1e-8)
+    target = MemoryTarget()
+    writeSuperposed(library[0].atomTable(),positions[0],[[9.,9.,9.]] * 2,
+                    'DWAG_dimer.gro',target)
+    tmpdir = tempfile.mkdtemp()
+    try:
+        groname = os.path.join(tmpdir,'DWAG_dimer.gro')
+        fid = open(groname,'w')
+        fid.write(target.files['DWAG_dimer.gro'])
+        fid.close()
+        (written,writtenFrames,boxes,titles) = readGroFrames(groname)
+    finally:
+        shutil.rmtree(tmpdir)
+    assert writtenFrames.shape == (2,2 * len(library[0].atomlist),3)
+    npt.assert_allclose(boxes,9.)
+    npt.assert_allclose(writtenFrames,positions[0].reshape(2,-1,3),atol=6e-4)